@@ -0,0 +1,192 @@
+"""Benchmarks of the smart_cv pipeline.
+
+The LLM is replaced by stubs adding a fixed latency, so that the measures only reflect
+the orchestration of the requests (wall-clock time is dominated by LLM wait time).
+
+Usage: python misc/benchmarks.py
+"""
+
+import json
+import os
+import time
+from smart_cv.resume_parser import ContentRetriever
+from smart_cv.VectorDB import ChunkDB
+from smart_cv.cv_gen.cv_gen_base import (
+    Section,
+    mk_resume,
+    iter_resumes,
+    mk_header_section,
+    mk_list_section,
+)
+
+
+def mk_stub_chat(latency: float = 0.2, answer: dict = None):
+    """Return a chat function that waits ``latency`` seconds and answers a json."""
+    answer = answer if answer is not None else {"FullName": "John Doe"}
+
+    def stub_chat(prompt, **kwargs):
+        time.sleep(latency)
+        return json.dumps(answer)
+
+    return stub_chat
+
+
+def mk_stub_retriever(n_chunks: int = 4, *, chat=None, **kwargs):
+    """A ContentRetriever over a synthetic CV split in ``n_chunks`` chunks."""
+    cv_text = "\n".join(
+        f"Experience {i}: worked as a data engineer on Spark and Python." * 5
+        for i in range(n_chunks)
+    )
+    retriever = ContentRetriever(
+        cv_text=cv_text,
+        prompts={"FullName": "Give me the name of the candidate"},
+        stacks="",
+        json_example="",
+        **kwargs,
+    )
+    retriever.db = ChunkDB(
+        {"cv": cv_text}, chunk_size=len(cv_text) // n_chunks + 1, chunk_overlap=0
+    )
+    retriever.chat = chat or mk_stub_chat()
+    return retriever
+
+
+def bench_retrieve_content(n_chunks: int = 4, latency: float = 0.2, max_workers=(1, 4)):
+    """Compare sequential and concurrent per-chunk extraction."""
+    results = {}
+    for workers in max_workers:
+        retriever = mk_stub_retriever(
+            n_chunks, chat=mk_stub_chat(latency), max_workers=workers
+        )
+        tic = time.perf_counter()
+        retriever.retrieve_content()
+        results[workers] = time.perf_counter() - tic
+        print(
+            f"retrieve_content: {len(retriever.db.segments)} chunks, "
+            f"max_workers={workers}: {results[workers]:.2f}s"
+        )
+    return results
+
+
+def bench_aggregate_dicts(n_dicts: int = 8, latency: float = 0.2, max_workers=4):
+    """Tree-shaped aggregation of chunk results: count LLM calls and time."""
+    n_calls = []
+
+    def stub_chat(prompt, **kwargs):
+        n_calls.append(prompt)
+        time.sleep(latency)
+        return "aggregated"
+
+    retriever = mk_stub_retriever(chat=stub_chat, max_workers=max_workers)
+    dict_list = [
+        {"skills": [f"skill {i}"], "JobTitle": f"Job {i}"} for i in range(n_dicts)
+    ]
+    tic = time.perf_counter()
+    retriever.aggregate_dicts(dict_list)
+    elapsed = time.perf_counter() - tic
+    print(
+        f"aggregate_dicts: {n_dicts} dicts, {len(n_calls)} LLM calls: {elapsed:.2f}s"
+    )
+    return elapsed
+
+
+def mk_synthetic_resume(i: int, n_experiences: int = 6, n_bullets: int = 5):
+    """Sections of a synthetic resume (picklable: strings and experience tuples)."""
+    experiences = [
+        (
+            f"Company {j} - Data Engineer",
+            f"{2010 + j}-{2011 + j}",
+            [
+                f"Built <b>pipeline {k}</b> with Spark and Python for project {i}-{j}"
+                for k in range(n_bullets)
+            ],
+        )
+        for j in range(n_experiences)
+    ]
+    return mk_header_section(f"Candidate {i}", [f"candidate{i}@mail.com"]) + [
+        Section(
+            content=f"Summary of candidate {i}: " + "data engineer. " * 20,
+            header="PROFILE",
+        ),
+        Section(content=experiences, header="EXPERIENCE", kind="experience"),
+        mk_list_section([f"Skill {k}" for k in range(10)], header="SKILLS"),
+    ]
+
+
+def bench_mk_resumes(n_resumes: int = 500, max_workers=(1, None)):
+    """Pages per second of the PDF generation: one mk_resume call at a time versus
+    batches (in the current process, and on a process pool), on the doctest-sized
+    resume and on a synthetic corpus of ``n_resumes`` resumes."""
+    corpora = {
+        "doctest-sized": [
+            [Section(content="Test", header="TEST")] for _ in range(n_resumes)
+        ],
+        "synthetic": [mk_synthetic_resume(i) for i in range(n_resumes)],
+    }
+    results = {}
+    for corpus_name, section_lists in corpora.items():
+        tic = time.perf_counter()
+        for sections in section_lists:
+            mk_resume(sections, pdf_path=os.devnull)
+        loop_elapsed = time.perf_counter() - tic
+        for workers in max_workers:
+            tic = time.perf_counter()
+            n_pages = sum(
+                pages for _, pages in iter_resumes(section_lists, max_workers=workers)
+            )
+            elapsed = time.perf_counter() - tic
+            results[corpus_name, workers] = n_pages / elapsed
+            print(
+                f"iter_resumes ({corpus_name}): {n_resumes} resumes, {n_pages} pages, "
+                f"max_workers={workers or os.cpu_count()}: {n_pages / elapsed:.1f} pages/s"
+            )
+        results[corpus_name, "mk_resume"] = n_pages / loop_elapsed
+        print(
+            f"mk_resume loop ({corpus_name}): {n_pages / loop_elapsed:.1f} pages/s"
+        )
+    return results
+
+
+def bench_cvs_index(n_cvs: int = 50_000, seed: int = 0):
+    """Time to build a CvsInfoIndex of ``n_cvs`` synthetic CV contents, and to query it."""
+    import random
+    from smart_cv.cv_index import CvsInfoIndex
+
+    rng = random.Random(seed)
+    skills = [f"Skill {i}" for i in range(300)] + ["Spark", "Python", "SQL"]
+    index = CvsInfoIndex()
+    tic = time.perf_counter()
+    for i in range(n_cvs):
+        index.add(
+            f"cv_{i}.json",
+            {
+                "JobTitle": rng.choice(["Data Engineer", "Data Scientist", "Developer"]),
+                "seniority": f"{rng.randint(0, 15)} years",
+                "skills": ", ".join(rng.sample(skills, 12)),
+                "languages": rng.choice(["English (C1), French", "French", "Spanish"]),
+            },
+        )
+    print(f"CvsInfoIndex: {n_cvs} CVs indexed in {time.perf_counter() - tic:.2f}s")
+    queries = {
+        "skills=spark, seniority>5": dict(skills="spark", seniority__gt=5),
+        "skills=[spark, sql], languages=english": dict(
+            skills=["spark", "sql"], languages="english"
+        ),
+        "JobTitle contains 'data', seniority in [2, 5]": dict(
+            JobTitle__contains="data", seniority__between=(2, 5)
+        ),
+    }
+    results = {}
+    for name, conditions in queries.items():
+        tic = time.perf_counter()
+        n = len(index.query(**conditions))
+        results[name] = time.perf_counter() - tic
+        print(f"query {name}: {n} CVs in {results[name] * 1000:.2f}ms")
+    return results
+
+
+if __name__ == "__main__":
+    bench_retrieve_content()
+    bench_aggregate_dicts()
+    bench_mk_resumes()
+    bench_cvs_index()
@@ -1,11 +1,20 @@
 """VectorDB"""
 
 # VectorDB class
-from typing import Mapping, Iterable, Dict, Any
+from typing import Mapping, Iterable, Dict, Any, Callable, Sequence
 from dataclasses import dataclass, field
 from types import SimpleNamespace
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from functools import cached_property
+import re
+import os
+import json
+import importlib
+import zlib
+import mmap
+import numpy as np
+from collections import ChainMap
+from collections.abc import MutableMapping
 DocKey = str
 DocValue = str
 
@@ -20,12 +29,114 @@ def generate_split_keys(docs: dict, text_splitter: RecursiveCharacterTextSplitte
 
     return [(d.metadata["document_name"], d.metadata["start_index"], d.metadata["start_index"]+ len(d.page_content)) for d in documents]
 
+_token_pattern = re.compile(r"\w+")
+
+
+@dataclass
+class HashingEmbedder:
+    """Offline embedder: hashed bag of words and word bigrams, with sublinear term frequency.
+    Needs no fitting, so new documents can be embedded independently of the corpus.
+
+    >>> HashingEmbedder(n_features=8)(["Python and Spark", ""]).shape
+    (2, 8)
+    """
+
+    n_features: int = 2**12
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = _token_pattern.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            idx = np.fromiter(
+                (zlib.crc32(f.encode("utf-8")) % self.n_features for f in features),
+                dtype=np.int64,
+                count=len(features),
+            )
+            matrix[i] = np.log1p(np.bincount(idx, minlength=self.n_features))
+        return matrix
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of a matrix (zero rows are left as is), as contiguous float32."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k_cosine(
+    matrix: np.ndarray, query_vector: np.ndarray, k: int, exclude: Iterable[int] = ()
+) -> np.ndarray:
+    """Indices of the k rows of a row-normalized matrix most similar to the query vector,
+    by decreasing cosine similarity. Rows in ``exclude`` are never returned.
+
+    >>> m = normalize_rows(np.array([[1, 0], [0, 1], [1, 1]]))
+    >>> top_k_cosine(m, np.array([1., 0.]), 2).tolist()
+    [0, 2]
+    >>> top_k_cosine(m, np.array([1., 0.]), 2, exclude=[0]).tolist()
+    [2, 1]
+    """
+    norm = np.linalg.norm(query_vector)
+    scores = matrix @ (query_vector / norm if norm else query_vector)
+    exclude = list(exclude)
+    if exclude:
+        scores[exclude] = -np.inf
+    k = min(k, len(scores) - len(exclude))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(k)
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
 class SegmentMapping:
-    """A class to represent a mapping between segments and documents."""
+    """A class to represent a mapping between segments and documents.
+    Segment keys are stored in an append-only table (so that row indices, e.g. of embeddings,
+    stay valid): removing the segments of a document only marks their rows as removed.
+    Lookups go through hash indexes."""
     def __init__(self, docs: Mapping, segment_keys: List[SegmentKey]):
         self.docs = docs
-        self.segment_keys = segment_keys
-        self.document_keys = list(docs.keys())
+        self.table: List[SegmentKey] = []  # append-only
+        self.row_of: Dict[SegmentKey, int] = {}  # live segment key -> row
+        self.doc_rows: Dict[DocKey, List[int]] = {}  # doc key -> rows of its live segments
+        self.removed_rows = set()
+        self.extend(segment_keys)
+
+    @property
+    def document_keys(self):
+        return list(self.docs.keys())
+
+    @property
+    def segment_keys(self) -> List[SegmentKey]:
+        if not self.removed_rows:
+            return self.table
+        return [self.table[row] for row in self.alive_rows()]
+
+    def alive_rows(self) -> List[int]:
+        """Rows of the table holding live segments, in insertion order."""
+        return [row for row in range(len(self.table)) if row not in self.removed_rows]
+
+    def append(self, key: SegmentKey):
+        """Append a segment key to the table (no-op if it is already there)."""
+        if key in self.row_of:
+            return
+        row = len(self.table)
+        self.table.append(key)
+        self.row_of[key] = row
+        self.doc_rows.setdefault(key[0], []).append(row)
+
+    def extend(self, segment_keys: Iterable[SegmentKey]):
+        for key in segment_keys:
+            self.append(key)
+
+    def remove_document_segments(self, doc_key: DocKey):
+        """Mark the segments of a document as removed (the document itself is kept)."""
+        for row in self.doc_rows.pop(doc_key, []):
+            self.removed_rows.add(row)
+            del self.row_of[self.table[row]]
+
     def __iter__(self):
         yield from self.segment_keys
 
@@ -44,21 +155,23 @@ class SegmentMapping:
             return
         else:
             doc_key, start_idx, end_idx = key
-            self.segment_keys.append(key)
+            self.append(key)
             self.docs[doc_key] = self.docs.get(doc_key, '')[:start_idx] + value + self.docs.get(doc_key, '')[end_idx:]
 
     def __add__(self, other):
         """Add two SegmentMapping objects together. This will concatenate the documents and segment keys."""
-        return SegmentMapping({**self.docs, **other.docs}, self.segment_keys + other.segment_keys)
+        added = SegmentMapping({**self.docs, **other.docs}, self.segment_keys)
+        added.extend(other.segment_keys)
+        return added
     
     def __len__(self):
-        return len(self.segment_keys)
+        return len(self.row_of)
     
     def __contains__(self, key: SegmentKey):
         if isinstance(key, str):
-            return key in self.document_keys
+            return key in self.docs
         elif isinstance(key, Tuple):
-            return key in self.segment_keys
+            return key in self.row_of
         else:
             raise TypeError("Key must be a string or a tuple")
     
@@ -72,21 +185,114 @@ class SegmentMapping:
         for key in self.segment_keys:
             yield self.__getitem__(key)
 
+# Files of a saved ChunkDB
+_meta_filename = "meta.json"
+_docs_index_filename = "docs_index.npy"
+_docs_buffer_filename = "docs.bin"
+_segments_filename = "segments.npy"
+_embeddings_filename = "embeddings.npy"
+
+def _func_path(func: Callable):
+    """The "module:qualname" path of an importable function (None if it isn't).
+
+    >>> _func_path(len)
+    'builtins:len'
+    >>> _func_path(lambda s: 1) is None
+    True
+    """
+    path = f"{getattr(func, '__module__', None)}:{getattr(func, '__qualname__', None)}"
+    try:
+        return path if _import_func(path) is func else None
+    except (ImportError, AttributeError, ValueError):
+        return None
+
+
+def _import_func(path: str) -> Callable:
+    """The function of a "module:qualname" path."""
+    module, qualname = path.split(":")
+    obj = importlib.import_module(module)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+segment_dtype = np.dtype([("doc", np.int32), ("start", np.int64), ("end", np.int64)])
+
+
+class MmapDocs(MutableMapping):
+    """Documents stored as one concatenated utf-8 buffer, memory-mapped from disk.
+    A document is only decoded when accessed. Written documents are kept in memory, and
+    deleted ones are marked as such (the buffer is read-only)."""
+
+    def __init__(self, keys: List[DocKey], offsets: np.ndarray, buffer_path: str):
+        self.keys_ = list(keys)
+        self.index = {k: i for i, k in enumerate(self.keys_)}
+        self.offsets = offsets
+        self.buffer_path = buffer_path
+        self.written = {}
+        self.deleted = set()  # keys of the buffer which were deleted
+
+    @cached_property
+    def buffer(self):
+        if os.path.getsize(self.buffer_path) == 0:
+            return b""
+        with open(self.buffer_path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, k):
+        if k in self.written:
+            return self.written[k]
+        if k in self.deleted:
+            raise KeyError(k)
+        i = self.index[k]
+        return self.buffer[self.offsets[i] : self.offsets[i + 1]].decode("utf-8")
+
+    def __setitem__(self, k, v):
+        self.written[k] = v
+        self.deleted.discard(k)
+
+    def __delitem__(self, k):
+        if k not in self:
+            raise KeyError(k)
+        self.written.pop(k, None)
+        if k in self.index:
+            self.deleted.add(k)
+
+    def __iter__(self):
+        yield from (k for k in self.keys_ if k not in self.deleted)
+        yield from (k for k in self.written if k not in self.index)
+
+    def __contains__(self, k):
+        return k in self.written or (k in self.index and k not in self.deleted)
+
+    def __len__(self):
+        n_written = sum(1 for k in self.written if k not in self.index)
+        return len(self.index) - len(self.deleted) + n_written
+
+
 @dataclass
 class ChunkDB:
     """ Contains a mapping from document keys to document content. Keys can either be a tuple (doc_key, start_idx, end_idx) or a string doc_key.
     The documents are split into segments and the segments are stored in a SegmentMapping object. 
-    The SegmentMapping object is a mapping from segment keys to segments."""
+    The SegmentMapping object is a mapping from segment keys to segments.
+    chunk_size and chunk_overlap are measured with length_function (characters by default,
+    pass a token counter to get token-sized chunks).
+    The given docs aren't modified: documents added with ``add`` are written to an
+    overlay of them (except for the MmapDocs of a loaded database, which it owns)."""
     docs: Mapping[DocKey, DocValue]
     #kwargs: Dict[str, Any] = field(default_factory=dict)
     chunk_size: int = 400
     chunk_overlap: int = 100
+    length_function: Callable[[str], int] = len
+    embedder: Callable[[Sequence[str]], np.ndarray] = field(
+        default_factory=HashingEmbedder
+    )
 
     @cached_property
     def text_splitter(self):
         return RecursiveCharacterTextSplitter(chunk_size= self.chunk_size,
                                                 chunk_overlap= self.chunk_overlap,
-                                                length_function= len,
+                                                length_function= self.length_function,
                                                 add_start_index=True, # enforce the start index
                                                 is_separator_regex= False
                                                 )
@@ -95,6 +301,53 @@ class ChunkDB:
     def segments(self):
         return self.mk_segment_store(self.docs)
     
+    def __post_init__(self):
+        if not isinstance(self.docs, MmapDocs):
+            self.docs = ChainMap({}, self.docs)  # copy on write of the caller's docs
+        self._embedding_buffer = None
+        self._n_embedded = 0
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Contiguous float32 matrix of the normalized segment embeddings, one row per row of
+        the segment table. Only the segments added since the last call are embedded."""
+        table = self.segments.table
+        if self._n_embedded < len(table):
+            removed_rows = self.segments.removed_rows
+            new_texts = [
+                "" if row in removed_rows else self.segments[table[row]]
+                for row in range(self._n_embedded, len(table))
+            ]
+            self._append_embeddings(normalize_rows(self.embedder(new_texts)))
+        return self._embedding_buffer[: len(table)]
+
+    @embeddings.setter
+    def embeddings(self, embeddings: np.ndarray):
+        self._embedding_buffer = embeddings
+        self._n_embedded = len(embeddings)
+
+    def _append_embeddings(self, new_embeddings: np.ndarray):
+        """Append rows to the embedding buffer, doubling its capacity when it is full
+        (so that adding documents one by one stays linear)."""
+        n, n_needed = self._n_embedded, self._n_embedded + len(new_embeddings)
+        buffer = self._embedding_buffer
+        if (
+            buffer is None
+            or n_needed > len(buffer)
+            or not buffer.flags.writeable
+        ):
+            capacity = max(n_needed, 2 * (0 if buffer is None else len(buffer)), 16)
+            grown = np.empty((capacity, new_embeddings.shape[1]), dtype=np.float32)
+            if n:
+                grown[:n] = buffer[:n]
+            buffer = self._embedding_buffer = grown
+        buffer[n:n_needed] = new_embeddings
+        self._n_embedded = n_needed
+
+    @cached_property
+    def metadata(self) -> Dict[DocKey, dict]:
+        return {}
+
     @cached_property
     def segment_store(self):
         return SimpleNamespace(segment_keys=self.segments)
@@ -109,29 +362,130 @@ class ChunkDB:
     
     def add(self, new_documents: Mapping[DocKey, DocValue], when_exists: str = "raise"):
         """ Add new documents to the database. When_exists can be "raise", "skip" or "overwrite.
-        New documents has to be a mapping with the document key as the key and the document content as the value."""
-        
-        for new_doc_key in new_documents:
-            if new_doc_key in self.segments:
+        New documents has to be a mapping with the document key as the key and the document content as the value.
+        Only the new documents are split, their segments are appended to the segment table."""
+        segments = self.segments
+        to_split = {}
+        for new_doc_key, new_doc in new_documents.items():
+            if new_doc_key in segments:
                 if when_exists == "skip":
                     continue
                 elif when_exists == "overwrite":
-                    self.segments[new_doc_key] = new_documents[new_doc_key]
+                    segments.remove_document_segments(new_doc_key)
                 else:
                     raise ValueError(f"Document with key {new_doc_key} already exists. Use 'when_exists' to handle this case.")
-            else:
-                self.segments = self.segments + self.mk_segment_store(new_documents)
+            to_split[new_doc_key] = new_doc
+        if not to_split:
+            return
+        new_segment_keys = generate_split_keys(to_split, self.text_splitter, metadatas=[])
+        for new_doc_key, new_doc in to_split.items():
+            segments.docs[new_doc_key] = new_doc
+        segments.extend(new_segment_keys)
+
 
+    @classmethod
+    def from_segment_keys(cls, docs: Mapping[DocKey, DocValue], segment_keys: List[SegmentKey], **kwargs):
+        """Make a ChunkDB from documents already split in segments (no text splitting)."""
+        db = cls(docs, **kwargs)
+        db.segments = SegmentMapping(db.docs, segment_keys)
+        return db
 
     def mk_segment_store(self, docs):
         """ Creates and returns a segment store from a dictionary of documents. Segment store is a mapping from segment keys to segments."""
         segment_keys = generate_split_keys(docs, self.text_splitter, metadatas=[])
         return SegmentMapping(docs, segment_keys)
 
-    def search(self, query: str, k: int = 1)->Iterable[DocKey]:
-        # TODO : return (yields) the k most similar documents to the query
-        pass
-        
+    def save(self, rootdir: str):
+        """Save the database in ``rootdir``: documents as one concatenated utf-8 buffer,
+        segment keys as a structured array and embeddings as a float32 ``.npy``."""
+        os.makedirs(rootdir, exist_ok=True)
+        docs = self.segments.docs
+        doc_keys = list(docs)
+        doc_index = {k: i for i, k in enumerate(doc_keys)}
+        offsets = np.zeros(len(doc_keys) + 1, dtype=np.int64)
+        with open(os.path.join(rootdir, _docs_buffer_filename), "wb") as f:
+            for i, k in enumerate(doc_keys):
+                encoded = docs[k].encode("utf-8")
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        np.save(os.path.join(rootdir, _docs_index_filename), offsets)
+        segments = np.array(
+            [(doc_index[d], start, end) for d, start, end in self.segments],
+            dtype=segment_dtype,
+        )
+        np.save(os.path.join(rootdir, _segments_filename), segments)
+        embeddings = self.embeddings
+        if self.segments.removed_rows:
+            embeddings = embeddings[self.segments.alive_rows()]
+        np.save(
+            os.path.join(rootdir, _embeddings_filename),
+            np.asarray(embeddings, dtype=np.float32),
+        )
+        meta = dict(
+            doc_keys=doc_keys,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=_func_path(self.length_function),
+        )
+        with open(os.path.join(rootdir, _meta_filename), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(
+        cls,
+        rootdir: str,
+        embedder: Callable = None,
+        mmap_mode: str = "r",
+        length_function: Callable[[str], int] = None,
+    ):
+        """Open a database saved with ``save``. Documents and embeddings are memory-mapped,
+        so nothing is loaded in RAM until it is accessed.
+        The embedder has to be the one used to compute the saved embeddings.
+        The length_function is the saved one, unless it isn't importable (e.g. a lambda or
+        a partial), in which case it must be given."""
+        with open(os.path.join(rootdir, _meta_filename)) as f:
+            meta = json.load(f)
+        doc_keys = meta.pop("doc_keys")
+        length_function_path = meta.pop("length_function", None)
+        if length_function is None:
+            if length_function_path is None:
+                raise ValueError(
+                    f"The length_function of the ChunkDB saved in {rootdir} isn't "
+                    "importable: give it to load"
+                )
+            length_function = _import_func(length_function_path)
+        docs = MmapDocs(
+            doc_keys,
+            np.load(os.path.join(rootdir, _docs_index_filename)),
+            os.path.join(rootdir, _docs_buffer_filename),
+        )
+        kwargs = {} if embedder is None else {"embedder": embedder}
+        segments = np.load(os.path.join(rootdir, _segments_filename))
+        segment_keys = [
+            (doc_keys[d], int(start), int(end))
+            for d, start, end in segments.tolist()
+        ]
+        db = cls.from_segment_keys(
+            docs, segment_keys, **meta, length_function=length_function, **kwargs
+        )
+        db.embeddings = np.load(
+            os.path.join(rootdir, _embeddings_filename), mmap_mode=mmap_mode
+        )
+        return db
+
+    def search(self, query: str, k: int = 1) -> Iterable[SegmentKey]:
+        """Yield the keys of the k segments most similar to the query (cosine similarity of
+        their embeddings), most similar first."""
+        if len(self.segments) == 0:
+            return
+        query_vector = self.embedder([query])[0].astype(np.float32)
+        table = self.segments.table
+        for idx in top_k_cosine(
+            self.embeddings, query_vector, k, exclude=self.segments.removed_rows
+        ):
+            yield table[idx]
+
     def add_metadata(self, metadata: Mapping[DocKey, dict]):
-        # TODO : add metadata to the documents
-        pass
+        """Add (or update) metadata of the documents."""
+        for doc_key, doc_metadata in metadata.items():
+            self.metadata.setdefault(doc_key, {}).update(doc_metadata)
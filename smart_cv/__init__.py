@@ -1,11 +1,42 @@
 """
 The smart_cv package provides functionality for creating and managing smart CVs (resumes).
 
-This package contains modules for parsing and analyzing CV data, generating 
+This package contains modules for parsing and analyzing CV data, generating
 CV templates, and extracting information from CV documents.
+
+The names below are imported lazily, on first access: importing smart_cv doesn't import
+the heavy dependencies (langchain, docxtpl, reportlab, oa...), nor makes the mall.
 """
 
-from smart_cv.base import mall, CvsInfoStore, get_config
-from smart_cv.interface import cv_content, fill_template, cv_text, _mk_parser, dag_pipeline
-from smart_cv.resume_parser import ContentRetriever, TemplateFiller
-from smart_cv.cv_gen import mk_resume
+import importlib
+
+_module_of_name = {
+    "mall": "smart_cv.base",
+    "CvsInfoStore": "smart_cv.base",
+    "get_config": "smart_cv.base",
+    "cv_content": "smart_cv.interface",
+    "fill_template": "smart_cv.interface",
+    "cv_text": "smart_cv.interface",
+    "_mk_parser": "smart_cv.interface",
+    "dag_pipeline": "smart_cv.interface",
+    "render_filled_template": "smart_cv.interface",
+    "ContentRetriever": "smart_cv.resume_parser",
+    "TemplateFiller": "smart_cv.resume_parser",
+    "AsyncContentRetriever": "smart_cv.async_parser",
+    "mk_resume": "smart_cv.cv_gen",
+    "process_cvs": "smart_cv.batch",
+}
+
+__all__ = [name for name in _module_of_name if not name.startswith("_")]
+
+
+def __getattr__(name):
+    if name not in _module_of_name:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_module_of_name[name]), name)
+    globals()[name] = value  # so the next accesses don't go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_module_of_name))
@@ -0,0 +1,59 @@
+"""Asyncio variant of the extraction pipeline.
+
+The LLM requests are made through an async chat callable (``achat(prompt, **kwargs)``
+returning the answer), so that a single event loop can interleave the requests of many
+CVs without blocking a thread per request. The retrieval, language detection and
+translation are implemented once, as coroutines, in smart_cv.resume_parser: the sync
+functions run them in an event loop.
+
+>>> async def achat(prompt, **kwargs):
+...     return "The text is in french"
+>>> run_sync(adetect_language("Bonjour", ["english", "french"], achat))
+'french'
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Iterable, List
+
+from meshed import provides
+
+from smart_cv.util import run_sync, to_async
+from smart_cv.resume_parser import (
+    ContentRetriever,
+    adetect_language,
+    atranslate_content,
+)
+
+
+@dataclass
+@provides("raw_dict_content")
+class AsyncContentRetriever(ContentRetriever):
+    """ContentRetriever meant to be awaited (``await retriever.acall()``), making more
+    requests at the same time by default.
+    Args (on top of the ContentRetriever ones):
+        achat (Callable): Async chat callable. By default, the sync chat is run in threads.
+        max_workers (int): Maximum number of requests of this CV awaited at the same time.
+    """
+
+    max_workers: int = 8
+
+
+async def aparse_cvs(
+    cv_texts: Iterable[str], *, max_concurrent_cvs: int = 16, **retriever_kwargs
+) -> List[dict]:
+    """Retrieve the content of several CVs in the same event loop (in the order of
+    ``cv_texts``), at most ``max_concurrent_cvs`` CVs at a time."""
+    semaphore = asyncio.Semaphore(max_concurrent_cvs)
+
+    async def parse(cv_text):
+        async with semaphore:
+            retriever = AsyncContentRetriever(cv_text=cv_text, **retriever_kwargs)
+            return await retriever.acall()
+
+    return await asyncio.gather(*(parse(cv_text) for cv_text in cv_texts))
+
+
+def parse_cvs(cv_texts: Iterable[str], **kwargs) -> List[dict]:
+    """Sync aparse_cvs."""
+    return run_sync(aparse_cvs(cv_texts, **kwargs))
@@ -1,17 +1,17 @@
 """Base objects for the smart_cv package."""
 
 from dol import Files, add_ipython_key_completions, wrap_kvs
-from raglab.retrieval.lib_alexis import (
-    extension_based_wrap,
-    get_config as config_getter_factory,
-)
 
 from smart_cv.util import pkg_defaults, app_filepath, app_config_path, data_dir
+from smart_cv.extraction import mk_cvs_text_store
+from smart_cv.cv_index import CvsInfoIndex
 
 import json
+import os
 import pathlib
+import threading
 from i2 import AttributeMutableMapping
-from functools import partial
+from functools import partial, lru_cache
 from dol import Files
 
 # from config2py import (
@@ -23,21 +23,86 @@ from dol import Files
 @add_ipython_key_completions
 @wrap_kvs(obj_of_data=json.loads)  # TODO add reading function for Docx files
 class CvsInfoStore(Files):
-    """Get cv info dicts from folder"""
+    """Get cv info dicts from folder.
 
-    def __init__(self, rootdir, *args, **kwargs):
-        super().__init__(rootdir, *args, **kwargs)
+    The ``index`` attribute is a ``CvsInfoIndex`` of the contents, to query them all
+    (e.g. ``store.index.query(skills="spark", seniority__gt=5)``). It's loaded from
+    ``index_path`` (if given), synced with the files on first access, and then updated
+    as the store is written. Call ``save_index`` to persist it.
+    """
 
+    def __init__(self, rootdir, *args, index_path: str = None, **kwargs):
+        super().__init__(rootdir, *args, **kwargs)
+        self.index_path = index_path
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self) -> CvsInfoIndex:
+        if self._index is None:
+            if self.index_path is not None and os.path.isfile(self.index_path):
+                index = CvsInfoIndex.load(self.index_path)
+            else:
+                index = CvsInfoIndex()
+            # (self is the undecorated store, whose values are the json bytes)
+            infos = wrap_kvs(self, obj_of_data=json.loads)
+            self._index = index.sync(infos, self.rootdir)
+        return self._index
+
+    def save_index(self):
+        if self.index_path is not None and self._index is not None:
+            self._index.save(self.index_path)
+
+    def __setitem__(self, k, v):
+        super().__setitem__(k, v)
+        if self._index is not None:
+            info = json.loads(v)
+            mtime = os.path.getmtime(os.path.join(self.rootdir, k))
+            with self._index_lock:
+                self._index.add(k, info, mtime=mtime)
+
+    def __delitem__(self, k):
+        super().__delitem__(k)
+        if self._index is not None and k in self._index:
+            with self._index_lock:
+                self._index.remove(k)
+
+
+def mk_mall():
+    """Make the mall: the stores of the app's data (cvs, contents, filled templates...)"""
+    from raglab.retrieval.lib_alexis import extension_based_wrap
+
+    return AttributeMutableMapping(
+        data=extension_based_wrap(Files(app_filepath("data"))),
+        stack_mining=extension_based_wrap(
+            Files(app_filepath("data", "stacks_mining"))
+        ),
+        cvs=mk_cvs_text_store(app_filepath("data", "cvs")),  # texts are cached
+        cvs_info=CvsInfoStore(
+            app_filepath("data", "cvs_info"),
+            index_path=os.path.join(data_dir, "cvs_info_index.pkl"),
+        ),
+        filled=extension_based_wrap(Files(app_filepath("data", "filled"))),
+        configs=extension_based_wrap(Files(app_filepath("configs"))),
+        pkg_data_store=Files(data_dir),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_mall():
+    """The mall of the app, made (and the local user folders populated) on first call.
+    ``smart_cv.base.mall`` is the same object."""
+    mall = mk_mall()
+    populate_local_user_folders(default_store, mall.configs)
+    return mall
+
+
+def __getattr__(name):
+    # The mall is made on first access, so importing the package doesn't touch the disk
+    if name == "mall":
+        return get_mall()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-mall = AttributeMutableMapping(
-    data=extension_based_wrap(Files(app_filepath("data"))),
-    stack_mining=extension_based_wrap(Files(app_filepath("data", "stacks_mining"))),
-    cvs=extension_based_wrap(Files(app_filepath("data", "cvs"))),
-    cvs_info=CvsInfoStore(app_filepath("data", "cvs_info")),
-    filled=extension_based_wrap(Files(app_filepath("data", "filled"))),
-    configs=extension_based_wrap(Files(app_filepath("configs"))),
-    pkg_data_store=Files(data_dir),
-)
 
 # -----------------------------------------------------------
 # Populate what's missing in local user space
@@ -62,8 +127,6 @@ def populate_local_user_folders(defaults, local_user_folders):
     return defaults
 
 
-populate_local_user_folders(default_store, mall.configs)
-
 # copy_if_missing('config.json', mall.configs)
 # copy_if_missing('stacks_keywords.txt', mall.config)
 # copy_if_missing('json_example.txt', mall.configs)
@@ -87,7 +150,7 @@ from smart_cv.util import data_dir
 # }
 
 config_sources = [
-    mall.configs.rootdir,  # user local configs
+    # mall.configs.rootdir,  # user local configs
     # json.loads(mall.configs['config.json']),  # package config.json
     # json.loads(pathlib.Path(app_config_path).read_text()),  # package config.json
     # pkg_defaults,  # package defaults
@@ -102,5 +165,9 @@ dflt_stacks = []
 # dflt_json_example = mall.configs["json_example.txt"]
 dflt_json_example = {}
 
+
 # a config getter, enhanced by the user_gettable store
-get_config = partial(config_getter_factory, sources=[mall.configs])
+def get_config(*args, **kwargs):
+    from raglab.retrieval.lib_alexis import get_config as config_getter_factory
+
+    return config_getter_factory(*args, sources=[get_mall().configs], **kwargs)
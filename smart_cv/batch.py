@@ -0,0 +1,248 @@
+"""Batch processing of CVs: fan the single-CV pipeline out over a thread pool.
+
+Results are written to ``mall.cvs_info`` (json content) and ``mall.filled`` (filled
+template) as soon as each CV is done, and CVs which already have both outputs are
+skipped. Processing a CV is mostly waiting for the LLM, hence the threads.
+"""
+
+import hashlib
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Mapping, Union
+
+from dol import Files
+
+from smart_cv.base import get_mall
+from smart_cv.instrumentation import event_labels, timed_event
+from smart_cv.interface import (
+    _mk_parser,
+    _has_content_labelling,
+    _label_empty_content,
+    _translate_content,
+    fill_template,
+)
+from smart_cv.resume_parser import bytes_content
+from smart_cv.util import filled_dir
+
+
+@dataclass
+class CvResult:
+    """Outcome of the processing of one CV."""
+
+    cv_name: str
+    content: dict = None
+    filled_path: str = None
+    stage_timings: dict = field(default_factory=dict)
+    skipped: bool = False
+    error: Exception = None
+
+
+@dataclass
+class BatchReport:
+    """Summary of a batch run: counts, throughput and per-stage timings."""
+
+    results: list
+    elapsed: float
+
+    @property
+    def processed(self):
+        return [r for r in self.results if not r.skipped and r.error is None]
+
+    @property
+    def skipped(self):
+        return [r for r in self.results if r.skipped]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if r.error is not None]
+
+    @property
+    def throughput(self):
+        """Processed CVs per minute."""
+        return 60 * len(self.processed) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def stage_timings(self):
+        """Total and mean time (in seconds) spent in each stage, over processed CVs."""
+        totals = defaultdict(float)
+        for r in self.processed:
+            for stage, t in r.stage_timings.items():
+                totals[stage] += t
+        n = len(self.processed) or 1
+        return {stage: {"total": t, "mean": t / n} for stage, t in totals.items()}
+
+    def summary(self):
+        lines = [
+            f"{len(self.processed)} processed, {len(self.skipped)} skipped, "
+            f"{len(self.failed)} failed in {self.elapsed:.1f}s "
+            f"({self.throughput:.1f} CVs/min)"
+        ]
+        for stage, t in self.stage_timings.items():
+            lines.append(f"  {stage}: {t['total']:.1f}s total, {t['mean']:.2f}s mean")
+        for r in self.failed:
+            lines.append(f"  FAILED {r.cv_name}: {r.error!r}")
+        return "\n".join(lines)
+
+
+def _cv_stem(cv_name: str):
+    return cv_name.split(".")[0]
+
+
+def info_key(cv_name: str):
+    """Key of the content of a CV in ``mall.cvs_info``."""
+    return f"{_cv_stem(cv_name)}.json"
+
+
+def filled_key(cv_name: str):
+    """Key of the filled template of a CV in ``mall.filled`` (as named by fill_template)."""
+    return f"{_cv_stem(cv_name)}_filled.docx"
+
+
+def filled_store_of(save_to: str) -> Mapping:
+    """The store of the filled templates that fill_template writes in the save_to folder
+    (None if they aren't saved per CV: no save_to, or a single .docx file path)."""
+    if save_to is None or save_to.endswith("docx"):
+        return None
+    os.makedirs(save_to, exist_ok=True)
+    return Files(save_to)
+
+
+def _named_cvs(cvs: Union[Iterable[str], Mapping[str, str]], cvs_store: Mapping):
+    """Yield (cv_name, cv_text) pairs. Items of an iterable are names of ``cvs_store``
+    (``mall.cvs`` by default) or raw CV texts (named after their hash). Texts are read
+    lazily, in the worker threads."""
+    if isinstance(cvs, Mapping):
+        for name, text in cvs.items():
+            yield name, (lambda text=text: text)
+        return
+    cvs_store = get_mall().cvs if cvs_store is None else cvs_store
+    for item in cvs:
+        if item in cvs_store:
+            yield item, (lambda item=item: cvs_store[item])
+        else:
+            name = "cv_" + hashlib.sha1(item.encode("utf-8")).hexdigest()[:12]
+            yield name, (lambda item=item: item)
+
+
+def process_cv(
+    cv_name: str,
+    get_text,
+    *,
+    language: str = "automatic",
+    info_store: Mapping = None,
+    save_to: str = filled_dir,
+    **parser_kwargs,
+) -> CvResult:
+    """Run the pipeline on one CV, timing every stage, and store its outputs."""
+    info_store = get_mall().cvs_info if info_store is None else info_store
+    result = CvResult(cv_name)
+    timings = result.stage_timings
+
+    def timed(stage, func, *args, **kwargs):
+        tic = time.perf_counter()
+        with timed_event("batch_stage", stage=stage):
+            out = func(*args, **kwargs)
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - tic
+        return out
+
+    with event_labels(cv=cv_name):  # labels the events of the CV
+        try:
+            text = timed("cv_text", get_text)
+            content = timed("extraction", _mk_parser, text, **parser_kwargs)
+            if not isinstance(content, dict):
+                raise ValueError(f"Extraction failed: {content!r}")
+            content = timed("labelling", _has_content_labelling, content)
+            content = timed("labelling", _label_empty_content, content)
+            content = timed("translation", _translate_content, content, text, language)
+            info_store[info_key(cv_name)] = timed("saving", bytes_content, content)
+            result.filled_path = timed(
+                "fill_template", fill_template, content, cv_name, save_to=save_to
+            )
+            result.content = content
+        except Exception as e:
+            result.error = e
+    return result
+
+
+def iter_process_cvs(
+    cvs: Union[Iterable[str], Mapping[str, str]],
+    *,
+    max_workers: int = 4,
+    skip_existing: bool = True,
+    cvs_store: Mapping = None,
+    info_store: Mapping = None,
+    filled_store: Mapping = None,
+    **process_kwargs,
+) -> Iterator[CvResult]:
+    """Process CVs concurrently, yielding each CvResult as soon as the CV is done.
+
+    Args:
+        cvs: names of CVs in ``cvs_store`` or raw CV texts, or a mapping name -> text.
+        max_workers: maximum number of CVs processed at the same time.
+        skip_existing: skip CVs that already have their content and filled template.
+        filled_store: where to look for the existing filled templates (by default, the
+            ``save_to`` folder of ``process_kwargs``, where the new ones are written).
+        process_kwargs: passed on to ``process_cv`` (language, save_to, parser arguments
+            such as ``cache``).
+    """
+    info_store = get_mall().cvs_info if info_store is None else info_store
+    if filled_store is None:
+        filled_store = filled_store_of(process_kwargs.get("save_to", filled_dir))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for cv_name, get_text in _named_cvs(cvs, cvs_store):
+            if (
+                skip_existing
+                and info_key(cv_name) in info_store
+                and (filled_store is None or filled_key(cv_name) in filled_store)
+            ):
+                yield CvResult(cv_name, skipped=True)
+                continue
+            futures.append(
+                executor.submit(
+                    process_cv,
+                    cv_name,
+                    get_text,
+                    info_store=info_store,
+                    **process_kwargs,
+                )
+            )
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def process_cvs(
+    cvs: Union[Iterable[str], Mapping[str, str]] = None,
+    *,
+    max_workers: int = 4,
+    skip_existing: bool = True,
+    verbose: bool = True,
+    **process_kwargs,
+) -> BatchReport:
+    """Process CVs concurrently (all the CVs of ``mall.cvs`` by default) and report
+    throughput and per-stage timings. See ``iter_process_cvs`` for the arguments."""
+    if cvs is None:
+        cvs_store = process_kwargs.get("cvs_store")
+        cvs = list(get_mall().cvs if cvs_store is None else cvs_store)
+    tic = time.perf_counter()
+    results = []
+    for result in iter_process_cvs(
+        cvs, max_workers=max_workers, skip_existing=skip_existing, **process_kwargs
+    ):
+        results.append(result)
+        if verbose and not result.skipped:
+            status = "failed" if result.error is not None else "done"
+            print(f"{result.cv_name}: {status}")
+    report = BatchReport(results, elapsed=time.perf_counter() - tic)
+    info_store = process_kwargs.get("info_store")
+    if info_store is None:
+        info_store = get_mall().cvs_info
+    if hasattr(info_store, "save_index"):
+        info_store.save_index()  # persist the index updated by the new contents
+    if verbose:
+        print(report.summary())
+    return report
@@ -0,0 +1,420 @@
+"""Content-addressed cache for LLM responses.
+
+A chat response is stored under a hash of the prompt, the model, the temperature and
+the other chat parameters, so reprocessing the same CV with the same settings costs no
+API call. The default cache has an in-memory LRU tier and an on-disk tier stored in
+the app data folder. The on-disk tiers of the app's default caches (which hold CV
+contents) can be turned off with ``set_disk_persistence(False)``, or by setting the
+``SMART_CV_DISK_CACHE`` environment variable to 0. A failing disk write (read-only or
+full filesystem) is logged, and the cache carries on in memory.
+
+>>> calls = []
+>>> def chat(prompt, **kwargs):
+...     calls.append(prompt)
+...     return prompt.upper()
+>>> cache = TieredCache(LRUCache(maxsize=10), {})
+>>> cached = cached_chat(chat, cache=cache)
+>>> cached("hello", temperature=0), cached("hello", temperature=0.0)
+('HELLO', 'HELLO')
+>>> len(calls), cache.stats
+(1, {'memory_hits': 1, 'disk_hits': 0, 'misses': 1})
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from functools import partial, wraps
+from typing import Callable, Optional
+
+from smart_cv.util import llm_cache_dir
+
+logger = logging.getLogger(__name__)
+
+DFLT_MEMORY_MAXSIZE = 1024
+DFLT_DISK_MAX_BYTES = 200 * 1024 * 1024
+
+# Whether the default caches of the app are persisted on disk (see set_disk_persistence)
+_disk_persistence = os.environ.get("SMART_CV_DISK_CACHE", "1") != "0"
+
+
+def set_disk_persistence(enabled: bool):
+    """Turn on or off the on-disk storage of the app's default caches (LLM responses,
+    translation memory, checkpoints, extracted texts). They contain CV contents: when
+    off, nothing is read from or written to their folders, and only the in-memory tiers
+    are used."""
+    global _disk_persistence
+    _disk_persistence = bool(enabled)
+
+
+def disk_persistence_is_on() -> bool:
+    return _disk_persistence
+
+
+def chat_cache_key(
+    prompt: str,
+    *,
+    model: str = None,
+    temperature=None,
+    kind: str = "chat",
+    **chat_kwargs,
+):
+    """Hash of a chat request: prompt, model, temperature, kind of chat (``chat`` or
+    ``stream``) and other chat parameters.
+
+    >>> chat_cache_key("hi", temperature=0) == chat_cache_key("hi", temperature=0.0)
+    True
+    >>> chat_cache_key("hi", model="gpt-4") == chat_cache_key("hi", model="gpt-3.5-turbo")
+    False
+    >>> chat_cache_key("hi", kind="chat") == chat_cache_key("hi", kind="stream")
+    False
+    """
+    if temperature is not None:
+        temperature = float(temperature)
+    request = dict(
+        prompt=prompt, model=model, temperature=temperature, kind=kind, **chat_kwargs
+    )
+    request_str = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(request_str.encode("utf-8")).hexdigest()
+
+
+def default_model(chat: Callable) -> Optional[str]:
+    """The model a chat uses when it's called without one: the model bound by a partial,
+    the default of its ``model`` parameter, or the ``DFLT_MODEL`` (or ``DFLT_ENGINE``) of
+    its module. None if it can't be found.
+
+    >>> def chat(prompt, *, model="gpt-4o", **kwargs):
+    ...     return prompt
+    >>> default_model(chat), default_model(partial(chat, model="gpt-4"))
+    ('gpt-4o', 'gpt-4')
+    """
+    func = inspect.unwrap(chat)
+    while isinstance(func, partial):
+        if isinstance(func.keywords.get("model"), str):
+            return func.keywords["model"]
+        func = inspect.unwrap(func.func)
+    try:
+        default = inspect.signature(func).parameters["model"].default
+    except (KeyError, TypeError, ValueError):
+        default = None
+    if isinstance(default, str):
+        return default
+    module = sys.modules.get(getattr(func, "__module__", None) or "")
+    for name in ("DFLT_MODEL", "DFLT_ENGINE"):
+        if isinstance(getattr(module, name, None), str):
+            return getattr(module, name)
+    return None
+
+
+def _request_key(prompt, chat_kwargs, dflt_model, kind):
+    """Cache key of a request, with the model the chat actually uses."""
+    model = chat_kwargs.get("model") or dflt_model
+    return chat_cache_key(prompt, **dict(chat_kwargs, model=model, kind=kind))
+
+
+class LRUCache(MutableMapping):
+    """In-memory mapping keeping at most ``maxsize`` items, least recently used first out.
+
+    >>> c = LRUCache(maxsize=2)
+    >>> c["a"], c["b"] = 1, 2
+    >>> _ = c["a"]
+    >>> c["c"] = 3
+    >>> sorted(c)
+    ['a', 'c']
+    """
+
+    def __init__(self, maxsize: int = DFLT_MEMORY_MAXSIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, k):
+        with self._lock:
+            v = self._data[k]
+            self._data.move_to_end(k)
+            return v
+
+    def __setitem__(self, k, v):
+        with self._lock:
+            self._data[k] = v
+            self._data.move_to_end(k)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __delitem__(self, k):
+        with self._lock:
+            del self._data[k]
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache(MutableMapping):
+    """Text values stored in files of ``rootdir``, one file per key.
+    When the total size exceeds ``max_bytes``, the least recently used files are removed.
+    The folder is created on the first write. If a write fails (e.g. read-only
+    filesystem), the error is logged and the cache stops writing (``writable`` is False).
+    """
+
+    def __init__(self, rootdir: str, max_bytes: int = DFLT_DISK_MAX_BYTES):
+        self.rootdir = rootdir
+        self.max_bytes = max_bytes
+        self.writable = True
+        self._lock = threading.Lock()
+        self._total_bytes = None  # computed on the first write
+
+    def _filepath(self, k):
+        return os.path.join(self.rootdir, k)
+
+    def _iter_keys(self):
+        try:
+            names = os.listdir(self.rootdir)
+        except FileNotFoundError:
+            names = []
+        return (
+            name
+            for name in names
+            if not name.endswith(".tmp") and os.path.isfile(self._filepath(name))
+        )
+
+    def __getitem__(self, k):
+        filepath = self._filepath(k)
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                v = f.read()
+        except (OSError, UnicodeDecodeError):  # missing, or unreadable: a miss
+            raise KeyError(k)
+        try:
+            os.utime(filepath)  # mark as recently used
+        except OSError:
+            pass
+        return v
+
+    def __setitem__(self, k, v):
+        if not self.writable:
+            return
+        try:
+            with self._lock:
+                self._write(k, v)
+        except OSError as e:
+            self.writable = False
+            logger.warning(
+                f"Could not write to {self.rootdir} ({e!r}): "
+                "the cache is no longer persisted on disk"
+            )
+
+    def _write(self, k, v):
+        filepath = self._filepath(k)
+        if self._total_bytes is None:
+            os.makedirs(self.rootdir, exist_ok=True)
+            self._total_bytes = sum(
+                os.path.getsize(self._filepath(name)) for name in self._iter_keys()
+            )
+        if os.path.isfile(filepath):
+            self._total_bytes -= os.path.getsize(filepath)
+        tmp_filepath = f"{filepath}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_filepath, "w", encoding="utf-8") as f:
+                f.write(v)
+            os.replace(tmp_filepath, filepath)  # never read half written
+        finally:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+        self._total_bytes += os.path.getsize(filepath)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        by_last_use = sorted(
+            self._iter_keys(), key=lambda k: os.path.getmtime(self._filepath(k))
+        )
+        for k in by_last_use:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                size = os.path.getsize(self._filepath(k))
+                os.remove(self._filepath(k))
+            except FileNotFoundError:  # removed by another process
+                continue
+            self._total_bytes -= size
+
+    def __contains__(self, k):
+        return os.path.isfile(self._filepath(k))
+
+    def __delitem__(self, k):
+        filepath = self._filepath(k)
+        if not os.path.isfile(filepath):
+            raise KeyError(k)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= os.path.getsize(filepath)
+            os.remove(filepath)
+
+    def __iter__(self):
+        return self._iter_keys()
+
+    def __len__(self):
+        return sum(1 for _ in self._iter_keys())
+
+
+class AppDiskCache(DiskCache):
+    """A ``DiskCache`` of one of the app's default caches: it holds nothing (no read, no
+    write) while the disk persistence is off (see ``set_disk_persistence``).
+
+    >>> import tempfile
+    >>> cache = AppDiskCache(tempfile.mkdtemp())
+    >>> set_disk_persistence(False)
+    >>> cache["k"] = "v"
+    >>> "k" in cache, len(cache)
+    (False, 0)
+    >>> set_disk_persistence(True)
+    >>> cache["k"] = "v"
+    >>> cache["k"]
+    'v'
+    """
+
+    def __getitem__(self, k):
+        if not _disk_persistence:
+            raise KeyError(k)
+        return super().__getitem__(k)
+
+    def __setitem__(self, k, v):
+        if _disk_persistence:
+            super().__setitem__(k, v)
+
+    def __contains__(self, k):
+        return _disk_persistence and super().__contains__(k)
+
+    def _iter_keys(self):
+        return super()._iter_keys() if _disk_persistence else iter(())
+
+
+class TieredCache(MutableMapping):
+    """A memory tier in front of a persistent tier, with hit and miss counters.
+    Both tiers can be any mutable mapping."""
+
+    def __init__(self, memory: MutableMapping = None, disk: MutableMapping = None):
+        self.memory = memory if memory is not None else LRUCache()
+        self.disk = disk if disk is not None else {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def __getitem__(self, k):
+        try:
+            v = self.memory[k]
+            self.stats["memory_hits"] += 1
+            return v
+        except KeyError:
+            pass
+        try:
+            v = self.memory[k] = self.disk[k]
+            self.stats["disk_hits"] += 1
+            return v
+        except KeyError:
+            self.stats["misses"] += 1
+            raise
+
+    def __contains__(self, k):
+        return k in self.memory or k in self.disk
+
+    def __setitem__(self, k, v):
+        self.memory[k] = v
+        self.disk[k] = v
+
+    def __delitem__(self, k):
+        self.memory.pop(k, None)
+        del self.disk[k]
+
+    def __iter__(self):
+        return iter(self.disk)
+
+    def __len__(self):
+        return len(self.disk)
+
+
+_dflt_llm_cache = None
+
+
+def get_dflt_llm_cache() -> TieredCache:
+    """The cache shared by the whole app, persisted in ``llm_cache_dir`` (unless the disk
+    persistence is off)."""
+    global _dflt_llm_cache
+    if _dflt_llm_cache is None:
+        _dflt_llm_cache = TieredCache(LRUCache(), AppDiskCache(llm_cache_dir))
+    return _dflt_llm_cache
+
+
+def cached_chat(chat: Callable, cache: Optional[MutableMapping] = None) -> Callable:
+    """Wrap a chat function so its responses are looked up in (and stored to) ``cache``.
+    If no cache is given, the default app cache is used. The keys include the default
+    model of the chat (see ``default_model``), so changing it doesn't serve stale answers."""
+    if cache is None:
+        cache = get_dflt_llm_cache()
+    dflt_model = default_model(chat)
+
+    @wraps(chat)
+    def _cached_chat(prompt, **chat_kwargs):
+        key = _request_key(prompt, chat_kwargs, dflt_model, "chat")
+        try:
+            return cache[key]
+        except KeyError:
+            response = chat(prompt, **chat_kwargs)
+            cache[key] = response
+            return response
+
+    _cached_chat.cache = cache
+    return _cached_chat
+
+
+def cached_achat(achat: Callable, cache: Optional[MutableMapping] = None) -> Callable:
+    """Async version of ``cached_chat``, for chat coroutine functions."""
+    if cache is None:
+        cache = get_dflt_llm_cache()
+    dflt_model = default_model(achat)
+
+    @wraps(achat)
+    async def _cached_achat(prompt, **chat_kwargs):
+        key = _request_key(prompt, chat_kwargs, dflt_model, "chat")
+        try:
+            return cache[key]
+        except KeyError:
+            response = await achat(prompt, **chat_kwargs)
+            cache[key] = response
+            return response
+
+    _cached_achat.cache = cache
+    return _cached_achat
+
+
+def cached_stream_chat(
+    stream_chat: Callable, cache: Optional[MutableMapping] = None
+) -> Callable:
+    """Version of ``cached_chat`` for streaming chats (yielding pieces of the answer).
+    A cached answer is yielded in one piece; a new one is stored once fully streamed."""
+    if cache is None:
+        cache = get_dflt_llm_cache()
+    dflt_model = default_model(stream_chat)
+
+    @wraps(stream_chat)
+    def _cached_stream_chat(prompt, **chat_kwargs):
+        key = _request_key(prompt, chat_kwargs, dflt_model, "stream")
+        try:
+            yield cache[key]
+            return
+        except KeyError:
+            pass
+        pieces = []
+        for piece in stream_chat(prompt, **chat_kwargs):
+            pieces.append(piece)
+            yield piece
+        cache[key] = "".join(pieces)
+
+    _cached_stream_chat.cache = cache
+    return _cached_stream_chat
@@ -0,0 +1,136 @@
+"""On-disk checkpoints of the outputs of pipeline stages.
+
+The output of a checkpointed stage is stored under a hash of the stage name, its
+arguments and the config it depends on. Rerunning the pipeline on the same CV with the
+same settings then reads the expensive stages (LLM extraction, translation) back from
+disk, and resumes from the first stage that has no valid checkpoint (e.g. after a
+failure, or a change of template). Checkpoints are an optimization: a checkpoint that
+can't be read or written (read-only filesystem, corrupted file) is skipped, never
+failing the stage. The default store holds CV contents: it follows
+``smart_cv.cache.set_disk_persistence``.
+
+>>> calls = []
+>>> def extract(cv_text, temperature=0):
+...     calls.append(cv_text)
+...     return {"name": cv_text.split()[0]}
+>>> store = {}
+>>> extract = checkpointed(extract, store=store)
+>>> extract("Alice Smith"), extract("Alice Smith", temperature=0)
+({'name': 'Alice'}, {'name': 'Alice'})
+>>> extract("Alice Smith", temperature=0.5) == {'name': 'Alice'}
+True
+>>> len(calls), len(store)
+(2, 2)
+
+A checkpoint that can't be written doesn't fail the stage:
+
+>>> class ReadOnlyStore(dict):
+...     def __setitem__(self, k, v):
+...         raise PermissionError("read-only filesystem")
+>>> checkpointed(lambda cv_text: cv_text.upper(), "upper", ReadOnlyStore())("Bob")
+'BOB'
+"""
+
+import hashlib
+import json
+import inspect
+import logging
+from collections.abc import MutableMapping
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from smart_cv.cache import AppDiskCache
+from smart_cv.util import checkpoints_dir
+
+logger = logging.getLogger(__name__)
+
+DFLT_CHECKPOINTS_MAX_BYTES = 500 * 1024 * 1024
+
+
+def _key_default(obj):
+    """JSON fallback for the arguments of a stage: functions are identified by name."""
+    if callable(obj):
+        func = getattr(obj, "func", obj)  # functools.partial
+        return f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', '')}"
+    return repr(obj)
+
+
+def stage_key(stage: str, arguments: dict, config=None) -> str:
+    """Hash of a stage call: the stage name, its arguments and the config.
+
+    >>> stage_key("f", {"x": 1}) == stage_key("f", {"x": 1})
+    True
+    >>> stage_key("f", {"x": 1}) == stage_key("f", {"x": 1}, config={"prompts": {}})
+    False
+    """
+    request = dict(stage=stage, arguments=arguments, config=config)
+    request_str = json.dumps(request, sort_keys=True, default=_key_default)
+    return hashlib.sha256(request_str.encode("utf-8")).hexdigest()
+
+
+_dflt_checkpoints = None
+
+
+def get_dflt_checkpoints() -> AppDiskCache:
+    """The checkpoints store shared by the whole app, persisted in ``checkpoints_dir``
+    (unless the disk persistence is off)."""
+    global _dflt_checkpoints
+    if _dflt_checkpoints is None:
+        _dflt_checkpoints = AppDiskCache(
+            checkpoints_dir, max_bytes=DFLT_CHECKPOINTS_MAX_BYTES
+        )
+    return _dflt_checkpoints
+
+
+def checkpointed(
+    func: Callable,
+    stage: str = None,
+    store: Optional[MutableMapping] = None,
+    *,
+    config: Callable = None,
+    ignore: Iterable[str] = (),
+    on_hit: Callable = None,
+) -> Callable:
+    """Wrap ``func`` so its (json-serializable) output is stored in, and read back from,
+    ``store``. The wrapper keeps the signature of ``func``, so it can be used in a DAG.
+
+    :param stage: Name of the stage, used in the key (defaults to the name of ``func``)
+    :param store: Mapping of checkpoints (defaults to the app's checkpoints folder)
+    :param config: Function returning the (json-serializable) config the output depends on
+    :param ignore: Names of the arguments that don't change the output (e.g. callbacks)
+    :param on_hit: Called with the output and the arguments when a checkpoint is used
+    """
+    if store is None:
+        store = get_dflt_checkpoints()
+    sig = inspect.signature(func)
+    stage = stage or getattr(func, "__name__", None) or func.func.__name__  # partial
+    ignore = set(ignore)
+
+    @wraps(func)
+    def _checkpointed(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {k: v for k, v in bound.arguments.items() if k not in ignore}
+        key = stage_key(stage, arguments, config() if config else None)
+        try:
+            output = json.loads(store[key])
+        except KeyError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the {stage} checkpoint ({e!r}), skipping it")
+        else:
+            if on_hit is not None:
+                on_hit(output, bound.arguments)
+            return output
+        output = func(*args, **kwargs)
+        try:
+            store[key] = json.dumps(output)
+        except TypeError:  # not json-serializable: no checkpoint for this output
+            pass
+        except OSError as e:
+            logger.warning(f"Could not write the {stage} checkpoint ({e!r})")
+        return output
+
+    _checkpointed.__name__ = _checkpointed.__qualname__ = stage
+    _checkpointed.checkpoints = store
+    return _checkpointed
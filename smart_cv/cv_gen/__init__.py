@@ -1,4 +1,4 @@
 """Generate Resumes"""
 
-from smart_cv.cv_gen.cv_gen_base import mk_resume
+from smart_cv.cv_gen.cv_gen_base import mk_resume, mk_resumes, iter_resumes
 
@@ -5,7 +5,9 @@ import os
 from dataclasses import dataclass, field
 from typing import Any, Iterable, Optional, Union, Callable
 from pathlib import Path
-from functools import wraps
+from functools import wraps, lru_cache
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import (
@@ -136,6 +138,13 @@ def _make_styles(
     return styles
 
 
+@lru_cache(maxsize=16)
+def _shared_styles(**style_kwargs):
+    """The styles made by ``_make_styles``, built once per set of arguments (and process).
+    They are shared by all the resumes: they must not be modified (copy them instead)."""
+    return _make_styles(**style_kwargs)
+
+
 def _render_section_content(
     content: Any, styles: dict, *, link_color: str = '#2056a5'
 ) -> list[Flowable]:
@@ -226,6 +235,7 @@ def mk_experience_section(
     header: str = "EXPERIENCE",
     link_color: str = '#2056a5',
     item_spacing: int = 4,
+    styles: dict = None,
 ) -> Section:
     """
     Create an experience section from a list of experience tuples.
@@ -234,13 +244,14 @@ def mk_experience_section(
         experiences: List of (title, dates, bullet_points) tuples
         header: Section header
         link_color: Color for links
+        styles: Styles to use (default: the shared styles)
 
     >>> exp = [("Company - Role", "2020-2023", ["Did stuff", "Made things"])]
     >>> section = mk_experience_section(exp)
     >>> section.header
     'EXPERIENCE'
     """
-    styles = _make_styles(link_color=link_color)
+    styles = styles or _shared_styles(link_color=link_color)
     flowables = []
 
     from .cv_gen_base import PAGE_BREAK  # Ensure PAGE_BREAK is in scope if needed
@@ -317,10 +328,15 @@ def mk_header_section(
     return [name_section] + contact_sections
 
 
-def mk_resume(
+def _is_raw_experience(item) -> bool:
+    """True for a (title, dates, bullets) experience tuple (or a PAGE_BREAK)."""
+    return item is PAGE_BREAK or (isinstance(item, (tuple, list)) and len(item) == 3)
+
+
+def _build_resume(
     sections: Iterable[Union[Section, Any]],
+    pdf_file,
     *,
-    pdf_path: str = "resume.pdf",
     page_size=letter,
     margins: dict = None,
     link_color: str = '#2056a5',
@@ -328,36 +344,16 @@ def mk_resume(
     style_overrides: dict = None,
     section_spacing: int = 12,
     experience_item_spacing: int = 6,
-) -> str:
-    """
-    Generate a resume PDF from sections.
-
-    Args:
-        sections: Iterable of Section objects or PAGE_BREAK sentinel
-        pdf_path: Path where PDF will be saved
-        page_size: Page size (default: letter)
-        margins: Dict with keys 'right', 'left', 'top', 'bottom'
-        link_color: Color for hyperlinks
-        page_breaks_before: List of section IDs to insert page breaks before
-        style_overrides: Dict of style customizations
-
-    Returns:
-        Path to the generated PDF
-
-    >>> sections = [Section(content="Test", header="TEST")]
-    >>> path = mk_resume(sections, pdf_path="/tmp/test.pdf")
-    >>> Path(path).exists()
-    True
-    """
+) -> int:
+    """Build the resume PDF into ``pdf_file`` (a path or a binary file-like object).
+    Returns the number of pages."""
     # Default margins
     if margins is None:
         margins = {'right': 50, 'left': 50, 'top': 50, 'bottom': 50}
 
-    pdf_path = os.path.expanduser(pdf_path)
-
     # Create document
     doc = SimpleDocTemplate(
-        pdf_path,
+        pdf_file,
         pagesize=page_size,
         rightMargin=margins.get('right', 50),
         leftMargin=margins.get('left', 50),
@@ -365,15 +361,15 @@ def mk_resume(
         bottomMargin=margins.get('bottom', 50),
     )
 
-    # Get styles
-    styles = _make_styles(link_color=link_color)
-
-    # Apply style overrides if provided
+    # Get styles (shared, unless they have to be customized)
     if style_overrides:
+        styles = _make_styles(link_color=link_color)
         for style_name, overrides in style_overrides.items():
             if style_name in styles:
                 for attr, value in overrides.items():
                     setattr(styles[style_name], attr, value)
+    else:
+        styles = _shared_styles(link_color=link_color)
 
     # Build story
     story = []
@@ -387,28 +383,160 @@ def mk_resume(
             if item.id in page_breaks_before:
                 story.append(PageBreak())
 
-            # Use custom spacing for experience section
-            if item.kind == "experience":
-                # Rebuild the section with custom item spacing
-                rebuilt_section = mk_experience_section(
+            # Experience sections given as (title, dates, bullets) tuples are built
+            # here, with the resume's styles and custom item spacing
+            if item.kind == "experience" and all(map(_is_raw_experience, item.content)):
+                item = mk_experience_section(
                     item.content,
                     header=item.header,
                     link_color=link_color,
                     item_spacing=experience_item_spacing,
+                    styles=styles,
                 )
-                flowables = _section_to_flowables(
-                    rebuilt_section,
-                    styles,
-                    link_color=link_color,
-                    section_spacing=section_spacing,
-                )
-            else:
-                flowables = _section_to_flowables(
-                    item, styles, link_color=link_color, section_spacing=section_spacing
-                )
+            flowables = _section_to_flowables(
+                item, styles, link_color=link_color, section_spacing=section_spacing
+            )
             story.extend(flowables)
 
     # Build PDF
     doc.build(story)
 
+    return doc.page
+
+
+def mk_resume(
+    sections: Iterable[Union[Section, Any]],
+    *,
+    pdf_path: Union[str, BytesIO] = "resume.pdf",
+    page_size=letter,
+    margins: dict = None,
+    link_color: str = '#2056a5',
+    page_breaks_before: list[str] = None,
+    style_overrides: dict = None,
+    section_spacing: int = 12,
+    experience_item_spacing: int = 6,
+) -> Union[str, BytesIO]:
+    """
+    Generate a resume PDF from sections.
+
+    Args:
+        sections: Iterable of Section objects or PAGE_BREAK sentinel
+        pdf_path: Path where PDF will be saved, or a binary buffer to write it to
+        page_size: Page size (default: letter)
+        margins: Dict with keys 'right', 'left', 'top', 'bottom'
+        link_color: Color for hyperlinks
+        page_breaks_before: List of section IDs to insert page breaks before
+        style_overrides: Dict of style customizations
+
+    Returns:
+        Path to the generated PDF (or the buffer)
+
+    >>> sections = [Section(content="Test", header="TEST")]
+    >>> path = mk_resume(sections, pdf_path="/tmp/test.pdf")
+    >>> Path(path).exists()
+    True
+    >>> mk_resume(sections, pdf_path=BytesIO()).getvalue()[:5]
+    b'%PDF-'
+    """
+    if isinstance(pdf_path, (str, Path)):
+        pdf_path = os.path.expanduser(pdf_path)
+
+    _build_resume(
+        sections,
+        pdf_path,
+        page_size=page_size,
+        margins=margins,
+        link_color=link_color,
+        page_breaks_before=page_breaks_before,
+        style_overrides=style_overrides,
+        section_spacing=section_spacing,
+        experience_item_spacing=experience_item_spacing,
+    )
     return pdf_path
+
+
+def _render_resume(args) -> tuple:
+    """Render one resume of a batch: to its path if it has one, else to bytes.
+    Returns the (path or bytes, number of pages) pair."""
+    sections, pdf_path, resume_kwargs = args
+    if pdf_path is None:
+        buffer = BytesIO()
+        n_pages = _build_resume(sections, buffer, **resume_kwargs)
+        return buffer.getvalue(), n_pages
+    pdf_path = os.path.expanduser(pdf_path)
+    return pdf_path, _build_resume(sections, pdf_path, **resume_kwargs)
+
+
+def _warm_styles(link_color: str = '#2056a5'):
+    """Process pool initializer: build the shared styles once per worker."""
+    _shared_styles(link_color=link_color)
+
+
+def iter_resumes(
+    section_lists: Iterable[Iterable[Union[Section, Any]]],
+    *,
+    pdf_paths: Iterable[str] = None,
+    max_workers: int = None,
+    chunksize: int = 8,
+    **resume_kwargs,
+):
+    """Like ``mk_resumes``, but yields (path or bytes, number of pages) pairs, in order."""
+    section_lists = [list(sections) for sections in section_lists]
+    if pdf_paths is None:
+        pdf_paths = [None] * len(section_lists)
+    else:
+        pdf_paths = list(pdf_paths)
+        assert len(pdf_paths) == len(section_lists), "One pdf path per resume"
+    tasks = [
+        (sections, pdf_path, resume_kwargs)
+        for sections, pdf_path in zip(section_lists, pdf_paths)
+    ]
+    if max_workers is not None and max_workers <= 1 or len(tasks) <= 1:
+        yield from map(_render_resume, tasks)
+        return
+    link_color = resume_kwargs.get('link_color', '#2056a5')
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_warm_styles, initargs=(link_color,)
+    ) as executor:
+        yield from executor.map(_render_resume, tasks, chunksize=chunksize)
+
+
+def mk_resumes(
+    section_lists: Iterable[Iterable[Union[Section, Any]]],
+    *,
+    pdf_paths: Iterable[str] = None,
+    max_workers: int = None,
+    chunksize: int = 8,
+    **resume_kwargs,
+) -> list:
+    """
+    Generate many resume PDFs, across a pool of processes.
+
+    Args:
+        section_lists: One iterable of sections per resume (see ``mk_resume``).
+            They are sent to the worker processes, so must be picklable: prefer
+            strings and (title, dates, bullets) experience tuples to Flowables.
+        pdf_paths: Where to save the PDFs. If None, the PDFs are returned as bytes.
+        max_workers: Number of processes (default: the number of CPUs; 1 to render in
+            the current process)
+        chunksize: Number of resumes sent to a worker at once
+        resume_kwargs: Options of ``mk_resume`` (page_size, margins, ...), for all resumes
+
+    Returns:
+        The list of paths (or PDF bytes), in the order of ``section_lists``
+
+    >>> resumes = [[Section(content=f"Resume {i}", header="TEST")] for i in range(3)]
+    >>> pdfs = mk_resumes(resumes, max_workers=1)
+    >>> [pdf[:5] for pdf in pdfs]
+    [b'%PDF-', b'%PDF-', b'%PDF-']
+    """
+    return [
+        output
+        for output, _ in iter_resumes(
+            section_lists,
+            pdf_paths=pdf_paths,
+            max_workers=max_workers,
+            chunksize=chunksize,
+            **resume_kwargs,
+        )
+    ]
@@ -0,0 +1,266 @@
+"""Index of the content of the CVs (``mall.cvs_info``), to query the whole portfolio
+without reading and parsing every json file.
+
+Scalar fields are held in columns (numpy arrays: floats for numeric fields, like the
+years of seniority, and normalized strings for text fields), and list fields (skills,
+languages, certifications) in inverted indexes (term -> rows). The index is updated
+incrementally, as CV contents are added, replaced or removed.
+
+>>> index = CvsInfoIndex()
+>>> index.add("alice.json", {"JobTitle": "Data Engineer", "seniority": "7 years",
+...                          "skills": "Python, Spark, SQL", "languages": "English (C1)"})
+>>> index.add("bob.json", {"JobTitle": "Data Scientist", "seniority": "2 years",
+...                        "skills": ["Python", "NLP"], "languages": "French, English"})
+>>> index.query(skills="spark", seniority__gt=5)
+['alice.json']
+>>> index.query(skills__any=["spark", "nlp"], languages="english")
+['alice.json', 'bob.json']
+>>> index.query(JobTitle__contains="scientist")
+['bob.json']
+>>> index.terms("skills").most_common(1)
+[('python', 2)]
+"""
+
+import os
+import pickle
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Mapping
+
+import numpy as np
+
+MISSING_TERMS = {"", "none", "missing information", "to be filled", "n/a"}
+
+
+def parse_years(value) -> float:
+    """Number of years in a duration like "2 years", "10+ years" or "6 months".
+
+    >>> parse_years("2 years"), parse_years("10+ ans"), parse_years("6 months")
+    (2.0, 10.0, 0.5)
+    >>> parse_years("none")
+    nan
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"(\d+(?:[.,]\d+)?)", str(value))
+    if match is None:
+        return float("nan")
+    number = float(match.group(1).replace(",", "."))
+    if re.search(r"\b(months?|mois)\b", str(value), flags=re.IGNORECASE):
+        number /= 12
+    return number
+
+
+def normalize_term(term: str) -> str:
+    """Lowercase term, without its parenthesized details (e.g. a language level).
+
+    >>> normalize_term(" English (C1) ")
+    'english'
+    """
+    term = re.sub(r"\(.*?\)", "", str(term))
+    return re.sub(r"\s+", " ", term).strip(" .-*•").lower()
+
+
+def split_terms(value) -> List[str]:
+    """The normalized terms of a list field, given as a list or a separated string.
+
+    >>> split_terms("Python, SQL; Machine Learning")
+    ['python', 'sql', 'machine learning']
+    >>> split_terms(["English (C1)", "none"])
+    ['english']
+    """
+    if isinstance(value, str):
+        items = re.split(r"[,;/\n|•]", value)
+    elif isinstance(value, Iterable) and not isinstance(value, Mapping):
+        items = [item for item in value if isinstance(item, str)]
+    else:
+        items = []
+    terms = (normalize_term(item) for item in items)
+    return list(dict.fromkeys(t for t in terms if t not in MISSING_TERMS))
+
+
+def normalize_text(value) -> str:
+    return normalize_term(value) if isinstance(value, str) else ""
+
+
+DFLT_NUMERIC_FIELDS = {"seniority": parse_years}
+DFLT_TEXT_FIELDS = ("FullName", "JobTitle", "mobility", "avaibility")
+DFLT_LIST_FIELDS = ("skills", "languages", "certifications")
+
+_NUMERIC_OPS = {
+    "eq": np.equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+    "lt": np.less,
+    "le": np.less_equal,
+}
+
+
+def _grown(array: np.ndarray, n: int, fill) -> np.ndarray:
+    """``array``, or a copy with doubled capacity if it can't hold ``n`` items."""
+    if n <= len(array):
+        return array
+    new = np.full(max(n, 2 * len(array)), fill, dtype=array.dtype)
+    new[: len(array)] = array
+    return new
+
+
+@dataclass
+class CvsInfoIndex:
+    """Columnar and inverted index of CV contents, with a small query API.
+
+    Rows are appended: replacing the content of a key appends a new row and marks the old
+    one as removed. See ``query`` for the conditions.
+    """
+
+    numeric_fields: Mapping[str, Callable] = field(
+        default_factory=lambda: dict(DFLT_NUMERIC_FIELDS)
+    )
+    text_fields: Iterable[str] = DFLT_TEXT_FIELDS
+    list_fields: Iterable[str] = DFLT_LIST_FIELDS
+
+    def __post_init__(self):
+        self.keys = []  # key of each row
+        self.row_of = {}  # row of each (alive) key
+        self.mtimes = {}  # modification time of the indexed file of each key
+        self._alive = np.zeros(0, dtype=bool)
+        self._numeric = {f: np.zeros(0, dtype=float) for f in self.numeric_fields}
+        self._text = {f: np.zeros(0, dtype=object) for f in self.text_fields}
+        self._inverted = {f: defaultdict(set) for f in self.list_fields}
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def __contains__(self, key):
+        return key in self.row_of
+
+    def __iter__(self):
+        return iter(self.row_of)
+
+    def add(self, key: str, info: Mapping, *, mtime: float = None):
+        """Index the content ``info`` of the CV ``key`` (replacing a previous one)."""
+        if key in self.row_of:
+            self.remove(key)
+        row = len(self.keys)
+        n = row + 1
+        self.keys.append(key)
+        self.row_of[key] = row
+        if mtime is not None:
+            self.mtimes[key] = mtime
+        self._alive = _grown(self._alive, n, False)
+        self._alive[row] = True
+        for f, parse in self.numeric_fields.items():
+            self._numeric[f] = _grown(self._numeric[f], n, np.nan)
+            self._numeric[f][row] = parse(info[f]) if f in info else np.nan
+        for f in self.text_fields:
+            self._text[f] = _grown(self._text[f], n, "")
+            self._text[f][row] = normalize_text(info.get(f))
+        for f in self.list_fields:
+            for term in split_terms(info.get(f)):
+                self._inverted[f][term].add(row)
+
+    def remove(self, key: str):
+        """Remove the CV ``key`` from the index."""
+        row = self.row_of.pop(key)
+        self.mtimes.pop(key, None)
+        self._alive[row] = False
+
+    def _rows_mask(self, rows: Iterable[int]) -> np.ndarray:
+        mask = np.zeros(len(self.keys), dtype=bool)
+        mask[np.fromiter(rows, dtype=int)] = True
+        return mask
+
+    def _condition_mask(self, condition: str, value) -> np.ndarray:
+        f, _, op = condition.partition("__")
+        if f in self._inverted:
+            inverted = self._inverted[f]
+            terms = [normalize_term(value)] if isinstance(value, str) else [
+                normalize_term(v) for v in value
+            ]
+            row_sets = [inverted.get(term, set()) for term in terms]
+            if op in ("", "all", "has"):
+                rows = set.intersection(*row_sets) if row_sets else set()
+            elif op == "any":
+                rows = set().union(*row_sets)
+            else:
+                raise ValueError(f"Unknown operator for list field {f}: {op}")
+            return self._rows_mask(rows)
+        n = len(self.keys)
+        if f in self._numeric:
+            column = self._numeric[f][:n]
+            if op == "between":
+                low, high = value
+                return (column >= low) & (column <= high)
+            if op not in ("",) + tuple(_NUMERIC_OPS):
+                raise ValueError(f"Unknown operator for numeric field {f}: {op}")
+            return _NUMERIC_OPS[op or "eq"](column, value)
+        if f in self._text:
+            column = self._text[f][:n]
+            if op in ("", "eq"):
+                return column == normalize_text(value)
+            if op == "contains":
+                value = normalize_text(value)
+                return np.fromiter((value in s for s in column), dtype=bool, count=n)
+            raise ValueError(f"Unknown operator for text field {f}: {op}")
+        raise KeyError(f"Field {f} is not indexed")
+
+    def mask(self, **conditions) -> np.ndarray:
+        """Boolean array of the rows satisfying all the conditions."""
+        mask = self._alive[: len(self.keys)].copy()
+        for condition, value in conditions.items():
+            mask &= self._condition_mask(condition, value)
+        return mask
+
+    def query(self, **conditions) -> List[str]:
+        """Keys of the CVs satisfying all the conditions, given as ``field=value`` or
+        ``field__operator=value``:
+
+        - list fields: ``skills="spark"`` or ``skills=["spark", "sql"]`` (all the terms),
+          ``skills__any=[...]`` (at least one of the terms)
+        - numeric fields: ``seniority=3``, ``seniority__gt=5`` (also ``ge``, ``lt``,
+          ``le``), ``seniority__between=(2, 5)``
+        - text fields: ``JobTitle="data engineer"`` (case-insensitive),
+          ``JobTitle__contains="data"``
+        """
+        return [self.keys[row] for row in np.flatnonzero(self.mask(**conditions))]
+
+    def count(self, **conditions) -> int:
+        """Number of the CVs satisfying all the conditions (see ``query``)."""
+        return int(self.mask(**conditions).sum())
+
+    def terms(self, list_field: str) -> Counter:
+        """Number of CVs of each term of a list field."""
+        alive = self._alive
+        return Counter(
+            {
+                term: n
+                for term, rows in self._inverted[list_field].items()
+                if (n := sum(1 for row in rows if alive[row]))
+            }
+        )
+
+    def sync(self, store: Mapping, rootdir: str = None):
+        """Update the index with the content of ``store``: index the new keys (and, if
+        the files are in ``rootdir``, the modified ones), and remove the deleted ones."""
+        keys = set(store)
+        for key in [k for k in self.row_of if k not in keys]:
+            self.remove(key)
+        for key in keys:
+            mtime = None
+            if rootdir is not None:
+                mtime = os.path.getmtime(os.path.join(rootdir, key))
+            if key not in self.row_of or (
+                mtime is not None and self.mtimes.get(key) != mtime
+            ):
+                self.add(key, store[key], mtime=mtime)
+        return self
+
+    def save(self, filepath: str):
+        with open(filepath, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, filepath: str) -> "CvsInfoIndex":
+        with open(filepath, "rb") as f:
+            return pickle.load(f)
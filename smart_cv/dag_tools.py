@@ -0,0 +1,204 @@
+"""Tools to execute a meshed DAG with concurrency: the func nodes whose inputs are all
+available are run at the same time on a thread pool, and per-node start and end times are
+recorded so that the critical path of the pipeline can be inspected."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, replace
+from functools import wraps
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+from meshed import DAG, FuncNode
+
+from smart_cv.instrumentation import timed_event
+
+
+def node_dependencies(dag: DAG) -> Dict[str, set]:
+    """Return a ``{node_name: names_of_the_func_nodes_it_needs}`` mapping.
+
+    A func node depends on the func nodes producing the variables it's bound to.
+
+    >>> from meshed import FuncNode
+    >>> dag = DAG([
+    ...     FuncNode(lambda x: x + 1, name='f', out='a'),
+    ...     FuncNode(lambda x: x * 2, name='g', out='b'),
+    ...     FuncNode(lambda a, b: a + b, name='h', out='c'),
+    ... ])
+    >>> sorted((k, sorted(v)) for k, v in node_dependencies(dag).items())
+    [('f', []), ('g', []), ('h', ['f', 'g'])]
+    """
+    producer = {fn.out: fn.name for fn in dag.func_nodes}
+    return {
+        fn.name: {producer[v] for v in fn.bind.values() if v in producer}
+        for fn in dag.func_nodes
+    }
+
+
+def _timed_node_func(func, node_name: str):
+    @wraps(func)
+    def _timed_func(*args, **kwargs):
+        with timed_event("dag_node", node=node_name):
+            return func(*args, **kwargs)
+
+    return _timed_func
+
+
+def instrumented_dag(dag: DAG) -> DAG:
+    """A copy of ``dag`` whose func nodes emit a ``dag_node`` event (with the node name
+    and duration) at every call (see smart_cv.instrumentation).
+
+    >>> dag = instrumented_dag(DAG([FuncNode(lambda x: x + 1, name='f', out='a')]))
+    >>> dag(x=1), [fn.name for fn in dag.func_nodes]
+    (2, ['f'])
+    """
+    return DAG(
+        [
+            FuncNode(
+                _timed_node_func(fn.func, fn.name),
+                name=fn.name,
+                bind=fn.bind,
+                out=fn.out,
+            )
+            for fn in dag.func_nodes
+        ],
+        name=dag.name,
+    )
+
+
+@dataclass
+class ParallelDAG:
+    """Run a DAG, executing the ready func nodes concurrently on a thread pool.
+
+    The outputs are the same as the ones of ``dag(*args, **kwargs)``. After a call,
+    ``timings`` holds the ``(start, end)`` times (relative to the start of the call) of
+    each node, and ``critical_path()`` gives the chain of nodes that determined the
+    total duration. The timings are the ones of the last call made in the current
+    context (thread or asyncio task), so concurrent calls don't overwrite each other's;
+    ``call_with_timings`` returns them along with the outputs. ``initializer`` is called
+    at the start of each worker thread (e.g. to give it the context of a streamlit
+    script). Slicing a ParallelDAG slices its DAG, and the other attributes (e.g.
+    ``func_nodes``, ``dot_digraph``) are the DAG's.
+
+    >>> from meshed import FuncNode
+    >>> def slow(x, delay=0.05):
+    ...     time.sleep(delay)
+    ...     return x
+    >>> dag = DAG([
+    ...     FuncNode(slow, name='f', out='a'),
+    ...     FuncNode(slow, name='g', bind={'x': 'x'}, out='b'),
+    ...     FuncNode(lambda a, b: a + b, name='h', out='c'),
+    ... ])
+    >>> pdag = ParallelDAG(dag, max_workers=2)
+    >>> pdag(x=1)
+    2
+    >>> pdag.critical_path()[-1]
+    'h'
+    >>> pdag.timings['h'][1] < 0.1  # f and g ran at the same time
+    True
+    >>> pdag[:'a'](x=3)
+    3
+    """
+
+    dag: DAG
+    max_workers: int = 4
+    initializer: Callable[[], None] = None
+
+    def __post_init__(self):
+        self.dependencies = node_dependencies(self.dag)
+        self.__signature__ = self.dag.__signature__
+        self.__name__ = self.dag.__name__
+        self._timings = ContextVar(f"{self.__name__}_timings", default={})
+
+    def __getitem__(self, item) -> "ParallelDAG":
+        return replace(self, dag=self.dag[item])
+
+    def __getattr__(self, name):
+        if name == "dag":  # not set yet
+            raise AttributeError(name)
+        return getattr(self.dag, name)
+
+    @property
+    def timings(self) -> Dict[str, Tuple[float, float]]:
+        """The node timings of the last call made in the current context."""
+        return self._timings.get()
+
+    def __call__(self, *args, **kwargs):
+        return self.call_with_timings(*args, **kwargs)[0]
+
+    def call_with_timings(self, *args, **kwargs) -> Tuple[object, dict]:
+        """The outputs of the DAG and the ``(start, end)`` times of its nodes."""
+        scope = self.dag.sig.map_arguments(args, kwargs, apply_defaults=True)
+        timings = {}
+        self.call_on_scope(scope, timings)
+        outputs = tuple(scope[leaf] for leaf in self.dag.leafs if leaf in scope)
+        return (outputs[0] if len(outputs) == 1 else outputs or None), timings
+
+    def call_on_scope(self, scope: dict, timings: dict = None):
+        """Call the func nodes on scope, as soon as the nodes they depend on are done,
+        recording their times in ``timings``."""
+        func_nodes = {fn.name: fn for fn in self.dag.func_nodes}
+        remaining = {name: set(deps) for name, deps in self.dependencies.items()}
+        lock = Lock()
+        t0 = time.perf_counter()
+        timings = {} if timings is None else timings
+        self._timings.set(timings)
+
+        def run(fn):
+            start = time.perf_counter() - t0
+            with lock:
+                inputs = dict(scope)  # a snapshot: other nodes write to scope meanwhile
+            output = fn.call_on_scope(inputs, write_output_into_scope=False)
+            with lock:
+                scope[fn.out] = output
+            timings[fn.name] = (start, time.perf_counter() - t0)
+            return fn.name
+
+        with ThreadPoolExecutor(
+            max_workers=max(self.max_workers, 1), initializer=self.initializer
+        ) as executor:
+            running = set()
+
+            def submit_ready():
+                for name in [n for n, deps in remaining.items() if not deps]:
+                    del remaining[name]
+                    running.add(
+                        executor.submit(copy_context().run, run, func_nodes[name])
+                    )
+
+            submit_ready()
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished = future.result()  # re-raises the node's error, if any
+                    for deps in remaining.values():
+                        deps.discard(finished)
+                submit_ready()
+        return scope
+
+    def critical_path(self, timings: dict = None) -> List[str]:
+        """The chain of nodes, ending with the last node to finish, where each node is
+        the dependency that finished last (i.e. the one the next node waited for).
+        ``timings`` defaults to the ones of the last call."""
+        timings = self.timings if timings is None else timings
+        if not timings:
+            return []
+        node = max(timings, key=lambda name: timings[name][1])
+        path = [node]
+        while deps := [d for d in self.dependencies[node] if d in timings]:
+            node = max(deps, key=lambda name: timings[name][1])
+            path.append(node)
+        return path[::-1]
+
+    def timings_report(self, timings: dict = None) -> str:
+        """A text table of the node timings, in order of start time."""
+        timings = self.timings if timings is None else timings
+        critical = set(self.critical_path(timings))
+        lines = []
+        for name, (start, end) in sorted(timings.items(), key=lambda x: x[1]):
+            mark = "*" if name in critical else " "
+            lines.append(
+                f"{mark} {name:<30} {start:8.3f}s -> {end:8.3f}s ({end - start:.3f}s)"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,159 @@
+"""Extraction of the text of CV documents (PDF, DOCX, plain text).
+
+The pages of large PDFs are parsed in parallel, in worker processes. Extracted texts
+are kept in a persistent cache keyed by a hash of the document's bytes, so a document
+is only parsed once, however many times it is reprocessed or re-templated. The texts
+are CV contents: the on-disk tier of the cache follows
+``smart_cv.cache.set_disk_persistence``, and failing writes are logged, not raised.
+
+>>> cache = {}
+>>> extract_text_cached("cv.txt", b"Data engineer", cache=cache)
+'Data engineer'
+>>> list(cache.values())
+['Data engineer']
+"""
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import MutableMapping
+from io import BytesIO
+from typing import Callable, Optional
+
+from dol import Files, wrap_kvs
+
+from smart_cv.cache import AppDiskCache, LRUCache, TieredCache
+from smart_cv.util import text_cache_dir
+
+# Change when the extraction changes, to invalidate the texts cached before
+EXTRACTION_VERSION = "2"
+DFLT_PARALLEL_MIN_PAGES = 32
+DFLT_TEXT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+DFLT_TEXT_CACHE_MAXSIZE = 256  # texts kept in memory
+
+
+def content_hash(doc_bytes: bytes) -> str:
+    """Key of a document in the text cache: a hash of its bytes (and extraction version).
+
+    >>> content_hash(b"abc") == content_hash(b"abc") != content_hash(b"abd")
+    True
+    """
+    h = hashlib.sha256(EXTRACTION_VERSION.encode())
+    h.update(doc_bytes)
+    return h.hexdigest()
+
+
+def _pdf_pages_text(pdf_bytes: bytes, start: int = 0, stop: int = None) -> list:
+    """The text of the pages ``start`` to ``stop`` of a PDF."""
+    from pypdf import PdfReader
+
+    pages = PdfReader(BytesIO(pdf_bytes)).pages
+    stop = len(pages) if stop is None else stop
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def pdf_to_text(
+    pdf_bytes: bytes,
+    *,
+    max_workers: int = None,
+    parallel_min_pages: int = DFLT_PARALLEL_MIN_PAGES,
+) -> str:
+    """The text of a PDF, one page per paragraph, separated by a form feed (so that the
+    headers and footers can be told apart, see smart_cv.normalization).
+    PDFs of at least ``parallel_min_pages`` pages are parsed by ranges of pages, in
+    ``max_workers`` processes (default: the number of CPUs)."""
+    from pypdf import PdfReader
+
+    n_pages = len(PdfReader(BytesIO(pdf_bytes)).pages)
+    max_workers = max_workers or os.cpu_count() or 1
+    if n_pages < parallel_min_pages or max_workers <= 1:
+        pages = _pdf_pages_text(pdf_bytes)
+    else:
+        step = -(-n_pages // max_workers)  # ceil division
+        starts = range(0, n_pages, step)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_pdf_pages_text, pdf_bytes, start, start + step)
+                for start in starts
+            ]
+            pages = [page for future in futures for page in future.result()]
+    return "\n\f\n".join(pages)
+
+
+def docx_to_text(docx_bytes: bytes) -> str:
+    """The text of a DOCX document (paragraphs and tables)."""
+    from docx2python import docx2python
+
+    with docx2python(BytesIO(docx_bytes)) as doc:
+        return doc.text
+
+
+def plain_to_text(doc_bytes: bytes) -> str:
+    return doc_bytes.decode("utf-8", errors="replace")
+
+
+extractor_of_extension = {
+    ".pdf": pdf_to_text,
+    ".docx": docx_to_text,
+    ".txt": plain_to_text,
+    ".md": plain_to_text,
+}
+
+
+def extract_text(name: str, doc_bytes: bytes) -> str:
+    """The text of a document, extracted according to the extension of its ``name``.
+
+    >>> extract_text("cv.md", "# Jean Dupont".encode())
+    '# Jean Dupont'
+    """
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in extractor_of_extension:
+        raise ValueError(
+            f"Can't extract the text of {name}: supported extensions are "
+            f"{list(extractor_of_extension)}"
+        )
+    return extractor_of_extension[ext](doc_bytes)
+
+
+_dflt_text_cache = None
+
+
+def get_dflt_text_cache() -> TieredCache:
+    """The text cache shared by the whole app, persisted in ``text_cache_dir`` (unless
+    the disk persistence is off)."""
+    global _dflt_text_cache
+    if _dflt_text_cache is None:
+        _dflt_text_cache = TieredCache(
+            LRUCache(maxsize=DFLT_TEXT_CACHE_MAXSIZE),
+            AppDiskCache(text_cache_dir, max_bytes=DFLT_TEXT_CACHE_MAX_BYTES),
+        )
+    return _dflt_text_cache
+
+
+def extract_text_cached(
+    name: str,
+    doc_bytes: bytes,
+    *,
+    cache: Optional[MutableMapping] = None,
+    extract: Callable[[str, bytes], str] = extract_text,
+) -> str:
+    """``extract_text``, with the texts looked up in (and stored to) ``cache``, under the
+    hash of the document's bytes. If no cache is given, the default app cache is used."""
+    if cache is None:
+        cache = get_dflt_text_cache()
+    key = content_hash(doc_bytes)
+    try:
+        return cache[key]
+    except KeyError:
+        text = extract(name, doc_bytes)
+        cache[key] = text
+        return text
+
+
+def mk_cvs_text_store(rootdir: str, *, cache: Optional[MutableMapping] = None):
+    """A store of the CV documents of ``rootdir``, whose values are the (cached) texts
+    of the documents. Written values are the bytes of the documents."""
+    return wrap_kvs(
+        Files(rootdir),
+        postget=lambda k, v: extract_text_cached(k, v, cache=cache),
+    )
@@ -0,0 +1,237 @@
+"""Instrumentation of the pipeline: structured events on tokens and latency.
+
+Events are dicts with a ``type`` (``chat_call``, ``chunk``, ``cv_chunks``,
+``cv_normalization``, ``dag_node``...), a ``time``, the labels of the context they were
+emitted in (e.g. ``cv``, set with ``event_labels``) and their own fields. They are sent
+to the sinks registered with ``add_event_sink``: any callable taking an event, like a
+``JsonlSink`` writing them to a file, or a ``CvMetrics`` aggregating them per CV.
+When no sink is registered, emitting an event costs (almost) nothing.
+
+>>> metrics = CvMetrics()
+>>> _ = add_event_sink(metrics)
+>>> chat = instrumented_chat(lambda prompt, **kwargs: "an answer")
+>>> with event_labels(cv="alice.pdf"):
+...     _ = chat("a prompt")
+...     with event_labels(retry=True):
+...         _ = chat("a repair prompt")
+>>> m = metrics["alice.pdf"]
+>>> m["chat_calls"], m["retries"], m["prompt_tokens"] > 0, m["completion_tokens"] > 0
+(2, 1, True, True)
+>>> remove_event_sink(metrics)
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, List
+
+from smart_cv.tokens import num_tokens
+
+logger = logging.getLogger(__name__)
+
+_event_sinks: List[Callable[[dict], None]] = []
+_labels: ContextVar[dict] = ContextVar("smart_cv_event_labels", default={})
+
+
+def add_event_sink(sink: Callable[[dict], None]):
+    """Send the events to ``sink`` (a callable taking an event dict)."""
+    _event_sinks.append(sink)
+    return sink
+
+
+def remove_event_sink(sink: Callable[[dict], None]):
+    _event_sinks.remove(sink)
+
+
+def instrumentation_is_on() -> bool:
+    return bool(_event_sinks)
+
+
+@contextmanager
+def event_labels(**labels):
+    """Add ``labels`` to the events emitted in the context (including the threads run
+    with ``smart_cv.util.concurrent_map``, and asyncio tasks)."""
+    token = _labels.set({**_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def emit(event_type: str, **fields):
+    """Send an event to the sinks. An error of a sink is reported, not raised."""
+    if not _event_sinks:
+        return
+    event = dict(type=event_type, time=time.time(), **_labels.get(), **fields)
+    for sink in list(_event_sinks):
+        try:
+            sink(event)
+        except Exception as e:
+            print(f"Event sink {sink} failed: {e}")
+
+
+def _count_tokens(text) -> int:
+    """The number of tokens of ``text``, estimated from its length (4 characters per
+    token) if it can't be encoded, so the token counts of the events stay meaningful."""
+    text = text if isinstance(text, str) else json.dumps(text, default=str)
+    try:
+        return num_tokens(text)
+    except Exception as e:
+        logger.warning(f"Could not count the tokens ({e!r}), estimating them")
+        return len(text) // 4
+
+
+def _chat_event(prompt, answer, tic, error=None, **fields):
+    emit(
+        "chat_call",
+        latency=time.perf_counter() - tic,
+        prompt_tokens=_count_tokens(prompt),
+        completion_tokens=_count_tokens(answer) if answer is not None else 0,
+        error=None if error is None else repr(error),
+        **fields,
+    )
+
+
+def instrumented_chat(chat: Callable) -> Callable:
+    """Wrap a chat function so each call emits a ``chat_call`` event (latency, prompt
+    and completion tokens). The calls retrying a failed answer are made with the
+    ``retry=True`` label. Wrapped in a cache, only the actual calls are recorded."""
+
+    @wraps(chat)
+    def _instrumented_chat(prompt, **chat_kwargs):
+        if not _event_sinks:
+            return chat(prompt, **chat_kwargs)
+        tic = time.perf_counter()
+        try:
+            answer = chat(prompt, **chat_kwargs)
+        except Exception as e:
+            _chat_event(prompt, None, tic, error=e)
+            raise
+        _chat_event(prompt, answer, tic)
+        return answer
+
+    return _instrumented_chat
+
+
+def instrumented_achat(achat: Callable) -> Callable:
+    """Async version of ``instrumented_chat``, for chat coroutine functions."""
+
+    @wraps(achat)
+    async def _instrumented_achat(prompt, **chat_kwargs):
+        if not _event_sinks:
+            return await achat(prompt, **chat_kwargs)
+        tic = time.perf_counter()
+        try:
+            answer = await achat(prompt, **chat_kwargs)
+        except Exception as e:
+            _chat_event(prompt, None, tic, error=e)
+            raise
+        _chat_event(prompt, answer, tic)
+        return answer
+
+    return _instrumented_achat
+
+
+def instrumented_stream_chat(stream_chat: Callable) -> Callable:
+    """Version of ``instrumented_chat`` for streaming chats. The event also has the time
+    to the first piece of the answer (``first_piece_latency``)."""
+
+    @wraps(stream_chat)
+    def _instrumented_stream_chat(prompt, **chat_kwargs):
+        if not _event_sinks:
+            yield from stream_chat(prompt, **chat_kwargs)
+            return
+        tic = time.perf_counter()
+        first_piece_latency = None
+        pieces = []
+        for piece in stream_chat(prompt, **chat_kwargs):
+            if first_piece_latency is None:
+                first_piece_latency = time.perf_counter() - tic
+            pieces.append(piece)
+            yield piece
+        _chat_event(
+            prompt, "".join(pieces), tic, first_piece_latency=first_piece_latency
+        )
+
+    return _instrumented_stream_chat
+
+
+@contextmanager
+def timed_event(event_type: str, **fields):
+    """Emit an event with the ``duration`` of the context, and the fields set in the
+    dict it yields. An error is recorded in the event, and raised."""
+    tic = time.perf_counter()
+    extra = {}
+    try:
+        yield extra
+    except Exception as e:
+        extra["error"] = repr(e)
+        raise
+    finally:
+        emit(event_type, duration=time.perf_counter() - tic, **fields, **extra)
+
+
+class JsonlSink:
+    """Event sink writing the events to a jsonl file, one json per line."""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            with open(self.filepath, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class CvMetrics:
+    """Event sink aggregating the events per CV (the ``cv`` label): tokens, chat calls,
+    latency and retries, tokens saved by the normalization, number of chunks and time
+    spent in each DAG node."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = defaultdict(
+            lambda: dict(
+                chat_calls=0,
+                retries=0,
+                prompt_tokens=0,
+                completion_tokens=0,
+                chat_latency=0.0,
+                tokens_saved=0,
+                n_chunks=0,
+                node_durations={},
+            )
+        )
+
+    def __call__(self, event: dict):
+        with self._lock:
+            m = self.metrics[event.get("cv")]
+            if event["type"] == "chat_call":
+                m["chat_calls"] += 1
+                m["retries"] += bool(event.get("retry"))
+                m["prompt_tokens"] += event["prompt_tokens"]
+                m["completion_tokens"] += event["completion_tokens"]
+                m["chat_latency"] += event["latency"]
+            elif event["type"] == "cv_normalization":
+                m["tokens_saved"] = event["tokens_saved"]
+            elif event["type"] == "cv_chunks":
+                m["n_chunks"] = event["n_chunks"]
+            elif event["type"] == "dag_node":
+                durations = m["node_durations"]
+                durations[event["node"]] = (
+                    durations.get(event["node"], 0.0) + event["duration"]
+                )
+
+    def __getitem__(self, cv):
+        return self.metrics[cv]
+
+    def slowest(self, n: int = 10, key: str = "chat_latency") -> list:
+        """The ``n`` CVs with the highest ``key`` metric, with their metrics."""
+        return sorted(self.metrics.items(), key=lambda x: x[1][key], reverse=True)[:n]
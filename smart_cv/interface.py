@@ -1,19 +1,42 @@
 """Interface objects: provide a dag pipeline and functions to interface the processing"""
 
-from smart_cv.base import dflt_config, get_config, dflt_stacks, dflt_json_example, mall
+from smart_cv.base import (
+    dflt_config,
+    get_config,
+    dflt_stacks,
+    dflt_json_example,
+    get_mall,
+)
 from smart_cv.resume_parser import (
     ContentRetriever,
     TemplateFiller,
+    template_bytes,
     label_empty_content,
     has_content_labelling,
     translate_content,
 )
 from smart_cv.util import dt_template_dir, filled_dir
+from smart_cv.cache import cached_chat
+from smart_cv.instrumentation import instrumented_chat, add_event_sink, JsonlSink
+from smart_cv.tokens import (
+    DFLT_CONTEXT_WINDOW,
+    DFLT_MAX_COMPLETION_TOKENS,
+    DFLT_RETRIEVAL_SEGMENT_TOKENS,
+)
 from functools import partial
+from typing import MutableMapping, Union
+from concurrent.futures import Future, ThreadPoolExecutor
 from oa import chat
 
 config = dflt_config
 
+# The chat used outside of the ContentRetriever (language detection, translation)
+_chat = cached_chat(instrumented_chat(chat))
+
+# Events of the pipeline (tokens, latencies...) written to a jsonl file, if configured
+if config.get("events_path"):
+    add_event_sink(JsonlSink(config["events_path"]))
+
 
 def _mk_parser(
     cv_text: str,
@@ -22,6 +45,21 @@ def _mk_parser(
     chunk_overlap: int = config.get("chunk_overlap", 50),
     temperature: float = config.get("temperature", 0),
     api_key: str = None,  # get_config("OPENAI_API_KEY"),
+    max_workers: int = config.get("max_workers", 1),
+    top_k: int = config.get("top_k", None),
+    retrieval_segment_tokens: int = config.get(
+        "retrieval_segment_tokens", DFLT_RETRIEVAL_SEGMENT_TOKENS
+    ),
+    field_groups: dict = config.get("field_groups", None),
+    stream_chat=None,
+    on_field=None,
+    local_skills: bool = config.get("local_skills", False),
+    context_window: int = config.get("context_window", DFLT_CONTEXT_WINDOW),
+    max_completion_tokens: int = config.get(
+        "max_completion_tokens", DFLT_MAX_COMPLETION_TOKENS
+    ),
+    normalize: bool = config.get("normalize_text", True),
+    cache: Union[bool, MutableMapping] = True,
     # empty_label: str = config.get("empty_label", "To be filled")
 ):
     """Create a parser object for the given CV."""
@@ -35,6 +73,17 @@ def _mk_parser(
         json_example=dflt_json_example,
         chunk_overlap=chunk_overlap,
         temperature=temperature,
+        max_workers=max_workers,
+        top_k=top_k,
+        retrieval_segment_tokens=retrieval_segment_tokens,
+        field_groups=field_groups,
+        stream_chat=stream_chat,
+        on_field=on_field,
+        local_skills=local_skills,
+        context_window=context_window,
+        max_completion_tokens=max_completion_tokens,
+        normalize=normalize,
+        cache=cache,
         # optional_content=config.get("optional_content", {}),
         # empty_label=empty_label
     )()
@@ -62,6 +111,7 @@ def cv_content(
 
 
 def cv_text(cv_name: str):
+    mall = get_mall()
     assert cv_name in mall.cvs, f"CV name {cv_name} not found in the mall."
     cv_text = cv_text = mall.cvs[cv_name]
     return cv_text
@@ -82,14 +132,47 @@ def fill_template(
     return filepath
 
 
+_persist_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _report_persist_error(future: Future):
+    if future.exception() is not None:
+        print(f"Could not save the filled template: {future.exception()}")
+
+
+def render_filled_template(
+    cv_content: dict,
+    cv_name: str = None,
+    template_path=dt_template_dir,
+    *,
+    filled_store=None,
+    persist: bool = False,
+) -> bytes:
+    """Fill a template with the given content, in memory, and return the docx bytes.
+    Nothing is written on the request path: if ``persist`` is True, the bytes are saved
+    to ``filled_store`` (default ``mall.filled``) in a background thread, under a key
+    made from ``cv_name`` (required then), and an error while saving (e.g. read-only
+    filesystem) is only reported."""
+    if persist and not cv_name:
+        raise ValueError("A cv_name is needed to persist the filled template")
+    docx_bytes = template_bytes(template_path, cv_content)
+    if persist:
+        store = get_mall().filled if filled_store is None else filled_store
+        key = f"{cv_name.split('.')[0]}_filled.docx"
+        future = _persist_executor.submit(store.__setitem__, key, docx_bytes)
+        future.add_done_callback(_report_persist_error)
+    return docx_bytes
+
+
 from smart_cv.resume_parser import (
     ContentRetriever,
     label_empty_content,
     has_content_labelling,
     translate_content,
+    detect_language,
     bytes_content,
 )
-from smart_cv.interface import cv_text, fill_template
+from smart_cv.interface import cv_text, fill_template, render_filled_template
 
 from functools import partial
 
@@ -100,13 +183,59 @@ _label_empty_content = partial(
     label_empty_content, empty_label=config.get("empty_label", "To be filled")
 )
 _translate_content = partial(
-    translate_content, language_list=config.get("language_list", ['en']), chat=chat
+    translate_content,
+    language_list=config.get("language_list", ['en']),
+    chat=_chat,
 )
+
+
+def _detect_language(cv_text: str, language: str = "automatic"):
+    """Resolve the target language, detecting it from the CV text if "automatic".
+    Only depends on cv_text, so it can run while the content is being extracted."""
+    if language == "automatic":
+        return detect_language(
+            cv_text, config.get("language_list", ["en"]), _chat
+        )
+    return language
+
+
 from meshed import DAG, FuncNode
+from smart_cv.dag_tools import ParallelDAG, instrumented_dag
+from smart_cv.checkpoints import checkpointed
+
+
+def _extraction_config():
+    """What the extraction depends on, besides the arguments of _mk_parser."""
+    return dict(
+        prompts=config["prompts"], stacks=dflt_stacks, json_example=dflt_json_example
+    )
+
+
+def _replay_fields(content, arguments):
+    """Emit the fields of a checkpointed extraction, as a streamed one would."""
+    if arguments.get("on_field") is not None:
+        for k, v in content.items():
+            arguments["on_field"](k, v)
+
+
+# The outputs of the LLM stages are checkpointed on disk, so a rerun (after a failure, or
+# with another template) resumes from the first stage whose inputs changed.
+if config.get("checkpoints", True):
+    _mk_parser_ = checkpointed(
+        _mk_parser,
+        config=_extraction_config,
+        ignore=("api_key", "stream_chat", "on_field", "max_workers", "cache"),
+        on_hit=_replay_fields,
+    )
+    _has_content_labelling = checkpointed(_has_content_labelling)
+    _label_empty_content = checkpointed(_label_empty_content)
+    _translate_content = checkpointed(_translate_content)
+else:
+    _mk_parser_ = _mk_parser
 
 funcs = [
     cv_text,
-    FuncNode(_mk_parser, out="raw_dict_content"),
+    FuncNode(_mk_parser_, out="raw_dict_content"),
     FuncNode(
         _has_content_labelling,
         bind={"dict_content": "raw_dict_content"},
@@ -117,13 +246,19 @@ funcs = [
         bind={"dict_content": "labeled_optional_content"},
         out="labeled_empty_content",
     ),
+    FuncNode(_detect_language, out="detected_language"),
     FuncNode(
         _translate_content,
-        bind={"dict_content": "labeled_empty_content"},
+        bind={"dict_content": "labeled_empty_content", "language": "detected_language"},
         out="translated_dict_content",
     ),
     FuncNode(fill_template, bind={"cv_content": "translated_dict_content"}),
     FuncNode(bytes_content, bind={"dict_content": "translated_dict_content"}),
 ]
 
-dag_pipeline = DAG(funcs)
+# The nodes whose inputs are ready run concurrently (e.g. the language detection while
+# the content is extracted), and every node emits a "dag_node" event with its duration
+# (see smart_cv.instrumentation)
+dag_pipeline = ParallelDAG(
+    instrumented_dag(DAG(funcs)), max_workers=config.get("dag_max_workers", 2)
+)
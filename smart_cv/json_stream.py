@@ -0,0 +1,194 @@
+"""Incremental parsing and local repair of the json answers of the LLM.
+
+With a streaming chat (an iterable of text pieces), the top-level fields of the answer
+can be used as soon as they are complete:
+
+>>> parser = IncrementalJsonParser()
+>>> parser.feed('Here is the json: {"FullName": "John Doe", "ski')
+[('FullName', 'John Doe')]
+>>> parser.feed('lls": ["Python", "Spark"]}')
+[('skills', ['Python', 'Spark'])]
+>>> parser.done
+True
+
+Malformed answers are repaired without asking the LLM, when possible:
+
+>>> repair_json('{"FullName": "John Doe", "skills": ["Python", "Sp')
+{'FullName': 'John Doe', 'skills': ['Python', 'Sp']}
+>>> repair_json("```json\\n{'FullName': 'John Doe',}\\n```")
+{'FullName': 'John Doe'}
+"""
+
+import ast
+import json
+import re
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+from smart_cv.tokens import DFLT_MODEL
+
+
+class IncrementalJsonParser:
+    """Parse a json object fed piece by piece, emitting each top-level field as soon as its
+    value is complete. Text before the opening brace is ignored."""
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._field_start = None
+
+    def feed(self, piece: str) -> List[Tuple[str, Any]]:
+        """Add a piece of text and return the (key, value) fields completed by it."""
+        self.text += piece
+        emitted = []
+        text = self.text
+        while self._pos < len(text) and not self.done:
+            c = text[self._pos]
+            if self._field_start is None:
+                if c == "{":
+                    self._depth = 1
+                    self._field_start = self._pos + 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "[{":
+                self._depth += 1
+            elif c in "]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    emitted.extend(self._emit_field(self._pos))
+                    self.done = True
+            elif c == "," and self._depth == 1:
+                emitted.extend(self._emit_field(self._pos))
+                self._field_start = self._pos + 1
+            self._pos += 1
+        return emitted
+
+    def _emit_field(self, end: int) -> List[Tuple[str, Any]]:
+        field_text = self.text[self._field_start : end].strip()
+        if not field_text:
+            return []
+        try:
+            field = json.loads("{" + field_text + "}")
+        except json.JSONDecodeError:
+            return []  # left to the repair of the whole answer
+        self.fields.update(field)
+        return list(field.items())
+
+
+def _strip_code_fences(text: str) -> str:
+    return re.sub(r"```(?:json)?", "", text)
+
+
+def close_truncated_json(text: str) -> str:
+    """Close the strings, lists and objects left open by a truncated json.
+
+    >>> close_truncated_json('{"a": [1, 2], "b": {"c": "d')
+    '{"a": [1, 2], "b": {"c": "d"}}'
+    >>> close_truncated_json('{"a": 1, "b":')
+    '{"a": 1}'
+    """
+    stack, in_string, escape, quote = [], False, False, None
+    for c in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == quote:
+                in_string = False
+        elif c in "\"'":
+            in_string, quote = True, c
+        elif c in "[{":
+            stack.append(c)
+        elif c in "]}" and stack:
+            stack.pop()
+    if in_string:
+        text += quote
+    text = text.rstrip()
+    if stack and stack[-1] == "{":
+        # drop a dangling key (with or without its colon)
+        text = re.sub(r"""([{,])\s*(["'])[^"']*\2\s*:?\s*$""", r"\1", text)
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    return text + "".join("}" if b == "{" else "]" for b in reversed(stack))
+
+
+def _remove_trailing_commas(text: str) -> str:
+    return re.sub(r",\s*([}\]])", r"\1", text)
+
+
+def repair_json(text: str) -> dict:
+    """Parse a json object answered by the LLM, fixing common errors locally: text around
+    the object, code fences, single quotes (python dict syntax), trailing commas and
+    truncation. Raises json.JSONDecodeError if the answer can't be repaired."""
+    text = _strip_code_fences(text)
+    start = text.find("{")
+    if start == -1:
+        raise json.JSONDecodeError("No json object found", text, 0)
+    body = text[start:]
+    end = body.rfind("}")
+    attempts = [body[: end + 1]] if end != -1 else []
+    attempts.append(close_truncated_json(body))
+    error = None
+    for attempt in attempts:
+        for candidate in (attempt, _remove_trailing_commas(attempt)):
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError as e:
+                error = error or e
+            try:
+                value = ast.literal_eval(candidate)
+                if isinstance(value, dict):
+                    return value
+            except (ValueError, SyntaxError):
+                pass
+    raise error
+
+
+def parse_json_answer(text: str) -> dict:
+    """json.loads, falling back on repair_json."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return repair_json(text)
+
+
+def stream_fields(
+    pieces: Iterable[str], on_field: Callable[[str, Any], None] = None
+) -> str:
+    """Consume a streamed answer, calling ``on_field(key, value)`` for each top-level field
+    as soon as it is complete. Returns the whole answer."""
+    parser = IncrementalJsonParser()
+    for piece in pieces:
+        for key, value in parser.feed(piece):
+            if on_field is not None:
+                on_field(key, value)
+    return parser.text
+
+
+def openai_stream_chat(
+    prompt: str, *, model: str = DFLT_MODEL, api_key: str = None, **chat_kwargs
+) -> Iterator[str]:
+    """A streaming chat: yields the pieces of the answer of an OpenAI chat model."""
+    from openai import OpenAI
+
+    client = OpenAI(api_key=api_key)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        **chat_kwargs,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
@@ -0,0 +1,75 @@
+"""Offline language detection, from stopword and accent profiles of the languages.
+
+>>> detect_language_offline("Ingénieur de données, 5 ans d'expérience dans la banque et les assurances")
+('french', 0.5)
+>>> detect_language_offline("Data engineer with an experience of 5 years in the banking industry", ["english", "french"])
+('english', 0.7)
+"""
+
+import re
+from collections import Counter
+from typing import Iterable, Tuple
+
+DFLT_SAMPLE_SIZE = 4000  # characters of the text used for the detection
+DFLT_MIN_CONFIDENCE = 0.3
+
+_stopwords = {
+    "english": """the and of to in a is for with on as at by an be this that from or are was
+        have has it its we our you your will my i he she they their which who not but all
+        also been were more than into over using years year experience skills""",
+    "french": """le la les de des du un une et en à au aux pour par sur dans avec est sont
+        ce cette ces qui que ou il elle nous vous leur leurs son sa ses mon ma mes pas plus
+        été être ans année expérience compétences formation langues""",
+    "spanish": """el la los las de del un una y en a al por para con sobre es son que o
+        este esta estos su sus mi mis no más como también años año experiencia
+        habilidades formación idiomas""",
+    "portuguese": """o a os as de do da dos das um uma e em no na nos nas por para com
+        sobre é são que ou este esta seu sua seus não mais como também anos ano
+        experiência habilidades formação idiomas""",
+    "german": """der die das den dem des ein eine einer und in im zu zum zur mit von für
+        auf ist sind auch als bei nicht ich wir sie jahre erfahrung kenntnisse
+        ausbildung sprachen""",
+    "italian": """il lo la i gli le di del della dei un una e in a al per con su è sono
+        che o questo questa suo sua non più come anche anni anno esperienza
+        competenze formazione lingue""",
+}
+stopwords = {lang: frozenset(words.split()) for lang, words in _stopwords.items()}
+
+# Characters that are (almost) specific to a language
+_specific_chars = {
+    "french": "èêëçœûùîï",
+    "spanish": "ñ¿¡",
+    "portuguese": "ãõ",
+    "german": "ßäö",
+    "italian": "ìò",
+}
+_word_pattern = re.compile(r"[^\W\d_]+")
+
+
+def language_scores(text: str, languages: Iterable[str] = None) -> Counter:
+    """Score of each (profiled) language: number of stopwords of the language in the text,
+    plus the number of characters specific to the language."""
+    languages = [l for l in (languages or stopwords) if l in stopwords]
+    words = _word_pattern.findall(text.lower())
+    word_counts = Counter(words)
+    scores = Counter({lang: 0 for lang in languages})
+    for lang in languages:
+        scores[lang] += sum(word_counts[w] for w in stopwords[lang] if w in word_counts)
+        scores[lang] += sum(text.count(c) for c in _specific_chars.get(lang, ""))
+    return scores
+
+
+def detect_language_offline(
+    text: str, languages: Iterable[str] = None, *, sample_size: int = DFLT_SAMPLE_SIZE
+) -> Tuple[str, float]:
+    """Detect the language of the text among ``languages`` (all profiled languages by
+    default). Returns the language and a confidence between 0 and 1, based on the margin
+    between the two best scores and on the amount of evidence."""
+    languages = [l.lower() for l in (languages or stopwords)]
+    scores = language_scores(text[:sample_size], languages).most_common(2)
+    if not scores or scores[0][1] == 0:
+        return None, 0.0
+    (best, best_score), second_score = scores[0], (scores[1][1] if len(scores) > 1 else 0)
+    margin = (best_score - second_score) / best_score
+    evidence = min(1.0, best_score / 10)
+    return best, round(margin * evidence, 3)
@@ -0,0 +1,233 @@
+"""Deterministic normalization of CV texts, to send fewer tokens to the LLM.
+
+The text extracted from a document has a lot of noise: runs of whitespace, bullet
+glyphs, page numbers, headers and footers repeated on every page, duplicated lines and
+boilerplate (e.g. personal data processing consent). ``normalize_cv_text`` removes it,
+taking care to keep the content lines (dates, figures, section headings), even when
+they repeat.
+
+Headers and footers are only looked for in the first and last lines of the pages, and
+must be identical on most pages (only a trailing page counter may differ):
+
+>>> text = '''Jean Dupont — Data Engineer
+... Résumé
+... •   Built   Spark   pipelines for the data platform
+... Jan 2023 - Dec 2024
+... Page 1 / 3
+... \\f
+... Jean Dupont — Data Engineer
+... Jan 2021 - Dec 2022
+... Team size
+... 12
+... ▪ Built Kafka streams for the data platform
+... Built Kafka streams for the data platform
+... Page 2 / 3
+... \\f
+... Jean Dupont — Data Engineer
+... Jan 2019 - Dec 2020
+... Team size
+... 5
+... Page 3 / 3'''
+>>> normalized, stats = normalize_cv_text_with_stats(text)
+>>> print(normalized)
+Jean Dupont — Data Engineer
+Résumé
+- Built Spark pipelines for the data platform
+Jan 2023 - Dec 2024
+<BLANKLINE>
+Jan 2021 - Dec 2022
+Team size
+12
+- Built Kafka streams for the data platform
+<BLANKLINE>
+Jan 2019 - Dec 2020
+Team size
+5
+>>> sorted(stats.items())
+[('duplicate', 1), ('page_furniture', 2), ('page_number', 3)]
+"""
+
+import re
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Set, Tuple
+
+PAGE_SEPARATOR = "\f"
+
+BULLET_CHARS = "•●○◦▪▫■□‣∙·►▶➢➤✓✔✗❖◆◇★☆-–—*"
+# a bullet is a glyph followed by a space, or a glyph that can't start a word or number
+_bullet = re.compile(
+    rf"^[{re.escape(BULLET_CHARS)}]+\s+|^[{re.escape(BULLET_CHARS[:-4])}]+"
+)
+# "Page 2", "p. 2 / 3", "2 of 3", "- 2 / 3 -": a page number wherever it is
+_page_counter = (
+    r"(?:(?:page|p\.)\s*\d{1,3}(?:\s*(?:/|of|sur|de)\s*\d{1,3})?"
+    r"|(?<!\d)\d{1,3}\s*(?:/|of|sur)\s*\d{1,3})"
+)
+_page_number = re.compile(rf"^[-–]?\s*{_page_counter}\s*[-–]?$", flags=re.IGNORECASE)
+# "2", "- 2 -": only a page number at the top or bottom of a page
+_bare_page_number = re.compile(r"^[-–]?\s*\d{1,3}\s*[-–]?$")
+_trailing_page_counter = re.compile(
+    rf"\s*[-–|]?\s*{_page_counter}\s*[-–]?$", flags=re.IGNORECASE
+)
+_invisible = re.compile("[​‌‍⁠﻿­]")
+_spaces = re.compile(r"[^\S\n]+")
+
+DFLT_BOILERPLATE_PATTERNS = (
+    r"curriculum vitae",
+    r"cv",
+    r"references? (are )?available (up)?on request",
+    r"r[ée]f[ée]rences sur demande",
+    # consent clauses only: a line mentioning GDPR or personal data may be experience
+    r"(i )?(hereby )?(consent|authori[sz]e)\b.*\b(personal data|gdpr)\b.*",
+    r"(j'|je )?(autorise|consens)\b.*\b(donn[ée]es personnelles|rgpd)\b.*",
+    r"(this )?cv (was )?(generated|created|made) (by|with) .*",
+)
+_boilerplate = re.compile(
+    "|".join(f"(?:{p})" for p in DFLT_BOILERPLATE_PATTERNS), flags=re.IGNORECASE
+)
+
+# Lines shorter than this aren't deduplicated (e.g. "Missions:", "Python")
+DFLT_MIN_DEDUP_CHARS = 20
+# Number of (non empty) lines at the top and bottom of a page where headers and footers
+# are looked for
+DFLT_EDGE_LINES = 2
+
+
+def clean_line(line: str) -> str:
+    """The line with normalized unicode, spaces and bullet.
+
+    >>> clean_line("  ▪  Data  engineering  ")
+    '- Data engineering'
+    """
+    line = unicodedata.normalize("NFKC", line)
+    line = _invisible.sub("", line)
+    line = _spaces.sub(" ", line).strip()
+    if (
+        _bullet.match(line)
+        and not _page_number.match(line)
+        and not _bare_page_number.match(line)
+    ):
+        line = _bullet.sub("", line).strip()
+        line = f"- {line}" if line else ""
+    return line
+
+
+def _furniture_key(line: str) -> str:
+    """Key of a line to detect headers and footers: a trailing page counter is ignored.
+
+    >>> _furniture_key("ACME | Page 2 / 5") == _furniture_key("ACME | Page 3 / 5")
+    True
+    >>> _furniture_key("Jan 2021 - Dec 2022") == _furniture_key("Jan 2019 - Dec 2020")
+    False
+    """
+    return _trailing_page_counter.sub("", line.lower())
+
+
+def _edge_indices(lines: List[str], n: int) -> Set[int]:
+    """Indices of the first and last ``n`` non empty lines."""
+    non_empty = [i for i, line in enumerate(lines) if line]
+    return set(non_empty[:n] + non_empty[-n:])
+
+
+def page_furniture(
+    pages: Iterable[List[str]],
+    min_share: float = 0.8,
+    edge_lines: int = DFLT_EDGE_LINES,
+) -> set:
+    """Keys of the lines found in the first or last ``edge_lines`` lines of at least
+    ``min_share`` of the pages (and at least 2)."""
+    pages = list(pages)
+    counts = Counter(
+        key
+        for lines in pages
+        for key in {_furniture_key(lines[i]) for i in _edge_indices(lines, edge_lines)}
+    )
+    min_pages = max(2, min_share * len(pages))
+    return {key for key, n in counts.items() if n >= min_pages and key}
+
+
+def normalize_cv_text_with_stats(
+    text: str,
+    *,
+    min_dedup_chars: int = DFLT_MIN_DEDUP_CHARS,
+    edge_lines: int = DFLT_EDGE_LINES,
+) -> Tuple[str, Counter]:
+    """Normalize the text of a CV (see ``normalize_cv_text``), and count the removed
+    lines for each reason (page_number, page_furniture, boilerplate, duplicate)."""
+    pages = [
+        list(map(clean_line, page.splitlines())) for page in text.split(PAGE_SEPARATOR)
+    ]
+    multi_page = len(pages) > 1
+    furniture = page_furniture(pages, edge_lines=edge_lines) if multi_page else set()
+    stats = Counter()
+    seen = set()  # deduplication keys of the kept lines
+    seen_furniture = set()
+    lines = []
+    for page in pages:
+        edges = _edge_indices(page, edge_lines)
+        top_and_bottom = _edge_indices(page, 1)
+        for i, line in enumerate(page):
+            if not line:
+                if lines and lines[-1]:
+                    lines.append("")  # keep (single) blank lines, separating sections
+                continue
+            if _page_number.match(line) or (
+                multi_page and i in top_and_bottom and _bare_page_number.match(line)
+            ):
+                stats["page_number"] += 1
+                continue
+            if i in edges and (key := _furniture_key(line)) in furniture:
+                if key in seen_furniture:
+                    stats["page_furniture"] += 1
+                    continue
+                seen_furniture.add(key)  # the first one is kept: e.g. a name
+            if _boilerplate.fullmatch(line.lstrip("- ").rstrip(" .:")):
+                stats["boilerplate"] += 1
+            elif len(line) >= min_dedup_chars and line.lstrip("- ").lower() in seen:
+                stats["duplicate"] += 1
+            else:
+                if len(line) >= min_dedup_chars:
+                    seen.add(line.lstrip("- ").lower())
+                lines.append(line)
+    return "\n".join(lines).strip(), stats
+
+
+def normalize_cv_text(
+    text: str,
+    *,
+    min_dedup_chars: int = DFLT_MIN_DEDUP_CHARS,
+    edge_lines: int = DFLT_EDGE_LINES,
+) -> str:
+    """Normalize the text of a CV before it's sent to the LLM:
+
+    - normalize unicode, remove invisible characters and collapse whitespace
+    - replace bullet glyphs by "- "
+    - drop page numbers: "Page 2", "2 / 3"..., and bare numbers when they are the first
+      or last line of a page (pages being separated by form feeds, as done by
+      smart_cv.extraction)
+    - drop the repetitions of the headers and footers: the lines found in the first or
+      last ``edge_lines`` lines of most pages
+    - drop boilerplate lines (e.g. "Curriculum Vitae", personal data consent)
+    - drop the repetitions of identical lines (of at least ``min_dedup_chars``)
+    - collapse blank lines
+
+    >>> normalize_cv_text("Curriculum Vitae\\n\\n\\n  Jean   Dupont \\n\\n\\nData engineer")
+    'Jean Dupont\\n\\nData engineer'
+
+    Consent clauses are boilerplate, but not the experience mentioning GDPR:
+
+    >>> print(normalize_cv_text(
+    ...     "Led GDPR compliance migration for client X\\n"
+    ...     "I hereby authorize the processing of my personal data (GDPR)."
+    ... ))
+    Led GDPR compliance migration for client X
+
+    Numbers inside a page are content, not page numbers:
+
+    >>> normalize_cv_text("Years of experience\\n5\\nPython")
+    'Years of experience\\n5\\nPython'
+    """
+    return normalize_cv_text_with_stats(
+        text, min_dedup_chars=min_dedup_chars, edge_lines=edge_lines
+    )[0]
@@ -1,15 +1,45 @@
 """Module to parse a resume and fill a template with the information retrieved by LLM API requests."""
 
-from docxtpl import DocxTemplate  # pip install docxtpl
+import asyncio
 import os
+import re
 from oa import prompt_function, chat
 import json
-from typing import Mapping, Union, List
-from functools import partial
+from typing import Any, Callable, Collection, Mapping, MutableMapping, Union, List
+from functools import partial, cached_property
 from dataclasses import dataclass
 from meshed import provides
 from smart_cv.VectorDB import ChunkDB
-from raglab.retrieval.lib_alexis import num_tokens
+from smart_cv.util import run_sync, to_async
+from smart_cv.cache import cached_chat, cached_achat, cached_stream_chat
+from smart_cv.instrumentation import (
+    emit,
+    instrumentation_is_on,
+    instrumented_achat,
+    event_labels,
+    timed_event,
+    instrumented_chat,
+    instrumented_stream_chat,
+)
+from smart_cv.json_stream import parse_json_answer, stream_fields
+from smart_cv.skills import extract_skills, SKILLS_KEY
+from smart_cv.translation import atranslate_values, DFLT_MAX_BATCH_TOKENS
+from smart_cv.templates import get_compiled_template
+from smart_cv.normalization import normalize_cv_text_with_stats
+from smart_cv.language import (
+    detect_language_offline,
+    DFLT_MIN_CONFIDENCE,
+    DFLT_SAMPLE_SIZE,
+)
+from smart_cv.tokens import (
+    num_tokens,
+    num_prompt_tokens,
+    chunk_token_budget,
+    TokenizedText,
+    DFLT_CONTEXT_WINDOW,
+    DFLT_MAX_COMPLETION_TOKENS,
+    DFLT_RETRIEVAL_SEGMENT_TOKENS,
+)
 
 DEBUG = False
 
@@ -19,19 +49,6 @@ def debug(message):
         print(message)
 
 
-def get_chunk_size(cv_len, cv_tokens, prompt_tokens, max_tokens):
-    assert (
-        max_tokens > prompt_tokens
-    ), f"The prompt is too long: limit is {max_tokens} tokens, prompt is {prompt_tokens} tokens"
-    if cv_tokens < max_tokens - prompt_tokens:
-        nb_chunks = 1
-    elif cv_tokens == max_tokens - prompt_tokens:
-        nb_chunks = 1
-    else:
-        nb_chunks = cv_tokens // (max_tokens - prompt_tokens) + 1
-    return cv_len // nb_chunks
-
-
 def replace_none_in_json(json_data, empty_label):
     if isinstance(json_data, dict):
         for key in json_data:
@@ -48,6 +65,295 @@ def replace_none_in_json(json_data, empty_label):
     return json_data
 
 
+DFLT_FIELD_GROUPS = {
+    "identity": ["FullName", "JobTitle", "avaibility", "mobility", "seniority"],
+    "experiences": ["experiences", "personal_projects"],
+    "education": ["education", "certifications", "languages"],
+    "skills": ["skills", "interests"],
+}
+
+
+def partition_prompts(prompts: Mapping, field_groups: Mapping[str, List[str]]):
+    """Split the prompts in groups of keys. Keys which are in no group make a last group.
+
+    >>> partition_prompts({"FullName": "...", "skills": "...", "hobbies": "..."},
+    ...                   {"identity": ["FullName", "JobTitle"], "skills": ["skills"]})
+    [{'FullName': '...'}, {'skills': '...'}, {'hobbies': '...'}]
+    """
+    grouped_keys = set()
+    groups = []
+    for keys in field_groups.values():
+        group = {k: prompts[k] for k in keys if k in prompts and k not in grouped_keys}
+        grouped_keys.update(group)
+        if group:
+            groups.append(group)
+    others = {k: v for k, v in prompts.items() if k not in grouped_keys}
+    if others:
+        groups.append(others)
+    return groups
+
+
+def json_repair_prompt(content: str, error: Exception):
+    return f"This json is not well formatted {content}. Here is the error{error}). Please correct it and return the corrected json."
+
+
+def aggregation_prompt(first, second):
+    return f"Aggregate the 2 following contents without repetitions: {str(first)} and {str(second)}"
+
+
+def is_empty_value(value):
+    """Tell if a retrieved value holds no information.
+
+    >>> is_empty_value("None"), is_empty_value([]), is_empty_value("Python")
+    (True, True, False)
+    """
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() in ("", "none")
+    if isinstance(value, (list, dict)):
+        return len(value) == 0
+    return False
+
+
+def _dedup_key(item):
+    if isinstance(item, str):
+        return item.strip().casefold()
+    return json.dumps(item, sort_keys=True, default=str)
+
+
+# a qualifier of an item: "(C1)", " - fluent", ": native"
+_item_qualifier = re.compile(r"\s*\(.*?\)|\s+[-–]\s.*$|\s*:.*$")
+_spaces = re.compile(r"\s+")
+# Keys identifying a record (an experience, a diploma...) of a list
+RECORD_ID_KEYS = ("company", "school", "title", "diploma", "name", "dates")
+
+
+def _item_key(text: str) -> str:
+    """Key of a string item, without its qualifiers.
+
+    >>> _item_key("English(C1)"), _item_key("english - fluent"), _item_key("C++")
+    ('english', 'english', 'c++')
+    """
+    key = _spaces.sub(" ", _item_qualifier.sub("", text)).strip().casefold()
+    return key or text.strip().casefold()
+
+
+def _years(text: str) -> set:
+    return set(re.findall(r"\d{4}", str(text)))
+
+
+def _same_id(key: str, first, second) -> bool:
+    first, second = str(first), str(second)
+    if key == "dates" and _years(first) and _years(second):
+        return _years(first) == _years(second)
+    return _contains_words(first, second.strip()) or _contains_words(
+        second, first.strip()
+    )
+
+
+def same_record(first: Mapping, second: Mapping) -> bool:
+    """Tell if two dicts describe the same record (e.g. an experience extracted from two
+    overlapping chunks): none of the ids (RECORD_ID_KEYS) they both have differ, and
+    they share at least two ids (or the only one they have).
+
+    >>> same_record({"company": "ACME", "title": "Data engineer", "dates": "2020-2023"},
+    ...             {"company": "Acme", "title": "Senior data engineer", "dates": "2020 - 2023"})
+    True
+    >>> same_record({"company": "ACME", "dates": "2020-2023"},
+    ...             {"company": "ACME", "dates": "2018-2020"})
+    False
+    """
+    ids = lambda d: {
+        k: d[k] for k in RECORD_ID_KEYS if k in d and not is_empty_value(d[k])
+    }
+    first_ids, second_ids = ids(first), ids(second)
+    common = first_ids.keys() & second_ids.keys()
+    if not common or any(
+        not _same_id(k, first_ids[k], second_ids[k]) for k in common
+    ):
+        return False
+    return len(common) >= min(2, len(first_ids), len(second_ids))
+
+
+def _n_filled(value) -> int:
+    """Number of non empty leaf values."""
+    if isinstance(value, dict):
+        return sum(_n_filled(v) for v in value.values())
+    if isinstance(value, list):
+        return sum(_n_filled(v) for v in value)
+    return 0 if is_empty_value(value) else 1
+
+
+def same_item(first, second) -> bool:
+    """Tell if two list items are the same, possibly with more or less detail."""
+    if isinstance(first, str) and isinstance(second, str):
+        return _item_key(first) == _item_key(second)
+    if isinstance(first, dict) and isinstance(second, dict):
+        return same_record(first, second)
+    return _dedup_key(first) == _dedup_key(second)
+
+
+def merge_items(first, second):
+    """The richest form of two same items: the longest string, or the record with the
+    most values, completed with the values of the other one."""
+    if isinstance(first, dict) and isinstance(second, dict):
+        if _n_filled(second) > _n_filled(first):
+            first, second = second, first
+        return merge_dicts(first, second)[0]
+    if isinstance(first, str) and isinstance(second, str):
+        return second if len(second.strip()) > len(first.strip()) else first
+    return first
+
+
+def merge_lists(first: list, second: list):
+    """Union of two lists, keeping order and dropping empty items and duplicates. Items
+    given twice with more or less detail (see same_item) are kept once, in their richest
+    form (see merge_items).
+
+    >>> merge_lists(["Python", "SQL"], ["sql", "Spark", "none"])
+    ['Python', 'SQL', 'Spark']
+    >>> merge_lists(["English", "French"], ["english (C1)", "Spanish"])
+    ['english (C1)', 'French', 'Spanish']
+    """
+    merged = []
+    for item in list(first) + list(second):
+        if is_empty_value(item):
+            continue
+        for i, kept in enumerate(merged):
+            if same_item(kept, item):
+                merged[i] = merge_items(kept, item)
+                break
+        else:
+            merged.append(item)
+    return merged
+
+
+# Keys whose values are lists of items, possibly given as comma separated strings (as in
+# the json example: "skills": "Python, SQL, Machine Learning")
+DFLT_LIST_KEYS = (
+    "skills",
+    "languages",
+    "certifications",
+    "personal_projects",
+    "interests",
+    "tools",
+    "tasks",
+)
+# a comma, semicolon or new line which isn't inside parentheses
+_list_separator = re.compile(r"\s*[,;\n]\s*(?![^()]*\))")
+
+
+def split_list_value(value) -> list:
+    """The items of a list-like value: a list, or a string of separated items.
+
+    >>> split_list_value("Python (pandas, numpy), SQL; Spark")
+    ['Python (pandas, numpy)', 'SQL', 'Spark']
+    """
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [item for item in _list_separator.split(value.strip()) if item]
+    return [value]
+
+
+def _contains_words(text: str, words: str) -> bool:
+    """Tell if ``words`` are in ``text``, not as a part of a bigger word.
+
+    >>> _contains_words("Senior data engineer", "data engineer")
+    True
+    >>> _contains_words("JavaScript", "Java"), _contains_words("C++", "C")
+    (False, False)
+    """
+    pattern = rf"(?<![\w+#&.]){re.escape(words)}(?![\w+#&])"
+    return re.search(pattern, text, flags=re.IGNORECASE) is not None
+
+
+def merge_values(first, second, list_like: bool = False):
+    """Merge two values of the same key without LLM.
+    Returns the merged value and a boolean telling if the values are conflicting
+    (in which case the merged value is the first one).
+    The values of list-like keys (``list_like=True``, see DFLT_LIST_KEYS) are merged as
+    lists of items, keeping the type of the first value (list or separated string).
+
+    >>> merge_values("none", "Paris")
+    ('Paris', False)
+    >>> merge_values(["English"], "French")
+    (['English', 'French'], False)
+    >>> merge_values("Python, SQL", "sql, Spark, Kafka", list_like=True)
+    ('Python, SQL, Spark, Kafka', False)
+    >>> merge_values("Data engineer", "Senior data engineer")
+    ('Senior data engineer', False)
+    >>> merge_values("Data engineer", "Full stack developer")
+    ('Data engineer', True)
+    >>> merge_values("Java", "JavaScript")
+    ('Java', True)
+    """
+    if is_empty_value(second):
+        return first, False
+    if is_empty_value(first):
+        return second, False
+    if isinstance(first, dict) and isinstance(second, dict):
+        merged, conflicts = merge_dicts(first, second)
+        return merged, bool(conflicts)
+    if list_like:
+        merged = merge_lists(split_list_value(first), split_list_value(second))
+        if isinstance(first, str):
+            merged = ", ".join(map(str, merged))
+        return merged, False
+    if isinstance(first, list) or isinstance(second, list):
+        as_list = lambda v: v if isinstance(v, list) else [v]
+        return merge_lists(as_list(first), as_list(second)), False
+    if _dedup_key(first) == _dedup_key(second):
+        return first, False
+    if isinstance(first, str) and isinstance(second, str):
+        if _contains_words(second, first.strip()):
+            return second, False
+        if _contains_words(first, second.strip()):
+            return first, False
+    return first, True
+
+
+def merge_dicts(
+    first: Mapping, second: Mapping, list_keys: Collection[str] = DFLT_LIST_KEYS
+):
+    """Merge two (nested) dicts without LLM. Returns the merged dict and the paths (tuples
+    of keys) of the conflicting values, whose merged value is the one of the first dict.
+
+    >>> merge_dicts({"skills": "Python", "JobTitle": "Data engineer"},
+    ...             {"skills": "Spark", "JobTitle": "Mobile developer", "mobility": "Paris"})
+    ({'skills': 'Python, Spark', 'JobTitle': 'Data engineer', 'mobility': 'Paris'}, [('JobTitle',)])
+    >>> merge_dicts({"address": {"city": "Paris", "country": "France"}},
+    ...             {"address": {"city": "Lyon", "zip": "69001"}})
+    ({'address': {'city': 'Paris', 'country': 'France', 'zip': '69001'}}, [('address', 'city')])
+    """
+    merged, conflicts = dict(first), []
+    for k, v in second.items():
+        if k not in merged:
+            merged[k] = v
+        elif isinstance(merged[k], dict) and isinstance(v, dict):
+            merged[k], sub_conflicts = merge_dicts(merged[k], v, list_keys)
+            conflicts.extend((k, *path) for path in sub_conflicts)
+        else:
+            merged[k], is_conflict = merge_values(merged[k], v, k in list_keys)
+            if is_conflict:
+                conflicts.append((k,))
+    return merged, conflicts
+
+
+def get_path(d: Mapping, path: tuple):
+    """The value of a nested dict at path (a tuple of keys)."""
+    for k in path:
+        d = d[k]
+    return d
+
+
+def set_path(d: MutableMapping, path: tuple, value):
+    """Set the value of a nested dict at path (a tuple of keys)."""
+    *parents, last = path
+    get_path(d, parents)[last] = value
+
+
 @dataclass
 @provides("raw_dict_content")
 class ContentRetriever:
@@ -56,7 +362,36 @@ class ContentRetriever:
         cv_path (str): Path to the resume to parse.
         template_path (str): Path to the template to fill.
         prompts (dict or str): A dict of prompts for each information to retrieve or a path to a json file containing the prompts.
-        api_key (str): OpenAI API key."""
+        api_key (str): OpenAI API key.
+        max_workers (int): Maximum number of chunks sent to the LLM at the same time. 1 means sequential requests.
+        cache (bool or MutableMapping): Cache of the LLM responses. True uses the default app cache, False disables caching.
+        top_k (int): If given (and the CV doesn't fit in one chunk), each prompt key is only sent with the top_k segments of the CV
+            most relevant to it, instead of every chunk. The segments (of retrieval_segment_tokens tokens) of the keys of a request
+            are packed in the chunk token budget.
+        retrieval_segment_tokens (int): Size, in tokens, of the segments searched when top_k is given.
+        field_groups (dict): If given, the prompt keys are split in these groups of keys (e.g. DFLT_FIELD_GROUPS)
+            and each group is retrieved by separate, concurrent requests, with shorter answers.
+        context_window (int): Context window of the model, in tokens. The CV is split in chunks of as many tokens as fit along with the prompt.
+        max_completion_tokens (int): Tokens of the context window reserved for the answer of the model.
+        chunk_overlap (int): Overlap of the chunks, in tokens.
+        stream_chat (Callable): Optional streaming chat (yielding pieces of the answer, e.g. json_stream.openai_stream_chat),
+            used instead of chat to retrieve the content.
+        on_field (Callable): Called with (key, value) for each field of each chunk answer as soon as it is streamed
+            (before aggregation).
+        local_skills (bool): Retrieve the 'skills' field locally by matching the stacks keywords in the resume,
+            instead of asking the LLM (the stacks are then not sent in the prompts).
+        achat (Callable): Optional async chat (a coroutine function), used instead of chat, e.g. to interleave the requests of many
+            CVs in one event loop (see smart_cv.async_parser).
+        normalize (bool): Normalize the CV text before chunking it (whitespace, bullets, page numbers, headers and footers,
+            boilerplate and duplicated lines, see smart_cv.normalization), to send fewer tokens to the LLM.
+
+    The retrieval is implemented by coroutines (aretrieve_content, acall...), the sync
+    methods (retrieve_content, __call__...) run them in an event loop.
+
+    The token counts of the prompt, of the CV and of each chunk are available as
+    prompt_tokens, cv_tokens and chunk_tokens (e.g. for cost accounting), and the number
+    of tokens removed by the normalization as tokens_saved (only counted when an event
+    sink is registered, see smart_cv.instrumentation: None otherwise)."""
 
     cv_text: str
     prompts: Mapping
@@ -69,37 +404,107 @@ class ContentRetriever:
     api_key: str = None
     chunk_overlap: int = 100
     temperature: float = 0.0
+    max_workers: int = 1
+    cache: Union[bool, MutableMapping] = True
+    top_k: int = None
+    retrieval_segment_tokens: int = DFLT_RETRIEVAL_SEGMENT_TOKENS
+    field_groups: Mapping[str, List[str]] = None
+    context_window: int = DFLT_CONTEXT_WINDOW
+    max_completion_tokens: int = DFLT_MAX_COMPLETION_TOKENS
+    stream_chat: Callable = None
+    on_field: Callable[[str, Any], None] = None
+    local_skills: bool = False
+    achat: Callable = None
+    normalize: bool = True
 
     def __post_init__(
         self,
         **kwargs,
     ):
         self.dict_content = {}
-        self.chat = partial(chat, temperature=self.temperature)
-        prompt_tokens = num_tokens(self.content_request("", "")) + num_tokens(
-            str(self.prompts)
-        )
-        cv_tokens = num_tokens(self.cv_text)
-        max_tokens = 4000  # TODO : Find a way to get the max tokens from the API
-
-        chunk_size = get_chunk_size(
-            len(self.cv_text), cv_tokens, prompt_tokens, max_tokens
+        # instrumented inside the cache: only the actual LLM calls are recorded
+        _chat = instrumented_chat(chat)
+        if self.cache is not False:
+            _chat = cached_chat(_chat, cache=None if self.cache is True else self.cache)
+        self.chat = partial(_chat, temperature=self.temperature)
+        if self.stream_chat is not None:
+            self.stream_chat = instrumented_stream_chat(self.stream_chat)
+            if self.cache is not False:
+                self.stream_chat = cached_stream_chat(
+                    self.stream_chat, cache=None if self.cache is True else self.cache
+                )
+            self.stream_chat = partial(self.stream_chat, temperature=self.temperature)
+        if self.achat is not None:
+            _achat = instrumented_achat(self.achat)
+            if self.cache is not False:
+                _achat = cached_achat(
+                    _achat, cache=None if self.cache is True else self.cache
+                )
+            self.achat = partial(_achat, temperature=self.temperature)
+        self._semaphore = None
+        self.prompt_tokens = num_prompt_tokens(
+            self.content_request("", "")
+        ) + num_prompt_tokens(str(self.prompts))
+        raw_cv_text = self.cv_text
+        if self.normalize:
+            self.cv_text, removed_lines = normalize_cv_text_with_stats(self.cv_text)
+        # The CV is encoded once: its token offsets are reused to split it in chunks
+        tokenized_cv = TokenizedText(self.cv_text)
+        # the raw text is only encoded when someone listens to the events
+        self.tokens_saved = None if self.normalize else 0
+        if self.normalize and instrumentation_is_on():
+            original_tokens = num_tokens(raw_cv_text)
+            self.tokens_saved = original_tokens - len(tokenized_cv)
+            debug(f"Normalization saved {self.tokens_saved}/{original_tokens} tokens")
+            emit(
+                "cv_normalization",
+                original_tokens=original_tokens,
+                tokens_saved=self.tokens_saved,
+                removed_lines=dict(removed_lines),
+            )
+        self.cv_tokens = len(tokenized_cv)
+        self._tokenized_cv = tokenized_cv
+        chunk_size = chunk_token_budget(
+            self.context_window, self.prompt_tokens, self.max_completion_tokens
         )
-        self.db = ChunkDB(
-            {str(kwargs.get("cv_name", "cv")): self.cv_text},
+        split_points = tokenized_cv.split_points(chunk_size, self.chunk_overlap)
+        self.chunk_tokens = [end - start for start, end in split_points]
+        cv_name = self._cv_name = str(kwargs.get("cv_name", "cv"))
+        segment_keys = [
+            (cv_name, tokenized_cv.char_index(start), tokenized_cv.char_index(end))
+            for start, end in split_points
+        ]
+        self.segment_tokens = dict(zip(segment_keys, self.chunk_tokens))
+        self.db = ChunkDB.from_segment_keys(
+            {cv_name: self.cv_text},
+            segment_keys,
             chunk_size=chunk_size,
             chunk_overlap=self.chunk_overlap,
+            length_function=num_tokens,
         )
 
         debug(f"Chunk size: {chunk_size}")
+        emit(
+            "cv_chunks",
+            n_chunks=len(split_points),
+            cv_tokens=self.cv_tokens,
+            chunk_size=chunk_size,
+            prompt_tokens=self.prompt_tokens,
+        )
 
     def content_request(
         self, json_string=None, chunk_context=None, stacks=None, json_example=None
     ):
         if stacks is None:
-            stacks = self.stacks
+            stacks = "" if self.local_skills else self.stacks
         if json_example is None:
             json_example = self.json_example
+        stacks_request = (
+            f"""Here are keywords of technical stack that should be found in the resume to fill 'skills': 
+                {stacks}"""
+            if stacks
+            else ""
+        )
         content_prompt = f"""
                 I will give you a resume and you will fill the provided json. 
                 The keys have to be respected and the corresponding description will be replaced by the retrieved information. 
@@ -116,34 +521,86 @@ class ContentRetriever:
 
                 Here is the resume you have to base on: {chunk_context} 
                                    
-                Here are keywords of technical stack that should be found in the resume to fill 'skills': 
-                {stacks}
+                {stacks_request}
                 """
         return content_prompt
 
-    def aggregate_dicts(self, dict_list: List[Mapping]):
-        """Aggregate the information of a list of dictionaries."""
-        if len(dict_list) == 1:
-            return dict_list[0]
-        result = dict_list[0]
-        for d in dict_list[1:]:
-            try:
-                result_str = self.chat(
-                    f"""Aggregate the 2 following dicts 
-                                       values without repetitions and return the dict with 
-                                       same keys and aggregated values: 
-                                       first dict: {str(result)}
-                                        second dict: {str(d)}"""
+    async def _ask(self, prompt: str, stream: bool = False) -> str:
+        """The answer of the LLM to the prompt, at most max_workers requests being made at
+        the same time: through achat if given, else through chat, in threads (in the
+        current thread when max_workers is 1). If stream and stream_chat is set, the
+        answer is streamed and its fields passed to on_field as soon as they are complete.
+        """
+        async with self._request_slots():
+            if stream and self.stream_chat is not None:
+                ask = lambda: stream_fields(self.stream_chat(prompt), self.on_field)
+            elif self.achat is not None:
+                return await self.achat(prompt)
+            else:
+                ask = partial(self.chat, prompt)
+            if (self.max_workers or 1) <= 1:
+                return ask()
+            return await asyncio.to_thread(ask)
+
+    def _request_slots(self) -> asyncio.Semaphore:
+        # A semaphore is bound to an event loop, so one is made per running loop
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(max(self.max_workers or 1, 1)))
+        return self._semaphore[1]
+
+    async def aaggregate_dicts(self, dict_list: List[Mapping]):
+        """Aggregate the information of a list of dictionaries.
+        The dicts are merged pairwise in a tree-shaped reduction (log2(n) levels, pairs of a
+        level merged concurrently). Lists and matching scalars are merged deterministically,
+        only conflicting free-text values are aggregated by the LLM."""
+        dict_list = list(dict_list)
+        if not dict_list:
+            return {}
+        while len(dict_list) > 1:
+            dict_list = await asyncio.gather(
+                *(
+                    self.aaggregate_pair(*dict_list[i : i + 2])
+                    for i in range(0, len(dict_list), 2)
                 )
-            except Exception as e:
-                print(e, "Trying again...")
-                return self.aggregate_dict_values(dict_list)
-            try:
-                result = json.loads(result_str)
-            except json.JSONDecodeError as e:
-                print("The json is not well formatted. Trying again...")
-                return self.aggregate_dict_values(dict_list)
-        return result
+            )
+        return dict_list[0]
+
+    async def aaggregate_pair(self, first: Mapping, second: Mapping = None):
+        """Aggregate two dicts: deterministic merge, then LLM aggregation of the conflicting
+        values (only the conflicting leaves of nested dicts are sent)."""
+        if second is None:
+            return first
+        merged, conflicts = merge_dicts(first, second)
+        aggregated = await asyncio.gather(
+            *(
+                self.aaggregate_values(get_path(first, path), get_path(second, path))
+                for path in conflicts
+            )
+        )
+        for path, value in zip(conflicts, aggregated):
+            set_path(merged, path, value)
+        return merged
+
+    async def aaggregate_values(self, first, second):
+        """Aggregate two conflicting values with the LLM. Keeps the first one if the request fails."""
+        try:
+            return await self._ask(aggregation_prompt(first, second))
+        except Exception as e:
+            print(e, "Keeping the first value...")
+            return first
+
+    def aggregate_dicts(self, dict_list: List[Mapping]):
+        """Sync aaggregate_dicts."""
+        return run_sync(self.aaggregate_dicts(dict_list))
+
+    def aggregate_pair(self, first: Mapping, second: Mapping = None):
+        """Sync aaggregate_pair."""
+        return run_sync(self.aaggregate_pair(first, second))
+
+    def aggregate_values(self, first, second):
+        """Sync aaggregate_values."""
+        return run_sync(self.aaggregate_values(first, second))
 
     def aggregate_dict_values(self, dict_list: List[Mapping]):
         """Aggregate the information of a list of dictionaries."""
@@ -151,93 +608,333 @@ class ContentRetriever:
         for d in dict_list:
             for k, v in d.items():
                 if k in result:
-                    result[k] = self.chat(
-                        f"Aggregate the 2 following contents without repetitions: {str(result[k])} and {str(v)}"
-                    )
+                    result[k] = self.chat(aggregation_prompt(result[k], v))
                 else:
                     result[k] = v
         return result
 
-    def retrieve_content(self, json_string: str = None, inplace=True):
-        """Given a mapping of information to retrieve, retrieve all the information and put it in the dict_content.
-        example:    mapping = {"JobTitle": "Give the job title of the candidate",
-                            "avaibility": "When is the candidate available to start" }
+    @cached_property
+    def retrieval_tokens(self) -> Mapping[tuple, int]:
+        """The number of tokens of each small (paragraph sized) segment of the CV, searched
+        for the parts of the CV relevant to a field."""
+        segment_size = min(self.retrieval_segment_tokens, self.db.chunk_size)
+        char_index = self._tokenized_cv.char_index
+        return {
+            (self._cv_name, char_index(start), char_index(end)): end - start
+            for start, end in self._tokenized_cv.split_points(segment_size)
+        }
 
-                    Returns: {"JobTitle": "Data Scientist",
-                            "avaibility": "As soon as possible"}
-        """
-        content_list = []
-        if json_string is None:
-            json_string = self.prompts
+    @cached_property
+    def retrieval_db(self) -> ChunkDB:
+        """Index of the retrieval segments (see retrieval_tokens)."""
+        return ChunkDB.from_segment_keys(
+            {self._cv_name: self.cv_text},
+            list(self.retrieval_tokens),
+            chunk_size=min(self.retrieval_segment_tokens, self.db.chunk_size),
+            chunk_overlap=0,
+            length_function=num_tokens,
+        )
+
+    def ranked_segments(self, query: str) -> List[tuple]:
+        """All the retrieval segments, most relevant to the query first."""
+        db = self.retrieval_db
+        return list(db.search(query, k=len(db.segments)))
+
+    def relevant_segments(self, query: str, k: int):
+        """The (at most) k segments most relevant to the query which fit in the chunk token
+        budget, in document order."""
+        return self.pack_segments({query: self.ranked_segments(query)}, k)[0]
+
+    def pack_segments(self, rankings: Mapping[str, List[tuple]], k: int):
+        """Select the segments of the rankings (of each key) in the chunk token budget,
+        round-robin: the best segment of every key, then the second best... up to k per
+        key. Returns the selected segments (in document order) and the keys whose best
+        segment was selected."""
+        tokens = self.retrieval_tokens
+        selected, n_tokens, served = set(), 0, set()
+        for rank in range(k):
+            for key, ranking in rankings.items():
+                if not ranking:  # nothing to retrieve (empty CV)
+                    served.add(key)
+                if rank >= len(ranking) or (rank > 0 and key not in served):
+                    continue
+                segment = ranking[rank]
+                if segment not in selected:
+                    if n_tokens + tokens[segment] > self.db.chunk_size:
+                        continue
+                    selected.add(segment)
+                    n_tokens += tokens[segment]
+                served.add(key)
+        return tuple(sorted(selected)), served
 
-        for segment_index in self.db.segments:
-            chunk_context = self.db.segments[segment_index]
-            content = self.chat(
-                self.content_request(
-                    json_string=json_string,
-                    chunk_context=chunk_context,
-                    stacks=self.stacks,
-                    json_example=self.json_example,
+    def segments_context(self, segment_keys) -> str:
+        """The text of the segments (in document order), contiguous ones joined back."""
+        ranges = []
+        for _, start, end in sorted(segment_keys):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return "\n".join(self.cv_text[start:end] for start, end in ranges)
+
+    def relevant_requests(self, prompts: Mapping, k: int):
+        """Requests of the prompts with the k segments most relevant to each prompt key, the
+        segments of all the keys being packed in the chunk token budget (see pack_segments).
+        The keys whose segments don't fit go to another request.
+        Returns a list of (prompts, chunk_context, chunk_tokens) triples."""
+        rankings = {
+            key: self.ranked_segments(f"{key}: {prompt}")
+            for key, prompt in prompts.items()
+        }
+        requests = []
+        while rankings:
+            segment_keys, served = self.pack_segments(rankings, k)
+            requests.append(
+                (
+                    {key: prompts[key] for key in rankings if key in served},
+                    self.segments_context(segment_keys),
+                    sum(self.retrieval_tokens[s] for s in segment_keys),
                 )
             )
+            rankings = {key: r for key, r in rankings.items() if key not in served}
+        return requests
+
+    def local_content(self, json_string=None):
+        """Split off the fields retrieved locally, without LLM.
+        Returns the prompts left for the LLM and the locally retrieved content."""
+        if json_string is None:
+            json_string = self.prompts
+        if (
+            self.local_skills
+            and isinstance(json_string, Mapping)
+            and SKILLS_KEY in json_string
+        ):
+            prompts = {k: v for k, v in json_string.items() if k != SKILLS_KEY}
+            return prompts, {SKILLS_KEY: extract_skills(self.cv_text, self.stacks)}
+        return json_string, {}
+
+    def content_requests(self, json_string=None):
+        """The (prompts, chunk_context, chunk_tokens) to send to retrieve the content: every chunk with
+        all the prompts, or, if top_k is set, each prompt with its relevant segments.
+        If field_groups is set, this is done for each group of prompts separately."""
+        if json_string is None:
+            json_string = self.prompts
+        if not isinstance(json_string, Mapping):
+            return self.chunk_requests(json_string)
+        prompt_groups = (
+            partition_prompts(json_string, self.field_groups)
+            if self.field_groups
+            else [json_string]
+        )
+        requests = []
+        for prompts in prompt_groups:
+            if self.top_k and len(self.db.segments) > 1:
+                requests.extend(self.relevant_requests(prompts, self.top_k))
+            else:
+                requests.extend(self.chunk_requests(prompts))
+        return requests
+
+    def chunk_requests(self, json_string):
+        """Pair the prompts with every chunk of the CV (and its number of tokens)."""
+        return [
+            (json_string, self.db.segments[key], self.segment_tokens.get(key))
+            for key in self.db.segments
+        ]
+
+    async def aretrieve_chunk_content(
+        self, chunk_context: str, json_string: str = None, chunk_tokens: int = None
+    ):
+        """Retrieve the information of a single chunk. If the LLM answer is not a valid json,
+        it is repaired locally if possible, else the LLM is asked once to correct it.
+        Returns the JSONDecodeError if it is still invalid.
+        chunk_tokens (the number of tokens of the chunk, for the ``chunk`` event) is only
+        counted if not given, and if someone listens to the events.
+        """
+        if json_string is None:
+            json_string = self.prompts
+        prompt = self.content_request(
+            json_string=json_string,
+            chunk_context=chunk_context,
+            json_example=self.json_example,
+        )
+        fields = list(json_string) if isinstance(json_string, Mapping) else None
+        if chunk_tokens is None and instrumentation_is_on():
+            chunk_tokens = num_tokens(chunk_context)
+        with event_labels(fields=fields), timed_event(
+            "chunk", chunk_tokens=chunk_tokens
+        ) as event:
+            content = await self._ask(prompt, stream=True)
             try:
-                content_json = json.loads(content)
+                return parse_json_answer(content)
             except json.JSONDecodeError as e:
-                content = self.chat(
-                    f"This json is not well formatted {content}. Here is the error{e}). Please correct it and return the corrected json."
-                )
+                event["retried"] = True
+                with event_labels(retry=True):
+                    content = await self._ask(json_repair_prompt(content, e))
                 print("The json is not well formatted. Trying again...")
                 try:
-                    content_json = json.loads(content)
+                    return json.loads(content)
                 except json.JSONDecodeError as e:
                     print("The json is still not well formatted. Please correct it.")
+                    event["error"] = repr(e)
                     return e
-            content_list.append(content_json)
-        full_content = self.aggregate_dicts(content_list)
+
+    async def aretrieve_content(self, json_string: str = None, inplace=True):
+        """Given a mapping of information to retrieve, retrieve all the information and put it in the dict_content.
+        example:    mapping = {"JobTitle": "Give the job title of the candidate",
+                            "avaibility": "When is the candidate available to start" }
+
+                    Returns: {"JobTitle": "Data Scientist",
+                            "avaibility": "As soon as possible"}
+        """
+        json_string, local_content = self.local_content(json_string)
+        requests = self.content_requests(json_string) if json_string else []
+        content_list = await asyncio.gather(
+            *(
+                self.aretrieve_chunk_content(chunk_context, prompts, chunk_tokens)
+                for prompts, chunk_context, chunk_tokens in requests
+            )
+        )
+        for content_json in content_list:
+            if isinstance(content_json, json.JSONDecodeError):
+                return content_json
+        full_content = await self.aaggregate_dicts(content_list)
+        full_content.update(local_content)
         if inplace:
             self.dict_content = full_content
         return full_content
 
-    def __call__(self):
-        self.retrieve_content()
+    async def acall(self):
+        await self.aretrieve_content()
         return self.dict_content
 
+    def retrieve_chunk_content(
+        self, chunk_context: str, json_string: str = None, chunk_tokens: int = None
+    ):
+        """Sync aretrieve_chunk_content."""
+        return run_sync(
+            self.aretrieve_chunk_content(chunk_context, json_string, chunk_tokens)
+        )
 
-def detect_language(cv_text: str, language_list: List[str], chat):
-    """Detect the language of the text."""
-    lang = chat(
-        f"Detect the language of the following text: {cv_text} \n Return english, french, spanish or potuguese."
-    )
+    def retrieve_content(self, json_string: str = None, inplace=True):
+        """Sync aretrieve_content."""
+        return run_sync(self.aretrieve_content(json_string, inplace))
+
+    def __call__(self):
+        return run_sync(self.acall())
+
+
+def language_detection_prompt(cv_text: str):
+    return f"Detect the language of the following text: {cv_text} \n Return english, french, spanish or potuguese."
+
+
+def parse_language(lang: str, language_list: List[str]):
+    """Get the language from the LLM answer to the language detection prompt.
+
+    >>> parse_language("The text is in French.", ["english", "french"])
+    'french'
+    >>> parse_language("Language: Spanish.", ["english", "french"])
+    'spanish'
+    """
     for l in language_list:
         if l.lower() in lang.lower():
             return l.lower()
-    return lang.split(":")[1].lower()
+    return lang.split(":")[-1].strip(" .\n").lower()
 
 
-@provides("translated_dict_content")
-def translate_content(
+def offline_language(cv_text: str, language_list: List[str], min_confidence: float):
+    """The language detected offline, or None if the detection isn't confident enough."""
+    language, confidence = detect_language_offline(cv_text, language_list)
+    if language is not None and confidence >= min_confidence:
+        return language
+    return None
+
+
+async def adetect_language(
+    cv_text: str,
+    language_list: List[str],
+    achat=None,
+    *,
+    min_confidence: float = DFLT_MIN_CONFIDENCE,
+):
+    """Detect the language of the text, offline (see smart_cv.language).
+    The LLM is only asked (if achat is given) when the offline detection isn't confident enough."""
+    language = offline_language(cv_text, language_list, min_confidence)
+    if language is not None:
+        return language
+    if achat is None:
+        language, _ = detect_language_offline(cv_text, language_list)
+        return language or language_list[0].lower()
+    lang = await achat(language_detection_prompt(cv_text[:DFLT_SAMPLE_SIZE]))
+    return parse_language(lang, language_list)
+
+
+def detect_language(
+    cv_text: str,
+    language_list: List[str],
+    chat=None,
+    *,
+    min_confidence: float = DFLT_MIN_CONFIDENCE,
+):
+    """Sync adetect_language, with a sync chat."""
+    return run_sync(
+        adetect_language(
+            cv_text,
+            language_list,
+            None if chat is None else to_async(chat),
+            min_confidence=min_confidence,
+        )
+    )
+
+
+async def atranslate_content(
     dict_content,
     cv_text: str,
     language: str = "automatic",
     *,
     language_list: List[str],
-    chat,
+    achat,
+    translation_memory: MutableMapping = None,
+    max_batch_tokens: int = DFLT_MAX_BATCH_TOKENS,
 ):
-    """Translate the content in the given language."""
-
+    """Translate the content in the given language.
+    The string values are translated separately (see smart_cv.translation): values needing no
+    translation are skipped, and known translations are taken from the translation memory."""
     if language == "automatic":
-        language = detect_language(cv_text, language_list, chat)
+        language = await adetect_language(cv_text, language_list, achat)
     if language == "english":
         return dict_content
-    else:
-        translated_content = chat(
-            f"""Translate the values of the following json in : {language}  
-                                            Keep the keys as they are and translate the values. Return the translated json.
-                                            Do not translate 'none'.
-                                            Keep json fromat (double quotes).
-                                            Content: {str(dict_content)} """
+    return await atranslate_values(
+        dict_content,
+        language,
+        achat=achat,
+        memory=translation_memory,
+        max_batch_tokens=max_batch_tokens,
+    )
+
+
+@provides("translated_dict_content")
+def translate_content(
+    dict_content,
+    cv_text: str,
+    language: str = "automatic",
+    *,
+    language_list: List[str],
+    chat,
+    translation_memory: MutableMapping = None,
+    max_batch_tokens: int = DFLT_MAX_BATCH_TOKENS,
+):
+    """Sync atranslate_content, with a sync chat."""
+    return run_sync(
+        atranslate_content(
+            dict_content,
+            cv_text,
+            language,
+            language_list=language_list,
+            achat=to_async(chat),
+            translation_memory=translation_memory,
+            max_batch_tokens=max_batch_tokens,
         )
-    return json.loads(translated_content)
+    )
 
 
 @provides("labeled_optional_content")
@@ -319,19 +1016,22 @@ from typing import Mapping
 class TemplateFiller:
     """Class to fill a docx template with the information provided in the content dict.
     Warning: The template should have the same labels as the keys of the content dict.
+    The template is compiled once per path (see smart_cv.templates), so making a filler
+    for every CV doesn't re-read nor re-parse the template file.
     """
 
     template_path: str
     content: Mapping
 
     def __post_init__(self):
-        self.template = DocxTemplate(self.template_path)
-        self.blanks = self.template.undeclared_template_variables
+        self.compiled = get_compiled_template(self.template_path)
+        self.template = self.compiled.new_template()
+        self.blanks = self.compiled.blanks
 
     def fill_template(self, **kwargs):
         """Fill the template with the information in the dict_content."""
         self.template.render(
-            {label: (self.content.get(label, "")) for label in self.blanks}
+            self.compiled.context(self.content), jinja_env=self.compiled.jinja_env
         )
 
     def save_template(self, save_path):
@@ -344,8 +1044,6 @@ class TemplateFiller:
         self.save_template(save_path)
 
 
-def template_bytes(template_path: str, content: Mapping):
+def template_bytes(template_path: str, content: Mapping) -> bytes:
     """Return the bytes of the filled template."""
-    filler = TemplateFiller(template_path, content)
-    filler.fill_template()
-    return filler.template.get_docx()
+    return get_compiled_template(template_path).render_bytes(content)
@@ -0,0 +1,94 @@
+"""Local, deterministic extraction of the technical skills of a CV.
+
+The keywords of the technical stacks (``stacks_keywords.txt``: comma separated, some of
+them regex-escaped like ``C\\+\\+``) are compiled once into a single regular expression.
+
+>>> extract_skills("Python, C++ and SQL Server developer (C#, Spark)", r"Python, C, C\\+\\+, C\\#, SQL, SQL Server, Spark")
+'Python, C++, SQL Server, C#, Spark'
+>>> extract_skills("R&D engineer, statistics with R", "R, Spark")
+'R'
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, List, Union
+
+from smart_cv.util import pkg_defaults
+
+dflt_stacks_path = pkg_defaults / "stacks_keywords.txt"
+SKILLS_KEY = "skills"
+
+# Keywords this short (C, R, Go, QA...) are matched case-sensitively
+_CASE_SENSITIVE_MAX_LEN = 2
+
+
+def parse_stacks(stacks: Union[str, Iterable[str]]) -> List[str]:
+    """The keywords of a stacks text (or of a list of such texts), unescaped and deduplicated.
+
+    >>> parse_stacks("Python, C,, C\\\\+\\\\+, k\\\\-NN,\\n\\npython, .NET")
+    ['Python', 'C', 'C++', 'k-NN', '.NET']
+    """
+    if not isinstance(stacks, str):
+        stacks = "\n".join(stacks)
+    keywords, seen = [], set()
+    for keyword in re.split(r"[,\n]", stacks):
+        keyword = re.sub(r"\\(.)", r"\1", keyword).strip()
+        if keyword and keyword.casefold() not in seen:
+            seen.add(keyword.casefold())
+            keywords.append(keyword)
+    return keywords
+
+
+def _keyword_pattern(keyword: str) -> str:
+    pattern = r"\s+".join(re.escape(word) for word in keyword.split())
+    if len(keyword) <= _CASE_SENSITIVE_MAX_LEN:
+        return pattern
+    return f"(?i:{pattern})"
+
+
+class SkillsMatcher:
+    """Find stack keywords in a text with a single compiled regular expression.
+    Longer keywords are preferred ("SQL Server" over "SQL") and a keyword has to be a whole
+    word ("C" doesn't match in "C++" or "CSS", "R" doesn't match in "R&D")."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = list(keywords)
+        self.canonical = {k.casefold(): k for k in self.keywords}
+        by_length = sorted(self.keywords, key=len, reverse=True)
+        alternatives = "|".join(_keyword_pattern(k) for k in by_length)
+        # a cheap first-character check lets the engine skip most positions at once
+        first_chars = {c for k in self.keywords for c in (k[0].lower(), k[0].upper())}
+        first_char_class = "".join(re.escape(c) for c in sorted(first_chars))
+        self.pattern = re.compile(
+            rf"(?=[{first_char_class}])(?<![\w+#.&])(?:{alternatives})(?![\w+#&])"
+        )
+
+    def __call__(self, text: str) -> List[str]:
+        """The keywords found in the text, in order of first appearance."""
+        found, seen = [], set()
+        for match in self.pattern.finditer(text):
+            key = " ".join(match.group().split()).casefold()
+            if key not in seen:
+                seen.add(key)
+                found.append(self.canonical.get(key, match.group()))
+        return found
+
+
+@lru_cache(maxsize=16)
+def _skills_matcher(stacks: str) -> SkillsMatcher:
+    return SkillsMatcher(parse_stacks(stacks))
+
+
+def get_skills_matcher(stacks: Union[str, Iterable[str]] = None) -> SkillsMatcher:
+    """The (cached) matcher of the stacks keywords, of the package defaults if not given."""
+    if not stacks:
+        stacks = dflt_stacks_path.read_text()
+    if not isinstance(stacks, str):
+        stacks = "\n".join(stacks)
+    return _skills_matcher(stacks)
+
+
+def extract_skills(cv_text: str, stacks: Union[str, Iterable[str]] = None) -> str:
+    """The stack keywords found in the CV text, comma separated (the type of the 'skills'
+    field in the json example)."""
+    return ", ".join(get_skills_matcher(stacks)(cv_text))
@@ -1,11 +1,18 @@
 "Streamlit interface for the CV processing"
 
 # streamlit interface
+import threading
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from smart_cv import cv_content, fill_template, mall, dag_pipeline
-from raglab.retrieval.lib_alexis import extension_based_decoding
+from smart_cv.interface import render_filled_template
+from smart_cv.extraction import extract_text_cached
+from smart_cv.instrumentation import event_labels
+from dataclasses import replace
 from meshed import DAG
+from functools import partial
 from smart_cv.base import mall
+from smart_cv.json_stream import openai_stream_chat
 
 
 print("Avaible CVs in the app: ", list(mall.cvs))
@@ -28,7 +35,14 @@ language = st.sidebar.selectbox(
     "Choose the language: 'automatique' write the DT in the same language than the CV",
     ["automatique", "french", "english"],
 )
-dag = dag_pipeline["_mk_parser":"fill_template"]
+# from the cv text to the translated content (the docx is then rendered in memory):
+# the language is detected while the content is extracted. The worker threads get the
+# script context, so that the streamed fields can be shown.
+_script_ctx = get_script_run_ctx()
+dag = replace(
+    dag_pipeline[["_mk_parser", "_detect_language"]:"translated_dict_content"],
+    initializer=lambda: add_script_run_ctx(threading.current_thread(), _script_ctx),
+)
 temperature = st.sidebar.slider("Temperature", 0.0, 1.0, 0.0)
 chunk_overlap = st.sidebar.slider("Chunk overlap", 0, 300, 50)
 
@@ -36,7 +50,7 @@ if uploaded_file is not None:
     bytes_data = uploaded_file.read()
     filename = uploaded_file.name
     name_of_cv = filename.split(".")[0]
-    text = extension_based_decoding(filename, bytes_data)
+    text = extract_text_cached(filename, bytes_data)
 
     print(temperature, chunk_overlap)
     # process the CVs
@@ -45,22 +59,32 @@ if uploaded_file is not None:
             st.info("Please add your OpenAI API key to continue.")
             st.stop()
         st.write("Processing...")
-        filepath = dag(
-            text,
-            language=language,
-            cv_name=name_of_cv,
-            temperature=temperature,
-            chunk_overlap=chunk_overlap,
-            api_key=api_key,
-        )
-        print("The filled CV is saved at: ", filepath)
-        # dowload a file with given filepath
+        # show the retrieved fields as soon as they are streamed by the LLM
+        retrieved_fields = {}
+        fields_placeholder = st.empty()
+
+        def show_field(key, value):
+            retrieved_fields[key] = value
+            fields_placeholder.json(retrieved_fields)
+
+        with event_labels(cv=name_of_cv):
+            content = dag(
+                text,
+                language="automatic" if language == "automatique" else language,
+                temperature=temperature,
+                chunk_overlap=chunk_overlap,
+                api_key=api_key,
+                stream_chat=partial(openai_stream_chat, api_key=api_key),
+                on_field=show_field,
+            )
+        # rendered in memory: the file is saved to mall.filled in the background
+        docx_bytes = render_filled_template(content, name_of_cv, persist=True)
 
         save_name = name_of_cv + "_filled.docx"
         st.write(f"Download the filled CV: {save_name}")
         st.download_button(
             label="Download",
-            data=open(filepath, "rb").read(),
+            data=docx_bytes,
             file_name=save_name,
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         )
@@ -0,0 +1,128 @@
+"""Compiled docx templates, to render many CVs with the same template.
+
+A ``CompiledTemplate`` reads the template file once and keeps its bytes in memory,
+along with the template variables (the "blanks"), the patched body xml and the compiled
+jinja templates. A render starts from a new document loaded from the in-memory bytes,
+so rendering many CVs doesn't re-read the file nor re-scan and re-compile its xml.
+``get_compiled_template`` keeps one compiled template per path, recompiled when the
+file is modified.
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Mapping
+
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+
+from smart_cv.util import ensure_default_config
+
+
+class _CachingEnvironment(Environment):
+    """Jinja environment remembering the templates compiled from strings."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compiled = {}
+        self._compiled_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return super().from_string(source, globals, template_class)
+        template = self._compiled.get(source)
+        if template is None:
+            template = super().from_string(source)
+            with self._compiled_lock:
+                self._compiled[source] = template
+        return template
+
+
+class _CompiledDocxTemplate(DocxTemplate):
+    """A DocxTemplate loaded from the bytes of a CompiledTemplate, reusing its body xml."""
+
+    def __init__(self, compiled: "CompiledTemplate"):
+        super().__init__(BytesIO(compiled.pristine_bytes))
+        self.compiled = compiled
+
+    def build_xml(self, context, jinja_env=None):
+        xml = self.compiled.body_xml(self)
+        return self.render_xml_part(xml, self.docx._part, context, jinja_env)
+
+
+@dataclass
+class CompiledTemplate:
+    """A docx template read and analysed once, to be rendered many times.
+
+    >>> from smart_cv.util import pkg_defaults
+    >>> compiled = CompiledTemplate(str(pkg_defaults / "DT_Template.docx"))
+    >>> 'FullName' in compiled.blanks
+    True
+    >>> docx_bytes = compiled.render_bytes({'FullName': 'Alice'})
+    >>> docx_bytes[:2]
+    b'PK'
+    """
+
+    template_path: str
+
+    def __post_init__(self):
+        self.mtime = os.path.getmtime(self.template_path)
+        with open(self.template_path, "rb") as f:
+            self.pristine_bytes = f.read()
+        self.jinja_env = _CachingEnvironment()
+        self._body_xml = None
+        self.blanks = frozenset(
+            DocxTemplate(BytesIO(self.pristine_bytes)).get_undeclared_template_variables(
+                self.jinja_env
+            )
+        )
+
+    def is_stale(self) -> bool:
+        """True if the template file was modified since it was compiled."""
+        return os.path.getmtime(self.template_path) != self.mtime
+
+    def body_xml(self, template: DocxTemplate) -> str:
+        """The patched xml of the body, computed (from ``template``) on first use."""
+        if self._body_xml is None:
+            template.init_docx()
+            self._body_xml = template.patch_xml(template.get_xml())
+        return self._body_xml
+
+    def new_template(self) -> DocxTemplate:
+        """A new, unrendered, DocxTemplate loaded from the in-memory bytes."""
+        return _CompiledDocxTemplate(self)
+
+    def context(self, content: Mapping) -> dict:
+        """The render context: the content of every blank, "" if missing."""
+        return {label: content.get(label, "") for label in self.blanks}
+
+    def render(self, content: Mapping) -> DocxTemplate:
+        """Return a DocxTemplate rendered with ``content``."""
+        template = self.new_template()
+        template.render(self.context(content), jinja_env=self.jinja_env)
+        return template
+
+    def render_bytes(self, content: Mapping) -> bytes:
+        """Return the bytes of the docx rendered with ``content``."""
+        buffer = BytesIO()
+        self.render(content).save(buffer)
+        return buffer.getvalue()
+
+
+_compiled_templates = {}
+_compiled_templates_lock = threading.Lock()
+
+
+def get_compiled_template(template_path: str) -> CompiledTemplate:
+    """The compiled template of ``template_path``, compiled again if the file changed.
+    A default template of the configs folder is copied from the package if missing."""
+    template_path = os.path.abspath(ensure_default_config(template_path))
+    compiled = _compiled_templates.get(template_path)
+    if compiled is None or compiled.is_stale():
+        with _compiled_templates_lock:
+            compiled = _compiled_templates.get(template_path)
+            if compiled is None or compiled.is_stale():
+                compiled = CompiledTemplate(template_path)
+                _compiled_templates[template_path] = compiled
+    return compiled
@@ -0,0 +1,132 @@
+"""A local fake LLM server, to test and benchmark the async pipeline without API calls.
+
+The server answers ``POST /chat`` requests (json body ``{"prompt": ...}``) after a fixed
+latency, with canned answers depending on the kind of prompt. ``mk_http_achat`` makes an
+async chat callable requesting it (stdlib only).
+
+Usage: python -m smart_cv.tests.fake_llm_server
+"""
+
+import asyncio
+import json
+import re
+import time
+
+DFLT_HOST, DFLT_PORT = "127.0.0.1", 8765
+_translation_request = re.compile(r"json in : (\w+).*Content: (\{.*\})", re.DOTALL)
+dflt_content = {
+    "FullName": "John Doe",
+    "JobTitle": "Data engineer",
+    "skills": ["Python", "Spark"],
+    "languages": ["English", "French"],
+}
+
+
+def fake_answer(prompt: str, content: dict = None) -> str:
+    """What the fake LLM answers to a prompt of the pipeline."""
+    if prompt.startswith("Detect the language"):
+        return "english"
+    if prompt.startswith("Aggregate"):
+        return "aggregated"
+    if prompt.startswith("Translate"):
+        # the values of the numbered json, marked with the language
+        language, numbered = _translation_request.search(prompt).groups()
+        return json.dumps(
+            {k: f"{v} ({language})" for k, v in json.loads(numbered).items()}
+        )
+    return json.dumps(content or dflt_content)
+
+
+async def serve(host=DFLT_HOST, port=DFLT_PORT, *, latency: float = 0.5, content=None):
+    """Start the fake LLM server. Returns the asyncio server (use it as a context manager)."""
+    stats = {"requests": 0}
+
+    async def handle(reader, writer):
+        header = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in header.decode().split("\r\n"):
+            if line.lower().startswith("content-length:"):
+                length = int(line.split(":")[1])
+        body = json.loads(await reader.readexactly(length))
+        stats["requests"] += 1
+        await asyncio.sleep(latency)
+        answer = json.dumps({"content": fake_answer(body["prompt"], content)}).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(answer)}\r\nConnection: close\r\n\r\n".encode()
+            + answer
+        )
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    server.stats = stats
+    server.port = server.sockets[0].getsockname()[1]  # the one chosen, if port is 0
+    return server
+
+
+def mk_http_achat(host=DFLT_HOST, port=DFLT_PORT):
+    """An async chat callable requesting the fake LLM server."""
+
+    async def achat(prompt, **kwargs):
+        reader, writer = await asyncio.open_connection(host, port)
+        body = json.dumps({"prompt": prompt, **kwargs}).encode()
+        writer.write(
+            f"POST /chat HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return json.loads(response.split(b"\r\n\r\n", 1)[1])["content"]
+
+    return achat
+
+
+async def check_async_pipeline(
+    n_cvs: int = 20, latency: float = 0.5, language: str = "english", port: int = 0
+):
+    """Parse ``n_cvs`` CVs and translate their content in ``language`` through the fake
+    server, in a single event loop, and check that the requests of the CVs were
+    interleaved. Returns the translated contents."""
+    from smart_cv.async_parser import aparse_cvs, atranslate_content
+
+    cv_texts = [f"CV {i}: data engineer, Python and Spark." for i in range(n_cvs)]
+    async with await serve(port=port, latency=latency) as server:
+        achat = mk_http_achat(port=server.port)
+        tic = time.perf_counter()
+        contents = await aparse_cvs(
+            cv_texts,
+            achat=achat,
+            prompts={"FullName": "Name of the candidate"},
+            stacks="",
+            json_example="",
+            cache=False,
+        )
+        translated = await asyncio.gather(
+            *(
+                atranslate_content(
+                    content,
+                    cv_text,
+                    language,
+                    language_list=["english", "french"],
+                    achat=achat,
+                    translation_memory={},
+                )
+                for content, cv_text in zip(contents, cv_texts)
+            )
+        )
+        elapsed = time.perf_counter() - tic
+    # each CV makes at most 3 sequential requests: extraction, language detection (if
+    # the language is automatic) and translation, and the CVs are run concurrently
+    assert elapsed < 4 * latency, f"Requests were not interleaved ({elapsed:.2f}s)"
+    print(
+        f"{n_cvs} CVs, {server.stats['requests']} requests "
+        f"of {latency}s in {elapsed:.2f}s"
+    )
+    return translated
+
+
+if __name__ == "__main__":
+    asyncio.run(check_async_pipeline())
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""Import-time (cold start) benchmark of smart_cv.
+
+Runs ``python -X importtime`` in fresh processes, reports the cumulative import time of
+the statements and the heaviest imported modules, and fails (exit code 1) if a statement
+takes more than its budget. Times depend on the machine, so the tests
+(test_import_time.py) check what is imported instead: none of ``HEAVY_MODULES``.
+
+Usage:
+    python -m smart_cv.tests.import_time
+    python -m smart_cv.tests.import_time --max-ms 200 --record import_times.jsonl
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+
+# statement -> budget (in milliseconds) of its cumulative import time
+DFLT_STATEMENTS = {
+    "import smart_cv": 50,
+    "import smart_cv.extraction": 500,  # dol, config2py and i2 take most of it
+}
+
+# Slow to import dependencies, which must only be imported when they're used
+HEAVY_MODULES = (
+    "docx",
+    "docxtpl",
+    "langchain",
+    "tiktoken",
+    "streamlit",
+    "oa",
+    "reportlab",
+    "pdfplumber",
+    "pypdf",
+    "docx2python",
+    "numpy",
+    "pandas",
+)
+
+_importtime_line = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(statement: str, python: str = sys.executable) -> list:
+    """The (self_us, cumulative_us, depth, module) of every module imported by
+    ``statement`` in a fresh interpreter (from the ``-X importtime`` report).
+    The modules imported at the start of the interpreter are included."""
+    process = subprocess.run(
+        [python, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{process.stderr[-2000:]}")
+    times = []
+    for line in process.stderr.splitlines():
+        if match := _importtime_line.match(line):
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append((int(self_us), int(cumulative_us), len(indent) // 2, module))
+    return times
+
+
+def imported_modules(statement: str, python: str = sys.executable) -> set:
+    """The names of the modules imported after running ``statement`` in a fresh
+    interpreter."""
+    code = f"{statement}\nimport sys\nprint('\\n'.join(sys.modules))"
+    process = subprocess.run([python, "-c", code], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{process.stderr[-2000:]}")
+    return set(process.stdout.split())
+
+
+def heavy_imports(statement: str, heavy=HEAVY_MODULES) -> set:
+    """The heavy modules (or their submodules) imported by ``statement``."""
+    return {
+        module
+        for module in imported_modules(statement)
+        if module.split(".")[0] in heavy
+    }
+
+
+def cold_start_time(
+    statement: str, python: str = sys.executable, repeat: int = 5
+) -> float:
+    """Wall-clock time (in seconds) of running ``statement`` in a fresh interpreter,
+    minus the time of starting the interpreter (best of ``repeat`` runs)."""
+
+    def run(code):
+        tic = time.perf_counter()
+        subprocess.run([python, "-c", code], capture_output=True, check=True)
+        return time.perf_counter() - tic
+
+    best = lambda code: min(run(code) for _ in range(repeat))
+    return max(best(statement) - best("pass"), 0.0)
+
+
+def report(statement: str, n_heaviest: int = 10, cold_start: bool = True) -> dict:
+    """Measure the import time of ``statement`` (and its cold start time, if
+    ``cold_start``) and print a summary."""
+    startup_modules = {t[3] for t in import_times("pass")}
+    times = [t for t in import_times(statement) if t[3] not in startup_modules]
+    total_us = sum(cumulative for _, cumulative, depth, _ in times if depth == 0)
+    heaviest = sorted(times, reverse=True)[:n_heaviest]  # by self time
+    result = dict(
+        statement=statement,
+        import_ms=total_us / 1000,
+        cold_start_ms=cold_start_time(statement) * 1000 if cold_start else None,
+        n_modules=len(times),
+        heaviest={module: self_us / 1000 for self_us, _, _, module in heaviest},
+    )
+    print(
+        f"{statement!r}: {result['import_ms']:.1f}ms of imports "
+        f"({result['n_modules']} modules)"
+        + (f", cold start {result['cold_start_ms']:.1f}ms" if cold_start else "")
+    )
+    for module, ms in result["heaviest"].items():
+        print(f"    {ms:8.1f}ms (self)  {module}")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("statements", nargs="*", help="Python statements to time")
+    parser.add_argument("--max-ms", type=float, help="Budget of every statement")
+    parser.add_argument("--record", help="Append the results to this jsonl file")
+    args = parser.parse_args(argv)
+
+    budgets = (
+        {statement: args.max_ms for statement in args.statements}
+        if args.statements
+        else {s: args.max_ms or budget for s, budget in DFLT_STATEMENTS.items()}
+    )
+    failures = []
+    for statement, budget in budgets.items():
+        result = report(statement)
+        if budget is not None and result["import_ms"] > budget:
+            failures.append(f"{statement!r}: {result['import_ms']:.1f}ms > {budget}ms")
+        if args.record:
+            with open(args.record, "a") as f:
+                f.write(json.dumps(dict(result, time=time.time())) + "\n")
+    if failures:
+        print("Import time budget exceeded:\n  " + "\n  ".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""Tests of the deterministic merge of the contents retrieved from the chunks of a CV."""
+
+from smart_cv.resume_parser import merge_dicts
+
+# the answers to two overlapping chunks: the end of the first chunk (the ACME
+# experience, the languages) is the start of the second one, worded differently
+first_chunk = {
+    "FullName": "Jean Dupont",
+    "experiences": [
+        {
+            "title": "Data engineer",
+            "company": "Octo",
+            "dates": "2016-2019",
+            "tasks": ["Spark pipelines"],
+        },
+        {"title": "Data engineer", "company": "ACME", "dates": "2019-2023"},
+    ],
+    "languages": "English, French",
+}
+second_chunk = {
+    "FullName": "none",
+    "experiences": [
+        {
+            "title": "Senior data engineer",
+            "company": "Acme",
+            "dates": "2019 - 2023",
+            "description": "Built the data platform.",
+            "tasks": ["Kafka streams", "Airflow scheduling"],
+        },
+        {"title": "Data scientist", "company": "Criteo", "dates": "2023-2024"},
+    ],
+    "languages": "english (C1), French (native), Spanish",
+}
+
+
+def test_overlapping_chunks_are_merged_without_duplicates():
+    merged, conflicts = merge_dicts(first_chunk, second_chunk)
+    assert conflicts == []
+    assert merged["FullName"] == "Jean Dupont"
+    assert [e["company"] for e in merged["experiences"]] == ["Octo", "Acme", "Criteo"]
+    acme = merged["experiences"][1]
+    assert acme["title"] == "Senior data engineer"  # the richer of the two records
+    assert acme["tasks"] == ["Kafka streams", "Airflow scheduling"]
+    assert acme["description"] == "Built the data platform."
+    assert merged["languages"] == "english (C1), French (native), Spanish"
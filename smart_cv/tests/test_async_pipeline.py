@@ -0,0 +1,24 @@
+"""Tests of the async pipeline, against the local fake LLM server."""
+
+import asyncio
+
+from smart_cv.tests.fake_llm_server import check_async_pipeline, dflt_content
+
+
+def test_async_pipeline_interleaves_the_cvs():
+    translated = asyncio.run(check_async_pipeline(n_cvs=10, latency=0.1))
+    assert translated == [dflt_content] * 10
+
+
+def test_async_pipeline_translates_the_values():
+    translated = asyncio.run(
+        check_async_pipeline(n_cvs=5, latency=0.1, language="french")
+    )
+    assert translated == [
+        {
+            "FullName": "John Doe (french)",
+            "JobTitle": "Data engineer (french)",
+            "skills": ["Python", "Spark"],  # stack keywords aren't translated
+            "languages": ["English (french)", "French (french)"],
+        }
+    ] * 5
@@ -0,0 +1,12 @@
+"""Regression test of the import time (cold start) of smart_cv: the heavy dependencies
+must not be imported by the package and its light modules."""
+
+import pytest
+
+from smart_cv.tests.import_time import DFLT_STATEMENTS, heavy_imports
+
+
+@pytest.mark.parametrize("statement", DFLT_STATEMENTS)
+def test_import_does_not_load_heavy_modules(statement):
+    heavy = heavy_imports(statement)
+    assert not heavy, f"{statement!r} imports heavy modules: {sorted(heavy)}"
@@ -0,0 +1,84 @@
+"""Tests of the retrieval of the parts of a CV relevant to each field (top_k)."""
+
+import ast
+import json
+import re
+
+from smart_cv.resume_parser import ContentRetriever
+
+experiences = "\n\n".join(
+    f"Project {i}: worked with the team on the data platform of client {i}, "
+    f"building pipelines and dashboards, then maintaining them in production."
+    for i in range(12)
+)
+cv_text = (
+    f"Name: Jean Dupont\nData engineer\n\n{experiences}\n\n"
+    "Languages: English (C1), French (native)\n\n"
+    "Certifications: AWS Solutions Architect"
+)
+prompts = {
+    "FullName": "Full name of the candidate",
+    "languages": "Languages spoken by the candidate",
+    "certifications": "Certifications of the candidate",
+}
+evidence = {
+    "FullName": "Jean Dupont",
+    "languages": "English (C1), French (native)",
+    "certifications": "AWS Solutions Architect",
+}
+_asked_keys = re.compile(r"Json : (\{.*?\})\n")
+
+
+def mk_achat(requests: list):
+    """A fake LLM answering the asked keys whose evidence is in the given resume."""
+
+    async def achat(prompt, **kwargs):
+        keys = ast.literal_eval(_asked_keys.search(prompt).group(1))
+        resume = prompt.split("Here is the resume you have to base on:")[1]
+        requests.append((list(keys), resume))
+        return json.dumps(
+            {k: evidence[k] if evidence[k] in resume else "none" for k in keys}
+        )
+
+    return achat
+
+
+def retriever_context_window(chunk_tokens: int = 150) -> int:
+    """A context window leaving chunk_tokens for the CV in the requests."""
+    probe = ContentRetriever(
+        cv_text="", prompts=prompts, stacks="", json_example="", cache=False
+    )
+    return probe.prompt_tokens + 100 + chunk_tokens
+
+
+def test_fields_get_their_evidence_outside_the_top_chunk():
+    requests = []
+    retriever = ContentRetriever(
+        cv_text=cv_text,
+        prompts=prompts,
+        stacks="",
+        json_example="",
+        cache=False,
+        achat=mk_achat(requests),
+        top_k=2,
+        retrieval_segment_tokens=30,
+        field_groups={
+            "identity": ["FullName"],
+            "education": ["languages", "certifications"],
+        },
+        context_window=retriever_context_window(),
+        max_completion_tokens=100,
+    )
+    chunks = list(retriever.db.segments)
+    assert len(chunks) > 2  # the CV doesn't fit in a request
+    first_chunk = retriever.db.segments[chunks[0]]
+    assert evidence["languages"] not in first_chunk
+
+    assert retriever() == evidence
+    # one request per group, with less than the whole CV
+    assert sorted(keys for keys, _ in requests) == [
+        ["FullName"],
+        ["languages", "certifications"],
+    ]
+    assert all(len(resume) < len(cv_text) for _, resume in requests)
+
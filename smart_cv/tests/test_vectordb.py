@@ -0,0 +1,29 @@
+"""Tests of the ChunkDB vector store."""
+
+from smart_cv.VectorDB import ChunkDB
+
+docs = {
+    "alice": "Alice is a data engineer. She builds Spark pipelines and Kafka streams.",
+    "bob": "Bob is a frontend developer. He writes React and TypeScript applications.",
+}
+
+
+def test_saved_docs_support_deletion(tmp_path):
+    ChunkDB(dict(docs), chunk_size=40, chunk_overlap=0).save(str(tmp_path))
+    loaded = ChunkDB.load(str(tmp_path)).segments.docs
+    del loaded["alice"]
+    assert "alice" not in loaded and list(loaded) == ["bob"] and len(loaded) == 1
+    loaded["alice"] = "Alice again"
+    assert loaded["alice"] == "Alice again" and len(loaded) == 2
+    loaded["carol"] = "Carol"
+    del loaded["carol"]
+    assert sorted(loaded) == ["alice", "bob"]
+
+
+def test_add_does_not_modify_the_given_docs():
+    given = dict(docs)
+    db = ChunkDB(given, chunk_size=40, chunk_overlap=0)
+    db.add({"carol": "Carol is a data scientist. She trains models in PyTorch."})
+    assert given == docs
+    assert "carol" in db.segments and "carol" in db.docs
+    assert any(key[0] == "carol" for key in db.search("PyTorch models", k=2))
@@ -0,0 +1,109 @@
+"""Token counting with the tiktoken encoding of the chat model."""
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache, cached_property
+from typing import List, Tuple
+import tiktoken
+
+DFLT_MODEL = "gpt-3.5-turbo"
+DFLT_ENCODING = "cl100k_base"
+DFLT_CONTEXT_WINDOW = 4000
+# Tokens of the context window reserved for the (json) answer of the model
+DFLT_MAX_COMPLETION_TOKENS = 1000
+# Tokens of the (paragraph sized) segments searched for the parts of a CV relevant to a
+# field, when only those are sent (see ContentRetriever.top_k)
+DFLT_RETRIEVAL_SEGMENT_TOKENS = 100
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = DFLT_MODEL):
+    """The tiktoken encoding of the model (built once per model)."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DFLT_ENCODING)
+
+
+def num_tokens(text: str, model: str = DFLT_MODEL) -> int:
+    """Number of tokens of the text for the given model."""
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=256)
+def num_prompt_tokens(prompt: str, model: str = DFLT_MODEL) -> int:
+    """num_tokens, memoized: the same prompts are counted for every CV."""
+    return num_tokens(prompt, model)
+
+
+@dataclass
+class TokenizedText:
+    """A text encoded once, with the character offset of each token, so that counting and
+    splitting the text in token-sized chunks don't encode it again."""
+
+    text: str
+    model: str = DFLT_MODEL
+
+    @cached_property
+    def tokens(self) -> List[int]:
+        return get_encoding(self.model).encode(self.text, disallowed_special=())
+
+    @cached_property
+    def offsets(self) -> List[int]:
+        """Character offset of the start of each token in the text."""
+        _, offsets = get_encoding(self.model).decode_with_offsets(self.tokens)
+        return offsets
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def char_index(self, token_index: int) -> int:
+        """Character offset of the token of index token_index (the text length at the end)."""
+        if token_index >= len(self.tokens):
+            return len(self.text)
+        return self.offsets[token_index]
+
+    def split_points(
+        self, chunk_size: int, chunk_overlap: int = 0, separators=("\n\n", "\n", " ")
+    ) -> List[Tuple[int, int]]:
+        """Token (start, end) indices of chunks of at most chunk_size tokens, overlapping by
+        chunk_overlap tokens. A chunk is cut at the last separator of its second half if any
+        (trying separators in order), else at chunk_size tokens."""
+        n = len(self.tokens)
+        chunk_overlap = min(chunk_overlap, chunk_size - 1)
+        points, start = [], 0
+        while start < n:
+            end = min(start + chunk_size, n)
+            if end < n:
+                lo, hi = self.char_index(start + chunk_size // 2), self.char_index(end)
+                for sep in separators:
+                    cut = self.text.rfind(sep, lo, hi)
+                    if cut != -1:
+                        end = max(bisect_right(self.offsets, cut + len(sep) - 1), start + 1)
+                        break
+            points.append((start, end))
+            if end >= n:
+                break
+            start = max(end - chunk_overlap, start + 1)
+        return points
+
+
+def chunk_token_budget(
+    context_window: int,
+    prompt_tokens: int,
+    max_completion_tokens: int = DFLT_MAX_COMPLETION_TOKENS,
+) -> int:
+    """Number of tokens of the resume that fit in a request along with the prompt, leaving
+    max_completion_tokens for the answer.
+
+    >>> chunk_token_budget(4000, 1500)
+    1500
+    >>> chunk_token_budget(4000, 1500, max_completion_tokens=0)
+    2500
+    """
+    budget = context_window - prompt_tokens - max_completion_tokens
+    assert budget > 0, (
+        f"The prompt is too long: limit is {context_window} tokens, prompt is "
+        f"{prompt_tokens} tokens and {max_completion_tokens} are reserved for the answer"
+    )
+    return budget
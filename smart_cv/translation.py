@@ -0,0 +1,206 @@
+"""Field-level translation of the retrieved content, with a translation memory.
+
+Instead of translating the whole content at once, the string values are translated one
+by one: values needing no translation (numbers, dates, urls, stack keywords...) are
+skipped, repeated values are translated once, values already translated (for this or
+another CV) are taken from a persistent translation memory, and the remaining ones are
+sent in batches of bounded size. The memory holds CV contents: its on-disk tier follows
+``smart_cv.cache.set_disk_persistence``.
+
+>>> def chat(prompt, **kwargs):
+...     return '{"0": "Ingénieur de données"}'
+>>> content = {"JobTitle": "Data engineer", "dates": "2019-2023", "skills": ["Python", "Spark"]}
+>>> translate_values(content, "french", chat=chat, memory={})
+{'JobTitle': 'Ingénieur de données', 'dates': '2019-2023', 'skills': ['Python', 'Spark']}
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+from typing import Callable, Dict, Iterable, List, MutableMapping
+
+from smart_cv.cache import TieredCache, LRUCache, AppDiskCache
+from smart_cv.json_stream import parse_json_answer
+from smart_cv.skills import get_skills_matcher
+from smart_cv.tokens import num_tokens
+from smart_cv.util import run_sync, to_async, translation_memory_dir
+
+DFLT_MAX_BATCH_TOKENS = 1500
+
+_no_letters_pattern = re.compile(r"^[\W\d_]*$")
+_url_or_email_pattern = re.compile(r"^(https?://|www\.)\S+$|^[\w.+-]+@[\w-]+\.[\w.-]+$")
+_separators_pattern = re.compile(r"[\s,;/&|()\-+.]+")
+
+
+def needs_translation(text: str, skills_matcher=None) -> bool:
+    """Tell if a value has to be translated: not a number or date, an url or email, the
+    'none' label or made of stack keywords only.
+
+    >>> [needs_translation(t) for t in ["Data engineer", "2019-2023", "none", "www.a.com", "Python, Spark"]]
+    [True, False, False, False, False]
+    """
+    text = text.strip()
+    if not text or text.lower() == "none" or _no_letters_pattern.match(text):
+        return False
+    if _url_or_email_pattern.match(text):
+        return False
+    skills_matcher = skills_matcher or get_skills_matcher()
+    without_keywords = skills_matcher.pattern.sub("", text)
+    return bool(_separators_pattern.sub("", without_keywords))
+
+
+def string_values(content) -> Iterable[str]:
+    """All the string values of a (nested) content."""
+    if isinstance(content, str):
+        yield content
+    elif isinstance(content, dict):
+        for v in content.values():
+            yield from string_values(v)
+    elif isinstance(content, list):
+        for v in content:
+            yield from string_values(v)
+
+
+def apply_translations(content, translations: Dict[str, str]):
+    """A copy of the content with its string values replaced by their translation."""
+    if isinstance(content, str):
+        return translations.get(content, content)
+    if isinstance(content, dict):
+        return {k: apply_translations(v, translations) for k, v in content.items()}
+    if isinstance(content, list):
+        return [apply_translations(v, translations) for v in content]
+    return content
+
+
+def memory_key(text: str, language: str) -> str:
+    """Key of a translation in the translation memory."""
+    return hashlib.sha256(f"{language.lower()}\0{text}".encode("utf-8")).hexdigest()
+
+
+_dflt_translation_memory = None
+
+
+def get_dflt_translation_memory() -> TieredCache:
+    """The translation memory shared by the whole app, persisted in translation_memory_dir
+    (unless the disk persistence is off). Failing writes are logged, not raised."""
+    global _dflt_translation_memory
+    if _dflt_translation_memory is None:
+        _dflt_translation_memory = TieredCache(
+            LRUCache(maxsize=10_000), AppDiskCache(translation_memory_dir)
+        )
+    return _dflt_translation_memory
+
+
+def translation_batches(
+    texts: List[str], max_batch_tokens: int = DFLT_MAX_BATCH_TOKENS
+) -> List[List[str]]:
+    """Group the texts in batches of at most max_batch_tokens tokens (a longer text makes
+    a batch on its own)."""
+    batches, batch, batch_tokens = [], [], 0
+    for text in texts:
+        text_tokens = num_tokens(text)
+        if batch and batch_tokens + text_tokens > max_batch_tokens:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += text_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_translation_prompt(batch: List[str], language: str) -> str:
+    numbered = json.dumps({str(i): text for i, text in enumerate(batch)}, ensure_ascii=False)
+    return f"""Translate the values of the following json in : {language}
+                Keep the keys as they are and translate the values. Return the translated json.
+                Keep proper nouns, company names and technical terms as they are.
+                Keep json format (double quotes).
+                Content: {numbered} """
+
+
+def parse_batch_translation(answer: str, batch: List[str]) -> Dict[str, str]:
+    """The translations of the batch, from the answer of the LLM. Values missing from the
+    answer are left untranslated."""
+    try:
+        translated = parse_json_answer(answer)
+    except json.JSONDecodeError:
+        return {}
+    return {
+        text: translated[str(i)]
+        for i, text in enumerate(batch)
+        if isinstance(translated.get(str(i)), str)
+    }
+
+
+def record_translations(
+    batches: List[List[str]], answers: List[str], language: str, memory: MutableMapping
+) -> Dict[str, str]:
+    """Parse the answers to the batches and store the translations in memory."""
+    translations = {}
+    for batch, answer in zip(batches, answers):
+        for text, translation in parse_batch_translation(answer, batch).items():
+            memory[memory_key(text, language)] = translation
+            translations[text] = translation
+    return translations
+
+
+def plan_translation(content, language: str, memory: MutableMapping):
+    """The translations already in memory and the batches of values left to translate."""
+    skills_matcher = get_skills_matcher()
+    translations, to_translate = {}, []
+    for text in dict.fromkeys(string_values(content)):  # unique values, in order
+        if not needs_translation(text, skills_matcher):
+            continue
+        try:
+            translations[text] = memory[memory_key(text, language)]
+        except KeyError:
+            to_translate.append(text)
+    return translations, to_translate
+
+
+async def atranslate_values(
+    content,
+    language: str,
+    *,
+    achat: Callable,
+    memory: MutableMapping = None,
+    max_batch_tokens: int = DFLT_MAX_BATCH_TOKENS,
+    max_workers: int = 4,
+):
+    """Translate the string values of the content in the given language (see module doc),
+    with an async chat. At most ``max_workers`` batches are translated at the same time."""
+    memory = get_dflt_translation_memory() if memory is None else memory
+    translations, to_translate = plan_translation(content, language, memory)
+    batches = translation_batches(to_translate, max_batch_tokens)
+    semaphore = asyncio.Semaphore(max(max_workers, 1))
+
+    async def translate_batch(batch):
+        async with semaphore:
+            return await achat(batch_translation_prompt(batch, language))
+
+    answers = await asyncio.gather(*map(translate_batch, batches))
+    translations.update(record_translations(batches, answers, language, memory))
+    return apply_translations(content, translations)
+
+
+def translate_values(
+    content,
+    language: str,
+    *,
+    chat: Callable,
+    memory: MutableMapping = None,
+    max_batch_tokens: int = DFLT_MAX_BATCH_TOKENS,
+    max_workers: int = 4,
+):
+    """Sync atranslate_values, with a sync chat (called in threads)."""
+    return run_sync(
+        atranslate_values(
+            content,
+            language,
+            achat=to_async(chat),
+            memory=memory,
+            max_batch_tokens=max_batch_tokens,
+            max_workers=max_workers,
+        )
+    )
@@ -1,7 +1,12 @@
 """Utils for smart_cv"""
 
+import asyncio
+import os
 from importlib.resources import files
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, Iterable, List
 from i2 import AttributeMutableMapping
 from config2py import (
     get_app_data_folder,
@@ -29,6 +34,28 @@ configs_dir = app_filepath("configs")
 dt_template_dir = configs_dir + "/DT_Template.docx"
 app_config_path = configs_dir + "/config.json"
 filled_dir = app_filepath("data/filled")
+# The directories of the caches are only created when the caches are first used
+app_path = partial(process_path, rootdir=app_dir)
+llm_cache_dir = app_path("llm_cache")
+translation_memory_dir = app_path("translation_memory")
+checkpoints_dir = app_path("checkpoints")
+text_cache_dir = app_path("text_cache")
+
+
+def ensure_default_config(path: str) -> str:
+    """Copy the package default of a file of the configs folder if it's missing, and
+    return its path. (The configs folder is populated when the mall is made, but files
+    like the template can be read before that.)"""
+    if not os.path.exists(path) and os.path.dirname(
+        os.path.abspath(path)
+    ) == os.path.abspath(configs_dir):
+        default = pkg_defaults / os.path.basename(path)
+        if default.is_file():
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(default.read_bytes())
+            os.replace(tmp_path, path)  # atomic: never read half written
+    return path
 
 
 # def copy_if_missing(src, dest):
@@ -38,6 +65,56 @@ filled_dir = app_filepath("data/filled")
 #                 f.write(f2.read())
 
 
+# -----------------------------------------------------------
+# Concurrency
+
+
+def concurrent_map(func: Callable, items: Iterable, max_workers: int = 1) -> List:
+    """Apply ``func`` to every item, running up to ``max_workers`` calls at once.
+    Results are returned in the order of ``items``. With ``max_workers <= 1`` the calls
+    are made sequentially in the current thread. The calls run in copies of the current
+    context (so context variables, like event labels, are seen in the threads).
+
+    >>> concurrent_map(lambda x: x * 2, [1, 2, 3], max_workers=2)
+    [2, 4, 6]
+    """
+    items = list(items)
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    contexts = [copy_context() for _ in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(
+            executor.map(lambda ctx, item: ctx.run(func, item), contexts, items)
+        )
+
+
+def to_async(func: Callable) -> Callable:
+    """Make an async function from a sync one (run in a thread, so it doesn't block the
+    event loop), e.g. to use a sync chat where an async one is expected."""
+
+    async def async_func(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    return async_func
+
+
+def run_sync(coro):
+    """Run a coroutine to completion from sync code, even if an event loop is already
+    running in this thread (e.g. in a notebook), in which case it runs in another thread.
+
+    >>> async def double(x):
+    ...     return x * 2
+    >>> run_sync(double(2))
+    4
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(copy_context().run, asyncio.run, coro).result()
+
+
 # -----------------------------------------------------------
 
 